@@ -5,11 +5,13 @@ import random
 import timeit
 
 from absl import app
+import numpy as np
 
 from src.lib import circuit
 from src.lib import helper
 from src.lib import ops
 from src.lib import state
+from src.lib import tensor
 
 
 def operator_order():
@@ -315,11 +317,56 @@ def time_series_qc(limit):
                   timeit.timeit(bench, number=1)))
 
 
+def subclass_overhead():
+  """Compare math on Tensor subclass objects vs. raw numpy buffers."""
+
+  # Each numpy operation on a Tensor (or State, Operator) goes through
+  # subclass dispatch and __array_finalize__, for the result and for
+  # every temporary. For small states and operators this overhead
+  # dominates. The library engines therefore compute on raw buffers
+  # via np.asarray() and only wrap the final result.
+  #
+  number = 20000
+  psi = state.State(np.random.random(16) + 0j)
+  raw = np.asarray(psi)
+  op = ops.Hadamard()
+  raw_op = np.asarray(op)
+
+  def norm_subclass():
+    dprod = np.conj(psi) @ psi
+    return psi / np.sqrt(np.real(dprod))
+
+  def norm_raw():
+    return raw / np.sqrt(np.real(np.vdot(raw, raw)))
+
+  def kron_subclass():
+    return ops.Operator(np.kron(op, op))
+
+  def kron_raw():
+    return ops.Operator(tensor.kron(raw_op, raw_op))
+
+  def close_subclass():
+    return np.allclose(psi, psi, atol=1e-6)
+
+  def close_raw():
+    return psi.is_close(psi)
+
+  for desc, f_sub, f_raw in [('normalize', norm_subclass, norm_raw),
+                             ('kron     ', kron_subclass, kron_raw),
+                             ('is_close ', close_subclass, close_raw)]:
+    t_sub = timeit.timeit(f_sub, number=number)
+    t_raw = timeit.timeit(f_raw, number=number)
+    print('{}: subclass: {:6.2f} us, raw: {:6.2f} us, speedup: {:4.1f}x'
+          .format(desc, t_sub / number * 1e6, t_raw / number * 1e6,
+                  t_sub / t_raw))
+
+
 def main(argv):
   if len(argv) > 1:
     raise app.UsageError('Too many command-line arguments.')
 
   operator_order()
+  subclass_overhead()
   operator_complexity()
   operator_per_state()
   hipster_single()
@@ -25,7 +25,8 @@ from src.lib import state
 # In quantum, the answer can be found in just 1 query.
 #
 # This code shows two ways to achieve this results, one with
-# an explicit Uf construction, one using the Deutsch OracleUf.
+# an explicit Uf construction, one using a permutation oracle,
+# which applies the Deutsch Oracle Uf as a gather on the state.
 #
 
 
@@ -77,7 +78,7 @@ def make_u(nbits: int, constant_c: Tuple[bool]) -> ops.Operator:
       #   op = (ops.Identity(idx) * ops.PauliZ() *
       #         ops.Identity(nbits - 1 - idx))  @ op
 
-  if not op.is_unitary():
+  if not op.validate_unitary():
     raise AssertionError('Constructed non-unitary operator.')
   return op
 
@@ -116,7 +117,7 @@ def run_oracle_experiment(nbits: int) -> None:
 
   c = make_c(nbits-1)
   f = make_oracle_f(c)
-  u = ops.OracleUf(nbits, f)
+  u = ops.PermutationOracle(nbits, f, vectorized=True)
 
   psi = state.zeros(nbits-1) * state.ones(1)
   psi = ops.Hadamard(nbits)(psi)
@@ -8,6 +8,7 @@ from typing import Callable
 from absl import app
 import numpy as np
 
+from src.lib import circuit
 from src.lib import helper
 from src.lib import ops
 from src.lib import state
@@ -60,12 +61,8 @@ def run_experiment(nbits_phase: int, nbits_grover: int,
 
   # Building the Grover operator, see grover.py
   n = 2**nbits_grover
-  zero_projector = np.zeros((n, n))
-  zero_projector[0, 0] = 1
-  op_zero = ops.Operator(zero_projector)
-
   f = make_f(nbits_grover, solutions)
-  u = ops.OracleUf(nbits_grover + 1, f)
+  grover = ops.Grover(nbits_grover, f, vectorized=True)
 
   # The state for the counting algorithm.
   # We reserve nbits for the phase estimation.
@@ -74,32 +71,27 @@ def run_experiment(nbits_phase: int, nbits_grover: int,
   # accuracy. Yet, this keeps the code a little bit simpler,
   # while trading off a few off-by-1 estimation errors.
   #
-  # We also add the |1> for the oracle.
+  # The matrix-free Grover operator flips the phase of the marked
+  # states directly, so we don't need the |1> ancilla for the oracle.
   #
-  psi = (state.zeros(nbits_phase) * state.zeros(nbits_grover) * state.ones(1))
+  psi = state.zeros(nbits_phase) * state.zeros(nbits_grover)
 
-  # Apply Hadamard to all the qubits.
-  for i in range(nbits_phase + nbits_grover + 1):
+  # Apply Hadamard to the qubits of the Grover register.
+  for i in range(nbits_phase, nbits_phase + nbits_grover):
     psi.apply1(ops.Hadamard(), i)
 
-  # Construct the Grover operator.
-  reflection = op_zero * 2.0 - ops.Identity(nbits_grover)
-  hn = ops.Hadamard(nbits_grover)
-  inversion = hn(reflection(hn)) * ops.Identity()
-  grover = inversion(u)
-
   # Now that we have the Grover operator, we have to perform
-  # phase estimation. This loop is a copy from phase_estimation.py
-  # with more comments there.
+  # phase estimation, see phase_estimation.py with more comments there.
+  # Instead of squaring the Grover matrix and building a dense
+  # controlled operator, the matrix-free Grover operator applies
+  # the Grover iteration 2^idx times to the half of the state where
+  # the control qubit is |1>.
+  #
+  # The phase estimation also applies the Hadamards to the phase
+  # register and the reverse QFT, which gives us the phase as a
+  # fraction of 2*pi.
   #
-  for idx, inv in enumerate(range(nbits_phase - 1, -1, -1)):
-    u2 = grover
-    for _ in range(idx):
-      u2 = u2(u2)
-    psi = ops.ControlledU(inv, nbits_phase, u2)(psi, inv)
-
-  # Reverse QFT gives us the phase as a fraction of 2*pi.
-  psi = ops.Qft(nbits_phase).adjoint()(psi)
+  psi = circuit.phase_estimation(psi, grover, nbits_phase)
 
   # Get the state with highest probability and compute the phase
   # as a binary fraction. Note that the probability increases
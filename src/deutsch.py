@@ -87,7 +87,7 @@ def make_uf(f: Callable[[int], int]) -> ops.Operator:
     u[col][x + xor] = 1.0
 
   op = ops.Operator(u)
-  if not op.is_unitary():
+  if not op.validate_unitary():
     raise AssertionError('Produced non-unitary operator.')
   return op
 
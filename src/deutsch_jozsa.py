@@ -45,7 +45,7 @@ def run_experiment(nbits: int, flavor: int):
   """Run full experiment for a given flavor of f()."""
 
   f = make_f(nbits-1, flavor)
-  u = ops.OracleUf(nbits, f)
+  u = ops.PermutationOracle(nbits, f, vectorized=True)
 
   psi = (ops.Hadamard(nbits-1)(state.zeros(nbits-1)) *
          ops.Hadamard()(state.ones(1)))
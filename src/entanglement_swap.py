@@ -75,9 +75,11 @@ def main(argv):
            [1, 0, 1, 1, 1.0, 1, 0, -1.0]]
 
   c07 = 1/math.sqrt(2)
+  # Note that measure_bit() collapses the state in place, hence
+  # each case starts from a copy of the original state.
   psi = qc.psi
   for c in cases:
-    qc.psi = psi
+    qc.psi = psi.copy()
 
     qc.measure_bit(0, c[0], collapse=True)
     qc.measure_bit(3, c[3], collapse=True)
@@ -74,39 +74,31 @@ def run_experiment(nbits, solutions) -> None:
   # for every vector element c_x, with u being the mean over the
   # state vector. This is the defintion of inversion about the mean.
   #
-  zero_projector = np.zeros((2**nbits, 2**nbits))
-  zero_projector[0, 0] = 1
-  op_zero = ops.Operator(zero_projector)
-
-  # Make f and Uf. Note:
-  # We reserve space for an ancilla 'y', which is unused in
-  # Grover's algorithm. This allows reuse of the Deutsch Uf builder.
+  # Multiplying the state with this matrix, however, takes O(4^n)
+  # operations. Since the computation is that simple, we don't build
+  # the matrix and compute 2u - c_x directly, in O(2^n), in the
+  # matrix-free ops.Grover operator.
+  #
+  # Make f and the Grover operator. The Grover operator is the
+  # combination of:
+  #    - phase inversion of the states with f(x) = 1
+  #    - inversion about the mean (see matrix above)
   #
-  # We use the Oracle construction for convenience. It is rather
-  # slow (full matrix) for larger qubit counts. Once can construct
-  # a 'regular' function for the grover search algorithms, but this
-  # function is different for each bitstring and that quickly gets
-  # confusing.
+  # The phase inversion is the result of applying the Deutsch Oracle Uf
+  # with an ancilla in state |1> after a Hadamard (see deutsch.py). This
+  # phase kickback only multiplies the marked states by -1, which is
+  # what ops.Grover does directly, without the ancilla and without
+  # building Uf.
   #
   f = make_f(nbits, solutions)
-  uf = ops.OracleUf(nbits+1, f)
+  grover = ops.Grover(nbits, f, vectorized=True)
 
-  # Build state with 1 ancilla of |1>.
+  # Build the equal superposition state.
   #
-  psi = state.zeros(nbits) * state.ones(1)
-  for i in range(nbits + 1):
+  psi = state.zeros(nbits)
+  for i in range(nbits):
     psi.apply1(ops.Hadamard(), i)
 
-  # Build Grover operator, note Id() for the ancilla.
-  # The Grover operator is the combination of:
-  #    - phase inversion via the u unitary
-  #    - inversion about the mean (see matrix above)
-  #
-  hn = ops.Hadamard(nbits)
-  reflection = op_zero * 2.0 - ops.Identity(nbits)
-  inversion = hn(reflection(hn)) * ops.Identity()
-  grover = inversion(uf)
-
   # Number of Grover iterations
   #
   # There are at least 2 ways to compute the required number of iterations.
@@ -128,19 +120,14 @@ def run_experiment(nbits, solutions) -> None:
   #
   iterations = int(math.pi / 4 * math.sqrt(2**nbits / solutions))
 
-  for _ in range(iterations):
-    psi = grover(psi)
+  psi = grover(psi, iterations=iterations)
 
   # Measurement - pick element with higher probability.
   #
-  # Note: We constructed the Oracle with n+1 qubits, to allow
-  # for the 'xor-ancillary'. To check the result, we need to
-  # ignore this ancilla.
-  #
   maxbits, maxprob = psi.maxprob()
-  result = f(maxbits[:-1])
+  result = f(list(maxbits))
   print('Got f({}) = {}, want: 1, #: {:2d}, p: {:6.4f}'
-        .format(maxbits[:-1], result, solutions, maxprob))
+        .format(maxbits, result, solutions, maxprob))
   if result != 1:
     raise AssertionError('something went wrong, measured invalid state')
 
@@ -149,7 +136,7 @@ def main(argv):
   if len(argv) > 1:
     raise app.UsageError('Too many command-line arguments.')
 
-  for nbits in range(3, 8):
+  for nbits in range(3, 13):
     run_experiment(nbits, 1)
 
   for solutions in range(1, 9):
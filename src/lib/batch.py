@@ -0,0 +1,182 @@
+# python3
+"""Simulate a circuit on a batch of states at once."""
+
+from typing import Dict
+
+import numpy as np
+
+from src.lib import circuit
+from src.lib import ir
+from src.lib import pauli
+from src.lib import state
+from src.lib import tensor
+
+# Small circuits, eg., the 1- and 2-qubit ansatzes of VQE, spend most
+# of their time in Python, in dispatching gates, not in the kernels.
+# Instead of running such a circuit many times, eg., for a sweep over
+# parameters or for many input states, we run it once on a batch.
+#
+# A batch is a (batch, 2^n) array, with one state per row. A gate is
+# applied to all rows in one kernel, via strided views with the batch
+# as an additional, leading axis:
+#
+#    psi.reshape(batch, 2, 2, ..., 2)
+#
+# Gates of parameterized rotations may differ per row, for example,
+# rx(theta) with a different theta for each row. Their matrix elements
+# are arrays of shape (batch, 1, ..., 1), which broadcast against the
+# amplitudes of each row (see circuit.apply_pair()).
+
+
+def rotation_rows(name: str, theta: np.ndarray) -> np.ndarray:
+  """Elements of a rotation for each angle, shape (4, batch)."""
+
+  # As circuit.rotation(), for an array of angles.
+  c = np.cos(theta / 2)
+  s = np.sin(theta / 2)
+  zero = np.zeros_like(theta)
+  if name in ('u1', 'cu1'):
+    rows = [zero + 1, zero, zero, np.exp(1j * theta)]
+  elif name == 'rx':
+    rows = [c, -1j * s, -1j * s, c]
+  elif name == 'ry':
+    rows = [c, -s, s, c]
+  elif name == 'rz':
+    rows = [c - 1j * s, zero, zero, c + 1j * s]
+  else:
+    raise ValueError(f'Not a parameterized rotation: {name}')
+  return np.array(rows, dtype=tensor.tensor_type())
+
+
+class Batch:
+  """A batch of states, as (batch, 2^n) array."""
+
+  def __init__(self, psi: np.ndarray, size: int = None):
+    # psi is either a (batch, 2^n) array of states, or a single state,
+    # which is copied to all 'size' rows.
+    psi = np.asarray(psi, dtype=tensor.tensor_type())
+    if psi.ndim == 1:
+      psi = np.tile(psi, (size, 1))
+    elif size is not None and size != psi.shape[0]:
+      raise ValueError('Batch size and states do not match.')
+    self.psi = np.ascontiguousarray(psi)
+    self.nbits = int(psi.shape[1]).bit_length() - 1
+
+  @property
+  def size(self) -> int:
+    return self.psi.shape[0]
+
+  def __len__(self):
+    return self.size
+
+  def __getitem__(self, idx: int) -> state.State:
+    return state.State(self.psi[idx])
+
+  def apply(self, gate: np.ndarray, ctls, by_0, target: int,
+            kind: int = circuit.KERNEL_GENERAL) -> None:
+    """Apply a (controlled) gate to all states, gate of shape (4, ...)."""
+
+    # Controls are by |0> where by_0 is set. A gate of shape (4, batch)
+    # holds the gate elements for each row.
+    psi_t = self.psi.reshape([self.size] + [2] * self.nbits)
+    sel = [slice(None)] * (self.nbits + 1)
+    for ctl, flip in zip(ctls, by_0):
+      sel[ctl + 1] = slice(0, 1) if flip else slice(1, 2)
+    sel[target + 1] = slice(0, 1)
+    psi0 = psi_t[tuple(sel)]
+    sel[target + 1] = slice(1, 2)
+    psi1 = psi_t[tuple(sel)]
+    if gate.ndim > 1:
+      gate = gate.reshape((4, self.size) + (1,) * self.nbits)
+    circuit.apply_pair(psi0, psi1, gate, kind)
+
+  def run(self, qc: circuit.qc, values: Dict = None,
+          inverse: bool = False) -> None:
+    """Run qc (or its inverse) on all states, values per row."""
+
+    # values maps parameters to an array of values, one per row, or to
+    # a single value for all rows. Parameters without values keep the
+    # value bound to the circuit. As for qc.bind(), values may also be
+    # a list, in the order of qc.parameters.
+    program = qc.compile()
+    if inverse:
+      program = program.inverse()
+    if values is None:
+      values = {}
+    if not isinstance(values, dict):
+      values = dict(zip(qc.parameters, values))
+
+    # Per-row gates, the adjoint of a rotation is the rotation by
+    # the negated angle.
+    rows = {}
+    for gate_id, (param, name, adjoint) in qc.ir.params.items():
+      if param not in values:
+        continue
+      theta = np.broadcast_to(np.asarray(values[param], dtype=np.float64),
+                              (self.size,))
+      if adjoint != inverse:
+        theta = -theta
+      rows[gate_id] = rotation_rows(name, theta)
+
+    single = ir.Op.SINGLE.value
+    ctl = ir.Op.CTL.value
+    for op, gate_id, a, b, c in program.instrs:
+      gate = rows.get(gate_id)
+      if gate is None:
+        gate = program.gates[gate_id]
+      kind = program.kinds[gate_id]
+      if op == single:
+        self.apply(gate, (), (), a, kind)
+      elif op == ctl:
+        self.apply(gate, (a,), (False,), b, kind)
+      else:
+        self.apply(gate, a, b, c, kind)
+
+  # --- Results ----------------------------------------------------
+  def probabilities(self, qubits=None) -> np.ndarray:
+    """Probabilities of each state, marginalized onto qubits."""
+
+    # As for qc.sample(), the result is indexed by the measured bits,
+    # with qubits[0] as the most significant bit.
+    probs = np.abs(self.psi.astype(np.complex128))**2
+    if qubits is None:
+      return probs
+    if isinstance(qubits, int):
+      qubits = [qubits]
+    probs = probs.reshape([self.size] + [2] * self.nbits)
+    others = tuple(i + 1 for i in range(self.nbits) if i not in qubits)
+    probs = probs.sum(axis=others)
+    remaining = sorted(qubits)
+    probs = probs.transpose([0] + [remaining.index(q) + 1 for q in qubits])
+    return probs.reshape(self.size, -1)
+
+  def pauli_expectation(self, idx: int) -> np.ndarray:
+    """Expectation value of Pauli Z on qubit idx, for each state."""
+
+    probs = self.probabilities([idx])
+    return probs[:, 0] - probs[:, 1]
+
+  def expectation(self, observable) -> np.ndarray:
+    """Expectation value of a PauliSum or matrix, for each state."""
+
+    if isinstance(observable, pauli.PauliSum):
+      return observable.expectation(self.psi)
+    psi = self.psi.astype(np.complex128)
+    return np.real(np.einsum('bi,ij,bj->b', psi.conj(),
+                             np.asarray(observable), psi))
+
+  def sample(self, shots: int, qubits=None,
+             rng: np.random.Generator = None) -> np.ndarray:
+    """Histogram of 'shots' measurements of qubits, for each state."""
+
+    if rng is None:
+      rng = np.random.default_rng()
+    probs = self.probabilities(qubits)
+    probs /= probs.sum(axis=1, keepdims=True)
+    return rng.multinomial(shots, probs)
+
+
+def zeros(size: int, nbits: int) -> Batch:
+  """A batch of 'size' states |0...0> of nbits qubits."""
+
+  return Batch(state.zeros(nbits), size)
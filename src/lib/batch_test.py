@@ -0,0 +1,91 @@
+# python3
+from absl.testing import absltest
+import numpy as np
+
+from src.lib import batch
+from src.lib import circuit
+from src.lib import pauli
+from src.lib import state
+
+
+class BatchTest(absltest.TestCase):
+
+  def ansatz(self, theta, phi):
+    qc = circuit.qc('ansatz', eager=False)
+    qc.reg(3, 0)
+    qc.h(0)
+    qc.rx(0, theta)
+    qc.cx(0, 1)
+    qc.ry(1, phi)
+    qc.cu1(1, 2, theta)
+    qc.ccx(0, [1], 2)
+    qc.rz(2, phi)
+    return qc
+
+  def test_parameter_sweep(self):
+    theta = circuit.Parameter('theta')
+    phi = circuit.Parameter('phi')
+    qc = self.ansatz(theta, phi)
+    thetas = np.linspace(0, np.pi, 5)
+    phis = np.linspace(-1, 2, 5)
+
+    b = batch.zeros(5, 3)
+    b.run(qc, {theta: thetas, phi: phis})
+    for i in range(5):
+      single = self.ansatz(thetas[i], phis[i])
+      single.run()
+      self.assertTrue(b[i].is_close(single.psi))
+
+    # Inverse, with values in order of the parameters.
+    b.run(qc, [thetas, phis], inverse=True)
+    self.assertTrue(np.allclose(b.probabilities()[:, 0], 1.0, atol=1e-5))
+
+  def test_input_states(self):
+    qc = self.ansatz(0.3, 0.5)
+    # Dense random states, any mixing of amplitudes or wrong phase
+    # per row shows up.
+    psis = (np.random.random((4, 8)) - 0.5 +
+            1j * (np.random.random((4, 8)) - 0.5))
+    psis /= np.linalg.norm(psis, axis=1, keepdims=True)
+    b = batch.Batch(psis)
+    b.run(qc)
+    for i in range(4):
+      psi = state.State(psis[i])
+      qc.compile().run(psi)
+      self.assertTrue(b[i].is_close(psi))
+
+  def test_results(self):
+    theta = circuit.Parameter('theta')
+    qc = circuit.qc('rx', eager=False)
+    qc.reg(2, 0)
+    qc.rx(0, theta)
+    qc.cx(0, 1)
+    b = batch.zeros(3, 2)
+    b.run(qc, {theta: [0.0, np.pi / 2, np.pi]})
+
+    probs = b.probabilities()
+    self.assertEqual(probs.shape, (3, 4))
+    self.assertTrue(np.allclose(probs[:, [0, 3]],
+                                [[1, 0], [0.5, 0.5], [0, 1]], atol=1e-6))
+    self.assertTrue(np.allclose(b.probabilities([1]),
+                                [[1, 0], [0.5, 0.5], [0, 1]], atol=1e-6))
+    self.assertTrue(np.allclose(b.pauli_expectation(0), [1, 0, -1],
+                                atol=1e-6))
+
+    hamil = pauli.PauliSum([(0.5, 'ZI'), (2.0, 'ZZ'), (0.3, 'XX')])
+    expect = b.expectation(hamil)
+    self.assertEqual(expect.shape, (3,))
+    self.assertTrue(np.allclose(expect, b.expectation(hamil.matrix())))
+    for i in range(3):
+      self.assertAlmostEqual(expect[i], hamil.expectation(b[i]), places=5)
+
+    counts = b.sample(100, [0, 1])
+    self.assertEqual(counts.shape, (3, 4))
+    self.assertTrue(np.all(counts.sum(axis=1) == 100))
+    self.assertEqual(counts[0, 0], 100)
+    self.assertEqual(counts[2, 3], 100)
+    self.assertEqual(counts[:, 1].sum() + counts[:, 2].sum(), 0)
+
+
+if __name__ == '__main__':
+  absltest.main()
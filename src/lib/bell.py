@@ -27,10 +27,14 @@ def ghz_state(nbits: int) -> state.State:
   # |0> ----------X --- o ---
   # |0> ----------------X ---  ...
   #
+  # The gates are applied in-place, so that no new state is allocated
+  # per gate.
+  #
   psi = state.zeros(nbits)
-  psi = ops.Hadamard()(psi)
+  ops.Hadamard().apply_(psi)
+  cnot = ops.Cnot(0, 1)
   for offset in range(nbits-1):
-    psi = ops.Cnot(0, 1)(psi, offset)
+    cnot.apply_(psi, offset)
   return psi
 
 
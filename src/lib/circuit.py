@@ -6,12 +6,121 @@
 
 from __future__ import annotations
 
+import cmath
+import collections
+import math
 import random
-from typing import Callable
+from typing import Callable, Dict
 
 from absl import flags
 import numpy as np
 
+
+# Gate kinds. The simulator classifies each 2x2 gate by the structure
+# of its matrix and selects a specialized kernel, which needs fewer
+# loads and floating point operations than the general case.
+# These values must match the GateKind enum in xgates.cc.
+#
+#   general:  | a b |    real:  | a b |  with a, b, c, d real
+#             | c d |           | c d |
+#
+#   diag:     | a 0 |    antidiag:  | 0 b |    phase:  | 1 0 |
+#             | 0 d |               | c 0 |            | 0 d |
+#
+KERNEL_GENERAL = 0
+KERNEL_REAL = 1
+KERNEL_DIAG = 2
+KERNEL_ANTIDIAG = 3
+KERNEL_PHASE = 4
+kernel_names = ['general', 'real', 'diag', 'antidiag', 'phase']
+
+# Profiling counters, how often each of the kernels above ran.
+kernel_profile = collections.Counter()
+
+
+def gate_kind(gate: np.ndarray) -> int:
+  """Classify a (flattened) 2x2 gate to select a kernel."""
+
+  g = gate.reshape(4)
+  if g[1] == 0 and g[2] == 0:
+    if g[0] == 1:
+      return KERNEL_PHASE
+    return KERNEL_DIAG
+  if g[0] == 0 and g[3] == 0:
+    return KERNEL_ANTIDIAG
+  if not np.any(g.imag):
+    return KERNEL_REAL
+  return KERNEL_GENERAL
+
+
+def reset_kernel_profile() -> None:
+  kernel_profile.clear()
+
+
+def apply_pair(psi0, psi1, gate, kind):
+  """Apply gate to the (strided) amplitude pairs psi0, psi1."""
+
+  # A gate of shape (4, ...) holds arrays of elements, which broadcast
+  # against psi0 and psi1, eg., per-row gates of a batch of states.
+  if gate.ndim > 1:
+    g = list(gate)
+  elif kind == KERNEL_REAL:
+    g = [float(v.real) for v in gate]
+  else:
+    g = [complex(v) for v in gate]
+
+  if kind == KERNEL_DIAG:
+    psi0 *= g[0]
+    psi1 *= g[3]
+  elif kind == KERNEL_ANTIDIAG:
+    t1 = g[1] * psi1
+    psi1[...] = g[2] * psi0
+    psi0[...] = t1
+  elif kind == KERNEL_PHASE:
+    psi1 *= g[3]
+  else:
+    t1 = g[0] * psi0 + g[1] * psi1
+    psi1[...] = g[2] * psi0 + g[3] * psi1
+    psi0[...] = t1
+
+
+def pair_views(psi, nbits, ctls, by_0, target):
+  """Views of the amplitude pairs of target, where controls are met."""
+
+  # Only the amplitudes where all controls are set (or not set, for
+  # controls by |0>) change. These form a strided view of 2^(n-k)
+  # amplitudes for k controls, hence a ccx costs a quarter of a
+  # single-qubit gate, instead of 5 controlled gates.
+  psi_t = psi.reshape([2] * nbits)
+  sel = [slice(None)] * nbits
+  for ctl, flip in zip(ctls, by_0):
+    sel[ctl] = slice(0, 1) if flip else slice(1, 2)
+  sel[target] = slice(0, 1)
+  psi0 = psi_t[tuple(sel)]
+  sel[target] = slice(1, 2)
+  psi1 = psi_t[tuple(sel)]
+  return psi0, psi1
+
+
+def applym(psi, gate, nbits, ctls, by_0, target, kind=KERNEL_GENERAL):
+  """Apply a multi-controlled gate via strided views."""
+
+  psi0, psi1 = pair_views(psi, nbits, ctls, by_0, target)
+  apply_pair(psi0, psi1, gate, kind)
+  return psi
+
+
+def pair_overlap(lam, psi, gate, nbits, ctls, by_0, target) -> complex:
+  """Compute <lam|G|psi>, G is gate on target where controls are met."""
+
+  # Amplitudes where the controls are not met don't contribute, as G
+  # is not a unitary, but the derivative of one (see qc.gradient()).
+  lam0, lam1 = pair_views(lam, nbits, ctls, by_0, target)
+  psi0, psi1 = pair_views(psi, nbits, ctls, by_0, target)
+  return complex(np.vdot(lam0, gate[0] * psi0 + gate[1] * psi1) +
+                 np.vdot(lam1, gate[2] * psi0 + gate[3] * psi1))
+
+
 # Many of the algorithm implementation rely on the fast performance
 # provided by libxgates. However, it can be difficult to build,
 # depending on your environment. To enable a quick start on this codebase
@@ -38,34 +147,34 @@ except:
   **************************************************************
   """)
 
-  def apply1(psi, gate, nbits, qubit, bitwidth=0):
-    """Apply a single-qubit gate via explicit indexing."""
-
-    qubit = nbits - qubit - 1
-    two_q = 2**qubit
-    for g in range(0, 2**nbits, 2**(qubit+1)):
-      for i in range(g, g + two_q):
-        t1 = gate[0] * psi[i] + gate[1] * psi[i + two_q]
-        t2 = gate[2] * psi[i] + gate[3] * psi[i + two_q]
-        psi[i] = t1
-        psi[i + two_q] = t2
+  def apply1(psi, gate, nbits, qubit, bitwidth=0, kind=KERNEL_GENERAL):
+    """Apply a single-qubit gate via strided views."""
+
+    # Qubit 0 is the most significant bit, hence, after reshaping
+    # the state into [2, 2, ..., 2], axis i corresponds to qubit i.
+    # Slices (instead of integer indices) ensure that we always get
+    # views, even for a 1-qubit state.
+    psi_t = psi.reshape([2] * nbits)
+    sel = [slice(None)] * nbits
+    sel[qubit] = slice(0, 1)
+    psi0 = psi_t[tuple(sel)]
+    sel[qubit] = slice(1, 2)
+    psi1 = psi_t[tuple(sel)]
+    apply_pair(psi0, psi1, gate, kind)
     return psi
 
-
-  def applyc(psi, gate, nbits, control, target, bitwidth=64):
-    """Apply a controlled 2-qubit gate via explicit indexing."""
-
-    qubit = nbits - target - 1
-    two_q = 2**qubit
-    control = nbits - control - 1
-    for g in range(0, 2**nbits, 2**(qubit+1)):
-      for i in range(g, g + two_q):
-        idx = g * 2**nbits + i
-        if idx & (1 << control):
-          t1 = gate[0] * psi[i] + gate[1] * psi[i + two_q]
-          t2 = gate[2] * psi[i] + gate[3] * psi[i + two_q]
-          psi[i] = t1
-          psi[i + two_q] = t2
+  def applyc(psi, gate, nbits, control, target, bitwidth=64,
+             kind=KERNEL_GENERAL):
+    """Apply a controlled 2-qubit gate via strided views."""
+
+    psi_t = psi.reshape([2] * nbits)
+    sel = [slice(None)] * nbits
+    sel[control] = slice(1, 2)
+    sel[target] = slice(0, 1)
+    psi0 = psi_t[tuple(sel)]
+    sel[target] = slice(1, 2)
+    psi1 = psi_t[tuple(sel)]
+    apply_pair(psi0, psi1, gate, kind)
     return psi
 
 
@@ -73,6 +182,8 @@ from src.lib import dumpers
 from src.lib import ir
 from src.lib import ops
 from src.lib import optimizer
+from src.lib import pauli
+from src.lib import schedule
 from src.lib import state
 from src.lib import tensor
 
@@ -82,6 +193,74 @@ flags.DEFINE_string('cirq', '', 'Generate cirq output file, or empty')
 flags.DEFINE_string('latex', '', 'Generate Latex output file, or empty')
 
 
+# --- Parameters -----------------------------------------------
+# Rotations rx, ry, rz, u1, and cu1 accept a Parameter instead of an
+# angle. Such a circuit is built (and compiled) only once, values are
+# bound to its parameters later, possibly many times, via qc.bind().
+# Until then, a parameter is 0.0. Usage model:
+#
+#    theta = circuit.Parameter('theta')
+#    c = circuit.qc('ansatz', eager=False)
+#    c.reg(1)
+#    c.rx(0, theta)
+#    ...
+#    for val in values:
+#      c.bind({theta: val})
+#      c.psi = state.zeros(1)
+#      c.run()
+#
+class Parameter:
+  """Placeholder for the angle of a rotation, see qc.bind()."""
+
+  def __init__(self, name: str):
+    self.name = name
+
+  def __repr__(self) -> str:
+    return f'Parameter({self.name})'
+
+
+def rotation(name: str, theta: float) -> ops.Operator:
+  """Matrix of a rotation (as in ops), computed in closed form."""
+
+  # Binding values is on the critical path of variational loops, these
+  # are much faster than the general ops.Rotation().
+  if name in ('u1', 'cu1'):
+    return ops.Operator([[1.0, 0.0], [0.0, cmath.exp(1j * theta)]])
+  c = math.cos(theta / 2)
+  s = math.sin(theta / 2)
+  if name == 'rx':
+    return ops.Operator([[c, -1j * s], [-1j * s, c]])
+  if name == 'ry':
+    return ops.Operator([[c, -s], [s, c]])
+  if name == 'rz':
+    return ops.Operator([[complex(c, -s), 0.0], [0.0, complex(c, s)]])
+  raise ValueError(f'Not a parameterized rotation: {name}')
+
+
+def rotation_derivative(name: str, theta: float) -> np.ndarray:
+  """Derivative of rotation(name, theta) by theta, flattened."""
+
+  if name in ('u1', 'cu1'):
+    return np.array([0.0, 0.0, 0.0, 1j * cmath.exp(1j * theta)])
+  c = math.cos(theta / 2) / 2
+  s = math.sin(theta / 2) / 2
+  if name == 'rx':
+    return np.array([-s, -1j * c, -1j * c, -s])
+  if name == 'ry':
+    return np.array([-s, -c, c, -s])
+  if name == 'rz':
+    return np.array([complex(-s, -c), 0.0, 0.0, complex(-s, c)])
+  raise ValueError(f'Not a parameterized rotation: {name}')
+
+
+def unbound(theta, name: str):
+  """Return angle and IR parameter for a rotation by theta."""
+
+  if isinstance(theta, Parameter):
+    return 0.0, (theta, name, False)
+  return theta, None
+
+
 class qc:
   """Wrapper class to maintain state + operators."""
 
@@ -92,6 +271,8 @@ class qc:
     self.build_ir = True
     self.eager = eager
     self.global_reg = 0
+    self.opt_stats = {}
+    self._compiled = None
 
   class scope:
     """Scope object to allow grouping of gates in the output."""
@@ -143,9 +324,26 @@ class qc:
     self.global_reg = self.global_reg + n
 
   def stats(self) -> str:
-    return ('Circuit Statistics\n' +
-            '  Qubits: {}\n'.format(self.nbits) +
-            '  Gates : {}\n'.format(self.ir.ngates))
+    sched = self.schedule()
+    widths = sched.widths()
+    s = ('Circuit Statistics\n' +
+         '  Qubits: {}\n'.format(self.nbits) +
+         '  Gates : {}\n'.format(self.ir.ngates) +
+         '  Depth : {}\n'.format(sched.depth))
+    if sched.depth:
+      path = sched.critical_path()
+      qubits = sorted({q for i in path for q in
+                       self.ir.gates[i].qubits})
+      s += '  Width : max {}, avg {:.2f} gates per layer\n'.format(
+          widths.max(), widths.mean())
+      s += '  Critical path: {} gates, on qubits {}\n'.format(
+          len(path), qubits)
+    if self.opt_stats:
+      s += '  Removed by optimizer: {} ({})\n'.format(
+          sum(self.opt_stats.values()),
+          ', '.join('{}: {}'.format(name, removed)
+                    for name, removed in self.opt_stats.items()))
+    return s
 
   def dump_with_dumper(self, flag: bool,
                        dumper_func: Callable[ir.Ir]) -> None:
@@ -160,8 +358,19 @@ class qc:
     self.dump_with_dumper(flags.FLAGS.cirq, dumpers.cirq)
     self.dump_with_dumper(flags.FLAGS.latex, dumpers.latex)
 
-  def optimize(self):
-    self. ir = optimizer.optimize(self.ir)
+  def schedule(self) -> schedule.Schedule:
+    """Schedule the gates into layers (moments), see schedule.py."""
+
+    return schedule.Schedule(self.ir)
+
+  def optimize(self) -> Dict[str, int]:
+    """Optimize the IR, return the number of removed gates per pass."""
+
+    stats = {}
+    self.ir = optimizer.optimize(self.ir, stats)
+    for name, removed in stats.items():
+      self.opt_stats[name] = self.opt_stats.get(name, 0) + removed
+    return stats
 
   @property
   def nbits(self) -> int:
@@ -177,25 +386,28 @@ class qc:
 
   # --- Gates  ----------------------------------------------------
   def apply1(self, gate: ops.Operator, idx: int,
-             name: str = None, *, val: float = None):
+             name: str = None, *, val: float = None, param=None):
     """Apply single gates."""
 
+    kind = gate_kind(gate) if self.eager else KERNEL_GENERAL
     if isinstance(idx, state.Reg):
       for reg in range(idx.nbits):
         if self.build_ir:
-          self.ir.single(name, idx[reg], gate, val)
+          self.ir.single(name, idx[reg], gate, val, param)
         if self.eager:
           apply1(self.psi, gate.reshape(4), self.psi.nbits, idx[reg],
-                 tensor.tensor_width)
+                 tensor.tensor_width, kind)
+          kernel_profile[kernel_names[kind]] += 1
       return
     if self.build_ir:
-      self.ir.single(name, idx, gate, val)
+      self.ir.single(name, idx, gate, val, param)
     if self.eager:
       apply1(self.psi, gate.reshape(4), self.psi.nbits, idx,
-             tensor.tensor_width)
+             tensor.tensor_width, kind)
+      kernel_profile[kernel_names[kind]] += 1
 
   def applyc(self, gate: ops.Operator, ctl: int, idx: int,
-             name: str = None, *, val: float = None):
+             name: str = None, *, val: float = None, param=None):
     """Apply controlled gates."""
 
     if isinstance(idx, state.Reg):
@@ -205,13 +417,30 @@ class qc:
     if by_0:
       self.x(ctl_qubit)
     if self.build_ir:
-      self.ir.controlled(name, ctl_qubit, idx, gate, val)
+      self.ir.controlled(name, ctl_qubit, idx, gate, val, param)
     if self.eager:
+      kind = gate_kind(gate)
       applyc(self.psi, gate.reshape(4), self.psi.nbits, ctl_qubit, idx,
-             tensor.tensor_width)
+             tensor.tensor_width, kind)
+      kernel_profile[kernel_names[kind]] += 1
     if by_0:
       self.x(ctl_qubit)
 
+  def applym(self, gate: ops.Operator, ctl, idx: int,
+             name: str = None, *, aux=(), val: float = None):
+    """Apply multi-controlled gates, ctl as in multi_control()."""
+
+    ctls = [self.ctl_by_0(c) for c in ctl]
+    ctl_qubits = tuple(c for c, _ in ctls)
+    by_0 = tuple(flip for _, flip in ctls)
+    if self.build_ir:
+      self.ir.multi(name, ctl_qubits, by_0, idx, gate, tuple(aux), val)
+    if self.eager:
+      kind = gate_kind(gate)
+      applym(self.psi, gate.reshape(4), self.psi.nbits, ctl_qubits, by_0,
+             idx, kind)
+      kernel_profile[kernel_names[kind]] += 1
+
   def cv(self, idx0: int, idx1: int):
     self.applyc(ops.Vgate(), idx0, idx1, 'cv')
 
@@ -231,34 +460,19 @@ class qc:
     self.applyc(ops.PauliZ(), idx0, idx1, 'cz')
 
   def cu1(self, idx0: int, idx1: int, value):
-    self.applyc(ops.U1(value), idx0, idx1, 'cu1', val=value)
+    value, param = unbound(value, 'cu1')
+    self.applyc(ops.U1(value), idx0, idx1, 'cu1', val=value, param=param)
 
   def crk(self, idx0: int, idx1: int, value):
     self.applyc(ops.Rk(value), idx0, idx1, 'crk', val=value)
 
   def ccx(self, idx0: int, idx1: int, idx2: int):
-    """Sleator-Weinfurter Construction."""
+    """Toffoli gate, a native multi-controlled node."""
 
-    i0, c0_by_0 = self.ctl_by_0(idx0)
-    i1, c1_by_0 = self.ctl_by_0(idx1)
-    i2 = idx2
-
-    with self.scope(self.ir, f'ccx({idx0}, {idx1}, {idx2})'):
-      if c0_by_0:
-        self.x(i0)
-      if c1_by_0:
-        self.x(i1)
-
-      self.cv(i0, i2)
-      self.cx(i0, i1)
-      self.cv_adj(i1, i2)
-      self.cx(i0, i1)
-      self.cv(i1, i2)
-
-      if c0_by_0:
-        self.x(i0)
-      if c1_by_0:
-        self.x(i1)
+    # The gate is a single node in the IR, which the simulator applies
+    # directly. The construction with cv, cx, and cv_adj gates is only
+    # produced for dumping, see ir.lower().
+    self.applym(ops.PauliX(), [idx0, idx1], idx2, 'ccx')
 
   def toffoli(self, idx0: int, idx1: int, idx2: int):
     self.ccx(idx0, idx1, idx2)
@@ -276,7 +490,8 @@ class qc:
     self.apply1(ops.Tgate(), idx, 't')
 
   def u1(self, idx: int, val):
-    self.apply1(ops.U1(val), idx, 'u1', val=val)
+    val, param = unbound(val, 'u1')
+    self.apply1(ops.U1(val), idx, 'u1', val=val, param=param)
 
   def v(self, idx: int):
     self.apply1(ops.Vgate(), idx, 'v')
@@ -294,13 +509,16 @@ class qc:
     self.apply1(ops.Yroot(), idx, 'yroot')
 
   def rx(self, idx: int, theta: float):
-    self.apply1(ops.RotationX(theta), idx, 'rx', val=theta)
+    theta, param = unbound(theta, 'rx')
+    self.apply1(ops.RotationX(theta), idx, 'rx', val=theta, param=param)
 
   def ry(self, idx: int, theta: float):
-    self.apply1(ops.RotationY(theta), idx, 'ry', val=theta)
+    theta, param = unbound(theta, 'ry')
+    self.apply1(ops.RotationY(theta), idx, 'ry', val=theta, param=param)
 
   def rz(self, idx: int, theta: float):
-    self.apply1(ops.RotationZ(theta), idx, 'rz', val=theta)
+    theta, param = unbound(theta, 'rz')
+    self.apply1(ops.RotationZ(theta), idx, 'rz', val=theta, param=param)
 
 #  Appplying a random unitary is possible, but it is not a
 #  1- or 2-qubit gate, hence slow.
@@ -312,7 +530,9 @@ class qc:
 # --- Measure ----------------------------------------------------
   def measure_bit(self, idx: int, tostate: int = 0,
                   collapse: bool = True) -> (float, state.State):
-    prob, self.psi = ops.Measure(self.psi, idx, tostate, collapse)
+    """Measure qubit(s) idx, collapse the state in place."""
+
+    prob, _ = ops.Measure(self.psi, idx, tostate, collapse, inplace=True)
     return prob, self.psi
 
   def pauli_expectation(self, idx: int):
@@ -328,6 +548,48 @@ class qc:
       return 1
     return 0
 
+  def sample(self, shots: int, qubits=None, histogram: bool = True,
+             rng: np.random.Generator = None) -> np.ndarray:
+    """Sample 'shots' measurements of 'qubits' (default: all qubits)."""
+
+    # The probabilities are computed once from the amplitudes and
+    # marginalized onto the requested qubits by summing over all
+    # other qubits. This correctly reflects entanglement between the
+    # measured qubits, which sampling each qubit independently would
+    # not. All shots are then drawn at once.
+    #
+    # With histogram=True, the result is an array of counts, indexed
+    # by the measured bits as a binary number, with qubits[0] as the
+    # most significant bit. Otherwise, the result is an array of
+    # shape (shots, len(qubits)) with the measured bits.
+    #
+    nbits = self.psi.nbits
+    if qubits is None:
+      qubits = list(range(nbits))
+    if isinstance(qubits, state.Reg):
+      qubits = qubits.global_idx
+    if isinstance(qubits, int):
+      qubits = [qubits]
+    if rng is None:
+      rng = np.random.default_rng()
+
+    probs = np.abs(np.asarray(self.psi, dtype=np.complex128))**2
+    probs = probs.reshape([2] * nbits)
+    others = tuple(i for i in range(nbits) if i not in qubits)
+    probs = probs.sum(axis=others)
+
+    # Remaining axes are in ascending qubit order, reorder as requested.
+    remaining = sorted(qubits)
+    probs = probs.transpose([remaining.index(q) for q in qubits])
+    probs = probs.reshape(-1)
+    probs /= probs.sum()
+
+    if histogram:
+      return rng.multinomial(shots, probs)
+    values = rng.choice(probs.shape[0], size=shots, p=probs)
+    shifts = np.arange(len(qubits) - 1, -1, -1)
+    return ((values[:, None] >> shifts) & 1).astype(np.uint8)
+
 # --- Advanced ---------------------------------------------------
   def swap(self, idx0: int, idx1: int):
     """Simple Swap operation."""
@@ -366,30 +628,19 @@ class qc:
     # whole gate sequences straight-forward, but changes the trivial
     # IR we're working with here. Something to keep in mind.
 
+    # The gate is a single node in the IR, simulated directly, without
+    # touching the ancillas. The ancillas, which have to be |0>, are
+    # only used for lowering the gate, see ir.lower().
+    if len(ctl) >= 2:
+      self.applym(gate, ctl, idx1, desc,
+                  aux=[aux[i] for i in range(len(ctl) - 1)])
+      return
+
     with self.scope(self.ir, f'multi({ctl}, {idx1}) # {desc})'):
       if not ctl:
         self.apply1(gate, idx1, desc)
         return
-      if len(ctl) == 1:
-        self.applyc(gate, ctl[0], idx1, desc)
-        return
-
-      # Compute the predicate.
-      self.ccx(ctl[0], ctl[1], aux[0])
-      aux_idx = 0
-      for i in range(2, len(ctl)):
-        self.ccx(ctl[i], aux[aux_idx], aux[aux_idx+1])
-        aux_idx = aux_idx + 1
-
-      # Use predicate to single-control qubit at idx1.
-      self.applyc(gate, aux[aux_idx], idx1, desc)
-
-      # Uncompute predicate.
-      aux_idx = aux_idx - 1
-      for i in range(len(ctl)-1, 1, -1):
-        self.ccx(ctl[i], aux[aux_idx], aux[aux_idx+1])
-        aux_idx = aux_idx - 1
-      self.ccx(ctl[0], ctl[1], aux[0])
+      self.applyc(gate, ctl[0], idx1, desc)
 
   def flip(self, reg: state.Reg):
     """Flip a quantum register via swaps."""
@@ -418,26 +669,138 @@ class qc:
   def qc(self, qc_parm: qc, offset=0):
     """Add another full circuit to this circuit."""
 
-    # Iterate of the new circuit and add the gates one by one,
-    # using this circuit's eager mode.
+    # The gates of the new circuit are added in bulk to the IR and,
+    # in eager mode, applied by running its compiled program. Compile
+    # first, qc_parm may be this circuit.
     #
-    for gate in qc_parm.ir.gates:
-      if gate.is_single():
-        self.apply1(gate.gate, gate.idx0+offset, gate.name, val=gate.val)
-      if gate.is_ctl():
-        self.applyc(gate.gate, gate.ctl+offset, gate.idx1+offset,
-                    gate.name, val=gate.val)
-
-  def run(self):
-    """Apply gates in this qc, don't rebuild IR."""
-
-    build_ir = self.build_ir
-    eager = self.eager
-    self.build_ir = False
-    self.eager = True
-    self.qc(self)
-    self.build_ir = build_ir
-    self.eager = eager
+    if self.eager:
+      program = qc_parm.compile(offset)
+    if self.build_ir:
+      self.ir.extend(qc_parm.ir, offset)
+    if self.eager:
+      program.run(self.psi)
+
+  def run(self, inverse: bool = False):
+    """Apply gates in this qc (or its inverse), don't rebuild IR."""
+
+    program = self.compile()
+    if inverse:
+      program = program.inverse()
+    program.run(self.psi)
+
+  def compile(self, offset: int = 0) -> Program:
+    """Compile the IR into a (cached) Program, at a qubit offset."""
+
+    # The cache holds a reference to the IR it was compiled from,
+    # which is replaced, eg., by optimize(), and the number of gates,
+    # which changes as gates are added.
+    if (self._compiled is None or self._compiled[0] is not self.ir or
+        self._compiled[1] != self.ir.ngates):
+      self._compiled = (self.ir, self.ir.ngates, {})
+    programs = self._compiled[2]
+    if offset not in programs:
+      programs[offset] = Program(self.ir, offset)
+    return programs[offset]
+
+  @property
+  def parameters(self):
+    """List of the distinct parameters of this qc, in order of use."""
+
+    return list(dict.fromkeys(p for p, _, _ in self.ir.params.values()))
+
+  def bind(self, values) -> None:
+    """Bind values to parameters, as dict or in order of parameters."""
+
+    # Only the matrices of the parameterized gates are recomputed, in
+    # the IR and, in-place, in all programs compiled from it. The
+    # adjoint of a rotation (from inverse()) is the rotation by -value.
+    if not isinstance(values, dict):
+      values = dict(zip(self.parameters, values))
+    programs = []
+    if self._compiled is not None and self._compiled[0] is self.ir:
+      programs = self._compiled[2].values()
+    for gate_id, (param, name, adjoint) in self.ir.params.items():
+      if param not in values:
+        continue
+      value = float(values[param])
+      if adjoint:
+        value = -value
+      gate = rotation(name, value)
+      self.ir.bind(gate_id, gate, value)
+      for program in programs:
+        program.bind(gate_id, gate)
+
+  # --- Gradients ------------------------------------------------
+  # Adjoint differentiation computes the gradient of the expectation
+  # value E = <psi|H|psi> by all parameters with one forward and one
+  # backward pass. With psi = U_G ... U_1 |psi_0>, gate U_k depending
+  # on theta, and
+  #
+  #    psi_k = U_k ... U_1 |psi_0>       (the state after gate k)
+  #    lam_k = U_k+1^+ ... U_G^+ H|psi>
+  #
+  # the derivative is:
+  #
+  #    dE/dtheta = 2 Re <lam_k| dU_k/dtheta |psi_k-1>
+  #
+  # The backward pass starts with psi and lam = H|psi> and un-applies
+  # the gates, via the inverse program, from both states in lock step.
+  # For each parameterized gate we get its term of the derivative from
+  # the two states, in between. This costs 3 kernel runs per gate, and
+  # two state vectors, for any number of parameters. A parameter used
+  # by several gates gets the sum of their terms.
+  #
+  def gradient(self, observable, params=None,
+               psi: state.State = None) -> np.ndarray:
+    """Gradient of <H> for this qc (at the bound values) by params."""
+
+    # observable is a pauli.PauliSum, or a matrix. params are the
+    # parameters to differentiate by, default: all parameters. The
+    # circuit runs on psi, default |0...0>, self.psi doesn't change.
+    if params is None:
+      params = self.parameters
+    if psi is None:
+      psi = state.zeros(self.nbits)
+    psi = state.State(np.array(psi))
+    nbits = psi.nbits
+    program = self.compile()
+    program.run(psi, nbits)
+    if isinstance(observable, pauli.PauliSum):
+      lam = state.State(observable.apply(psi))
+    else:
+      lam = state.State(np.asarray(observable) @ psi)
+
+    # Derivatives of the gates, at their current angle. Gates from
+    # inverse() are rotations by the negated parameter.
+    index = {param: k for k, param in enumerate(params)}
+    gate_ids = self.ir.gate_ids
+    derivs = {}
+    for gate_id, (param, name, adjoint) in self.ir.params.items():
+      if param not in index:
+        continue
+      theta = float(self.ir.vals[np.argmax(gate_ids == gate_id)])
+      deriv = rotation_derivative(name, theta)
+      derivs[gate_id] = (index[param], -deriv if adjoint else deriv)
+
+    grads = np.zeros(len(params))
+    inverse = program.inverse()
+    ctl_op = ir.Op.CTL.value
+    multi_op = ir.Op.MULTI.value
+    for (op, gate, kind, a, b, c), (_, gate_id, *_) in zip(inverse.code,
+                                                            inverse.instrs):
+      execute(psi, nbits, op, gate, kind, a, b, c)
+      if gate_id in derivs:
+        k, deriv = derivs[gate_id]
+        if op == ctl_op:
+          ctls, by_0, target = (a,), (False,), b
+        elif op == multi_op:
+          ctls, by_0, target = a, b, c
+        else:
+          ctls, by_0, target = (), (), a
+        grads[k] += 2 * pair_overlap(lam, psi, deriv, nbits, ctls, by_0,
+                                     target).real
+      execute(lam, nbits, op, gate, kind, a, b, c)
+    return grads
 
   def inverse(self):
     """Return, but don't apply, the inverse circuit."""
@@ -463,23 +826,328 @@ class qc:
     #      c_inv = c0.inverse()
     #      main.qc(c_inv, offset=3)
     #
+    # Gates are interned, the adjoint is computed once per distinct gate.
+    #
     newqc = qc(self.name, eager=False)
+    adjoints = [gate.adjoint() for gate in self.ir.gate_table]
     for gate in self.ir.gates[::-1]:
+      adjoint = adjoints[gate.gate_id]
       val = -gate.val if gate.val else None
+      param = gate.param
+      if param is not None:
+        param = (param[0], param[1], not param[2])
+        val = -(gate.val or 0.0)
       if gate.is_single():
-        newqc.apply1(gate.gate.adjoint(), gate.idx0, gate.name+'*', val=val)
+        newqc.ir.single(gate.name+'*', gate.idx0, adjoint, val, param)
       if gate.is_ctl():
-        newqc.applyc(gate.gate.adjoint(), gate.ctl, gate.idx1,
-                     gate.name+'*', val=val)
+        newqc.ir.controlled(gate.name+'*', gate.ctl, gate.idx1, adjoint, val,
+                            param)
+      if gate.is_multi():
+        newqc.ir.multi(gate.name+'*', gate.ctls, gate.ctl_by_0, gate.idx1,
+                       adjoint, gate.aux, val, param)
     return newqc
 
+# --- Unitary ------------------------------------------------
+  # Column c of the unitary U of this circuit is U|c>, the result of
+  # running the circuit on basis state |c>. Instead of computing the
+  # 2^n x 2^n matrix as a chain of dense kron and matmul products, which
+  # costs O(8^n) per gate, we run the gate kernels on all columns at
+  # once. For this, the 2^n x m matrix of basis columns is viewed as a
+  # state of n + log2(m) qubits, with the circuit's qubits first. A gate
+  # on qubit i of this larger state acts on qubit i of each column,
+  # hence each gate costs O(2^n * m), or O(4^n) for the full unitary.
+  #
+  def width(self) -> int:
+    """Number of qubits used by the state and the gates of this qc."""
+
+    nbits = self.global_reg
+    if self.ir.ngates:
+      nbits = max(nbits, int(self.ir.idx0s.max()) + 1,
+                  int(self.ir.idx1s.max()) + 1)
+    for ctls, _, aux in self.ir.ctl_table:
+      nbits = max([nbits] + [q + 1 for q in ctls + aux])
+    return nbits
+
+  def apply_to(self, psi: np.ndarray, nbits: int, offset: int = 0,
+               repeat: int = 1) -> None:
+    """Apply the gates of this qc, in-place, to an nbits state psi."""
+
+    # psi can be any contiguous vector of the tensor type, eg., a
+    # batch of states viewed as one larger state, with the batch index
+    # as the least significant qubits (see unitary_matrix()).
+    self.compile(offset).run(psi, nbits, repeat)
+
+  def unitary_matrix(self, columns=None) -> tensor.Tensor:
+    """Compute the unitary (or selected columns) of this circuit."""
+
+    nbits = self.width()
+    dim = 2**nbits
+    if columns is None:
+      columns = range(dim)
+    columns = np.asarray(columns, dtype=np.int64).reshape(-1)
+    if columns.size and (columns.min() < 0 or columns.max() >= dim):
+      raise AssertionError('Invalid column index.')
+
+    # Pad the number of columns to a power of 2, with zero columns.
+    mbits = max(0, int(columns.size - 1).bit_length())
+    width = 2**mbits
+    mat = np.zeros((dim, width), dtype=tensor.tensor_type())
+    mat[columns, np.arange(columns.size)] = 1.0
+    psi = mat.reshape(-1)
+    self.apply_to(psi, nbits + mbits)
+
+    mat = psi.reshape(dim, width)[:, :columns.size]
+    if columns.size == dim and np.array_equal(columns, np.arange(dim)):
+      return ops.Operator(mat)
+    return tensor.Tensor(mat)
+
 # --- Debug --------------------------------------------------
-  def dump(self, desc=None):
+  def dump(self, desc=None, per_qubit: bool = False):
     """Simple dumper for basic debugging of a circuit."""
 
+    # With per_qubit, only a per-qubit summary of the state is
+    # printed, which remains small and fast for wide circuits.
     if desc:
       print(desc)
     if self.name:
       print(f'Circuit: {self.name}, Nodes: {len(self.ir.gates)}')
     print(self.ir, end='')
-    self.psi.dump('Current state')
+    if per_qubit:
+      self.psi.dump_qubits('Current state')
+    else:
+      self.psi.dump('Current state')
+
+
+# --- Phase Estimation -------------------------------------------
+# Phase estimation, following Nielsen/Chuang Section 5.2 (see also
+# phase_estimation.py and counting.py):
+#
+# 't' qubits
+# |0> - H -------------------- ... ----o --  |
+# |0> - H -----------------o-- ... --- | --  |  inverse
+# |0> - H ---------o-------|-- ... --- | --  |   QFT
+# |0> - H -o-------|-------|-- ... --- | --  |
+#          |       |       |           |
+# |u> --- U^1 --- U^2 --- U^4 ... --- U^2^(t-1)
+#
+# The controlled U^(2^j) are never built as dense, full-width
+# operators. A controlled operation only acts on the half of the state
+# where the control qubit is |1> (see ops.ControlledApply), and on
+# this half U^(2^j) is applied to the target register only:
+#
+#   - for a matrix U, via Operator.apply_local(). The powers are
+#     computed by repeated squaring, each power from the previous one,
+#   - for a (non-eager) qc sub-circuit U, by running its gates 2^j
+#     times through the gate kernels,
+#   - for an operator with an apply_controlled() method, such as the
+#     matrix-free ops.Grover, by delegating to this method.
+#
+# The inverse QFT on the t register is the discrete Fourier transform,
+# which we compute with an FFT in O(t 2^t), instead of building the
+# dense 2^t x 2^t QFT operator.
+#
+def phase_estimation(psi: state.State, u, t: int, idx: int = None,
+                     inverse_qft: bool = True) -> state.State:
+  """Phase estimation for U on qubits idx... into qubits 0...t-1."""
+
+  if idx is None:
+    idx = t
+  if idx < t:
+    raise AssertionError('Target register overlaps the t register.')
+
+  psi = state.State(np.array(psi))
+  nbits = psi.nbits
+  h = ops.Hadamard().reshape(4)
+  for i in range(t):
+    apply1(psi, h, nbits, i, tensor.tensor_width, gate_kind(h))
+
+  # The control qubits precede the target register, hence the target
+  # register moves up by one qubit in the controlled half of the state.
+  offset = idx - 1
+
+  if isinstance(u, qc):
+    def run_power(sub: state.State, power: int) -> state.State:
+      u.apply_to(sub, sub.nbits, offset, power)
+      return sub
+
+    for j, ctl in enumerate(range(t - 1, -1, -1)):
+      ops.ControlledApply(psi, ctl, lambda sub, p=2**j: run_power(sub, p),
+                          inplace=True)
+  elif hasattr(u, 'apply_controlled'):
+    for j, ctl in enumerate(range(t - 1, -1, -1)):
+      psi = u.apply_controlled(psi, ctl, idx, 2**j, inplace=True)
+  else:
+    power = np.asarray(u, dtype=np.complex128)
+    for j, ctl in enumerate(range(t - 1, -1, -1)):
+      op = ops.Operator(power)
+      ops.ControlledApply(psi, ctl, lambda sub, op=op: op.apply_(sub, offset),
+                          inplace=True)
+      if j < t - 1:
+        power = power @ power
+
+  if inverse_qft:
+    view = np.asarray(psi).reshape(2**t, -1)
+    psi = state.State(np.fft.fft(view, axis=0, norm='ortho').reshape(-1))
+  return psi
+
+
+# --- Equivalence -------------------------------------------------
+# Two circuits are equivalent if they implement the same unitary.
+# Comparing the dense unitaries costs O(4^n) memory and, built from
+# gate matrices, up to O(8^n) time. Instead, we run both circuits on
+# a few random input states and compare the outputs. This is the
+# Freivalds-style randomized check: for U1 != U2, a random state psi
+# with U1 psi == U2 psi is extremely unlikely. All random states run
+# as a single batch through the gate kernels (see unitary_matrix()).
+#
+def circuits_equivalent(qc1: qc, qc2: qc, trials: int = 4,
+                        up_to_phase: bool = False,
+                        atol: float = 1e-5) -> bool:
+  """Check whether qc1 and qc2 implement the same unitary."""
+
+  nbits = max(qc1.width(), qc2.width())
+  mbits = max(0, int(trials - 1).bit_length())
+  shape = (2**nbits, 2**mbits)
+  batch = (np.random.randn(*shape) + 1j * np.random.randn(*shape))
+  batch /= np.linalg.norm(batch, axis=0)
+  batch = batch.astype(tensor.tensor_type())
+
+  res1 = batch.reshape(-1).copy()
+  res2 = batch.reshape(-1).copy()
+  qc1.apply_to(res1, nbits + mbits)
+  qc2.apply_to(res2, nbits + mbits)
+  res1 = res1.reshape(shape)
+  res2 = res2.reshape(shape)
+
+  if up_to_phase:
+    # The global phase is the same for all inputs. We estimate it from
+    # the overlap of all outputs.
+    overlap = np.vdot(res1, res2)
+    if abs(overlap) < atol:
+      return False
+    res1 = res1 * (overlap / abs(overlap))
+  return np.allclose(res1, res2, atol=atol)
+
+
+# --- Compiled Programs ----------------------------------------
+# Running a circuit from its IR means, for each gate, dispatching on
+# the opcode, looking up and reshaping the gate, classifying it to
+# select a kernel, and computing qubit indices. A Program does all of
+# this once, up front. It is a flat list of instructions:
+#
+#    (opcode, gate buffer, kernel kind, a, b, c)
+#
+# with a = qubit, or control, or control qubits,
+#      b = target, or by_0 flags of a multi gate,
+#      c = target of a multi gate,
+#
+# already at the qubit offset. Gate buffers are contiguous flattened
+# 2x2 copies, one per distinct (interned) gate, shared by all its
+# instructions. Running a program is a tight loop over these
+# instructions, which calls the kernels only (in C, with libxgates).
+#
+# The inverse program (reversed, with adjoint gates) is derived from
+# a program and cached, hence circuits which are run forwards and
+# backwards many times, eg., in VQE or test loops, are compiled once.
+#
+# The buffers of parameterized gates are updated in-place by bind().
+# Their kernel is selected by the kind of rotation, which fits any
+# angle, not by their current matrix.
+#
+param_kernels = {
+    'rx': KERNEL_GENERAL,
+    'ry': KERNEL_REAL,
+    'rz': KERNEL_DIAG,
+    'u1': KERNEL_PHASE,
+    'cu1': KERNEL_PHASE,
+}
+
+
+def execute(psi, nbits, op, gate, kind, a, b, c) -> None:
+  """Run a single instruction of a Program."""
+
+  if op == ir.Op.SINGLE.value:
+    apply1(psi, gate, nbits, a, tensor.tensor_width, kind)
+  elif op == ir.Op.CTL.value:
+    applyc(psi, gate, nbits, a, b, tensor.tensor_width, kind)
+  else:
+    applym(psi, gate, nbits, a, b, c, kind)
+
+
+class Program:
+  """A circuit, compiled to a flat list of kernel calls."""
+
+  def __init__(self, parm_ir: ir.Ir, offset: int = 0):
+    single = ir.Op.SINGLE.value
+    ctl = ir.Op.CTL.value
+    ctls = [(tuple(q + offset for q in c), by_0)
+            for c, by_0, _ in parm_ir.ctl_table]
+    instrs = []
+    for op, idx0, idx1, gate_id, ctl_id in zip(
+        parm_ir.opcodes.tolist(), parm_ir.idx0s.tolist(),
+        parm_ir.idx1s.tolist(), parm_ir.gate_ids.tolist(),
+        parm_ir.ctl_ids.tolist()):
+      if op == single:
+        instrs.append((op, gate_id, idx0 + offset, None, None))
+      elif op == ctl:
+        instrs.append((op, gate_id, idx0 + offset, idx1 + offset, None))
+      else:
+        instrs.append((op, gate_id, *ctls[ctl_id], idx1 + offset))
+    fixed = {gate_id: param_kernels[name]
+             for gate_id, (_, name, _) in parm_ir.params.items()}
+    self._link([np.asarray(g) for g in parm_ir.gate_table], instrs, fixed)
+
+  def _link(self, gates, instrs, fixed):
+    """Make gate buffers and the code from instructions on gate ids."""
+
+    self.gates = [np.array(g, order='C').reshape(4) for g in gates]
+    self.kinds = [fixed[gate_id] if gate_id in fixed else gate_kind(g)
+                  for gate_id, g in enumerate(self.gates)]
+    self.fixed = fixed
+    self.instrs = instrs
+    self.code = [(op, self.gates[gate_id], self.kinds[gate_id], a, b, c)
+                 for op, gate_id, a, b, c in instrs]
+    self.profile = collections.Counter(
+        kernel_names[self.kinds[gate_id]] for _, gate_id, *_ in instrs)
+    self._inverse = None
+
+  def __len__(self):
+    return len(self.code)
+
+  def inverse(self) -> Program:
+    """Return the (cached) inverse of this program."""
+
+    if self._inverse is None:
+      inv = Program.__new__(Program)
+      inv._link([g.reshape(2, 2).conj().T for g in self.gates],
+                self.instrs[::-1], self.fixed)
+      inv._inverse = self
+      self._inverse = inv
+    return self._inverse
+
+  def bind(self, gate_id: int, gate: np.ndarray) -> None:
+    """Update the buffer of a (parameterized) gate, and its inverse."""
+
+    self.gates[gate_id][:] = np.asarray(gate).reshape(4)
+    if self._inverse is not None:
+      self._inverse.gates[gate_id][:] = np.asarray(gate).conj().T.reshape(4)
+
+  def run(self, psi: np.ndarray, nbits: int = None,
+          repeat: int = 1) -> None:
+    """Run this program, in-place, on state psi."""
+
+    if nbits is None:
+      nbits = psi.nbits
+    width = tensor.tensor_width
+    single = ir.Op.SINGLE.value
+    ctl = ir.Op.CTL.value
+    for _ in range(repeat):
+      for op, gate, kind, a, b, c in self.code:
+        if op == single:
+          apply1(psi, gate, nbits, a, width, kind)
+        elif op == ctl:
+          applyc(psi, gate, nbits, a, b, width, kind)
+        else:
+          applym(psi, gate, nbits, a, b, c, kind)
+    for name, count in self.profile.items():
+      kernel_profile[name] += count * repeat
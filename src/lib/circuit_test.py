@@ -1,14 +1,25 @@
 # python3
 import math
+import re
 
 from absl.testing import absltest
 import numpy as np
 
 from src.lib import circuit
+from src.lib import dumpers
 from src.lib import ops
+from src.lib import pauli
 from src.lib import state
 
 
+# Functions declared in libq.h.
+libq_functions = {
+    'new_qureg', 'delete_qureg', 'print_qureg', 'flush', 'x', 'y', 'z',
+    'h', 't', 'v', 'yroot', 'cx', 'cz', 'ccx', 'u1', 'cu1', 'cv',
+    'cv_adj', 'libq_gate1', 'cmplx',
+}
+
+
 class CircuitTest(absltest.TestCase):
 
   def compare_to(self, psi, *bits):
@@ -94,6 +105,155 @@ class CircuitTest(absltest.TestCase):
     if not psi.is_close(qc.psi):
       raise AssertionError('Numerical Problems')
 
+  def test_gate_kinds(self):
+    self.assertEqual(circuit.gate_kind(ops.Hadamard()), circuit.KERNEL_REAL)
+    self.assertEqual(circuit.gate_kind(ops.PauliX()), circuit.KERNEL_ANTIDIAG)
+    self.assertEqual(circuit.gate_kind(ops.PauliY()), circuit.KERNEL_ANTIDIAG)
+    self.assertEqual(circuit.gate_kind(ops.PauliZ()), circuit.KERNEL_PHASE)
+    self.assertEqual(circuit.gate_kind(ops.Tgate()), circuit.KERNEL_PHASE)
+    self.assertEqual(circuit.gate_kind(ops.RotationZ(0.3)),
+                     circuit.KERNEL_DIAG)
+    self.assertEqual(circuit.gate_kind(ops.Vgate()), circuit.KERNEL_GENERAL)
+
+  def test_specialized_kernels(self):
+    gates = [ops.Hadamard(), ops.PauliX(), ops.PauliY(), ops.PauliZ(),
+             ops.Sgate(), ops.RotationY(0.4), ops.RotationZ(0.7),
+             ops.Vgate(), ops.Yroot()]
+
+    circuit.reset_kernel_profile()
+    psi = state.bitstring(1, 0, 1, 0)
+    qc = circuit.qc()
+    qc.bitstring(1, 0, 1, 0)
+    for i in range(4):
+      qc.h(i)
+      psi.apply1(ops.Hadamard(), i)
+    for gate in gates:
+      for i in range(4):
+        qc.apply1(gate, i, 'gate')
+        psi.apply1(gate, i)
+        qc.applyc(gate, i, (i + 1) % 4, 'cgate')
+        psi.applyc(gate, i, (i + 1) % 4)
+    self.assertTrue(psi.is_close(qc.psi))
+
+    for name in circuit.kernel_names:
+      self.assertGreater(circuit.kernel_profile[name], 0)
+    self.assertEqual(sum(circuit.kernel_profile.values()),
+                     4 + 2 * 4 * len(gates))
+
+  def test_sample(self):
+    qc = circuit.qc('bell')
+    qc.reg(3, 0)
+    qc.x(2)
+    qc.h(0)
+    qc.cx(0, 1)
+
+    # Entangled qubits must only ever be measured as 00 or 11.
+    counts = qc.sample(10000, [0, 1])
+    self.assertLen(counts, 4)
+    self.assertEqual(counts.sum(), 10000)
+    self.assertEqual(counts[1] + counts[2], 0)
+    self.assertGreater(counts[0], 4000)
+    self.assertGreater(counts[3], 4000)
+
+    counts = qc.sample(100, [2, 1])
+    self.assertEqual(counts[2] + counts[3], 100)
+
+    bits = qc.sample(1000, histogram=False)
+    self.assertEqual(bits.shape, (1000, 3))
+    self.assertTrue(np.all(bits[:, 0] == bits[:, 1]))
+    self.assertTrue(np.all(bits[:, 2] == 1))
+
+  def test_phase_estimation(self):
+    t = 4
+    sub = circuit.qc('u', eager=False)
+    sub.h(0)
+    sub.cx(0, 1)
+    sub.t(1)
+    sub.ry(0, 0.3)
+    u = ((ops.RotationY(0.3) * ops.Identity()) @
+         (ops.Identity() * ops.Tgate()) @ ops.Cnot(0, 1) @
+         (ops.Hadamard() * ops.Identity()))
+
+    # Dense reference, as in phase_estimation.expo_u.
+    psi = state.zeros(t) * state.rand(2)
+    want = ops.Hadamard(t)(psi)
+    for idx, inv in enumerate(range(t-1, -1, -1)):
+      u2 = u
+      for _ in range(idx):
+        u2 = u2(u2)
+      want = ops.ControlledU(inv, t, u2)(want, inv)
+
+    for op in [u, sub]:
+      res = circuit.phase_estimation(psi, op, t, inverse_qft=False)
+      self.assertTrue(np.allclose(res, want, atol=1e-5))
+    res = circuit.phase_estimation(psi, u, t)
+    self.assertTrue(np.allclose(res, ops.Qft(t).adjoint()(want),
+                                atol=1e-5))
+
+    # Matrix-free Grover vs. its dense matrix.
+    grover = ops.Grover(3, [2, 5])
+    psi = state.zeros(t) * state.rand(3)
+    self.assertTrue(np.allclose(
+        circuit.phase_estimation(psi, grover, t),
+        circuit.phase_estimation(psi, grover.matrix(), t), atol=1e-5))
+
+  def test_unitary_matrix(self):
+    qc = circuit.qc('u', eager=False)
+    qc.h(0)
+    qc.cx(0, 2)
+    qc.t(1)
+    qc.ry(2, 0.3)
+    qc.cu1(2, 1, 0.7)
+    u = ((ops.Identity(2) * ops.RotationY(0.3)) @
+         (ops.Identity() * ops.Tgate() * ops.Identity()) @
+         ops.Cnot(0, 2) @ (ops.Hadamard() * ops.Identity(2)))
+    u = (ops.Identity() * ops.ControlledU(1, 0, ops.U1(0.7))) @ u
+
+    mat = qc.unitary_matrix()
+    self.assertIsInstance(mat, ops.Operator)
+    self.assertTrue(np.allclose(mat, u, atol=1e-6))
+    self.assertTrue(mat.is_unitary())
+
+    cols = qc.unitary_matrix([5, 1, 6])
+    self.assertEqual(cols.shape, (8, 3))
+    self.assertTrue(np.allclose(cols, u[:, [5, 1, 6]], atol=1e-6))
+
+    # Compare against running the circuit.
+    run = circuit.qc('run')
+    run.rand(3)
+    psi = run.psi.copy()
+    run.qc(qc)
+    self.assertTrue(np.allclose(run.psi, mat @ psi, atol=1e-5))
+
+  def test_compact_ir(self):
+    qc = circuit.qc('ir', eager=False)
+    with circuit.qc.scope(qc.ir, 'outer'):
+      for i in range(100):
+        qc.h(i % 4)
+      with circuit.qc.scope(qc.ir, 'inner'):
+        qc.cu1(0, 3, 0.0)
+        qc.rx(2, 0.5)
+    qc.x(1)
+
+    self.assertEqual(qc.ir.ngates, 103)
+    self.assertLen(qc.ir.gates, 103)
+    # All 100 Hadamards share one entry in the gate table.
+    self.assertLen(qc.ir.gate_table, 4)
+    self.assertEqual(qc.ir.sections, [('outer', 0, 102), ('inner', 100, 102)])
+
+    node = qc.ir.gates[100]
+    self.assertTrue(node.is_ctl())
+    self.assertEqual((node.name, node.ctl, node.idx1), ('cu1', 0, 3))
+    self.assertEqual(node.val, 0.0)
+    self.assertTrue(np.allclose(node.gate, ops.U1(0.0)))
+    node = qc.ir.gates[-1]
+    self.assertTrue(node.is_single())
+    self.assertEqual((node.name, node.idx0, node.val), ('x', 1, None))
+    with self.assertRaises(AssertionError):
+      _ = node.ctl
+    self.assertEqual([n.idx0 for n in qc.ir.gates[:5]], [0, 1, 2, 3, 0])
+    self.assertEqual(str(qc.ir).splitlines()[0], '  |-- outer ---')
+
   def test_circuit_of_circuit(self):
     c1 = circuit.qc('c1')
     c1.reg(6, 0)
@@ -137,13 +297,182 @@ class CircuitTest(absltest.TestCase):
     for i in range(1, 8):
       self.assertLess(c.psi[i], 0.01)
 
+  def test_compile(self):
+    c = circuit.qc('c', eager=False)
+    c.reg(4, 0)
+    c.h(0)
+    c.rx(1, 0.3)
+    c.cx(0, 2)
+    c.t(2)
+    c.ccx(1, [2], 3)
+    c.cu1(3, 0, 0.7)
+
+    eager = circuit.qc('eager')
+    eager.reg(4, 0)
+    eager.qc(c)
+    c.run()
+    self.assertTrue(c.psi.is_close(eager.psi))
+
+    # Programs are cached, until the IR changes.
+    program = c.compile()
+    self.assertLen(program, 6)
+    self.assertIs(program, c.compile())
+    self.assertIs(program.inverse(), c.compile().inverse())
+    self.assertIs(program.inverse().inverse(), program)
+    c.run(inverse=True)
+    self.assertGreater(c.psi.prob(0, 0, 0, 0), 0.99)
+    c.y(3)
+    self.assertLen(c.compile(), 7)
+
+    # At an offset, as for qc.qc().
+    big = circuit.qc('big')
+    big.reg(6, 0)
+    big.qc(c, 2)
+    big.qc(c.inverse(), 2)
+    self.assertEqual(big.ir.ngates, 14)
+    self.assertEqual(big.ir.gates[4].qubits, (3, 4, 5))
+    self.assertGreater(big.psi.prob(0, 0, 0, 0, 0, 0), 0.99)
+
+  def test_parameters(self):
+    a = circuit.Parameter('a')
+    b = circuit.Parameter('b')
+    c = circuit.qc('param', eager=False)
+    c.reg(3, 0)
+    c.h(0)
+    c.rx(0, a)
+    c.ry(1, b)
+    c.rz(2, a)
+    c.cu1(0, 2, b)
+    c.u1(1, a)
+    c.rx(2, a)
+    self.assertEqual(c.parameters, [a, b])
+    self.assertLen(c.ir.params, 5)
+    program = c.compile()
+
+    for vals in [(0.3, 1.2), (0.0, 0.0), (-2.0, 0.5)]:
+      c.bind(vals)
+      self.assertIs(c.compile(), program)
+      c.psi = state.zeros(3)
+      c.run()
+
+      expected = circuit.qc('expected')
+      expected.reg(3, 0)
+      expected.h(0)
+      expected.rx(0, vals[0])
+      expected.ry(1, vals[1])
+      expected.rz(2, vals[0])
+      expected.cu1(0, 2, vals[1])
+      expected.u1(1, vals[0])
+      expected.rx(2, vals[0])
+      self.assertTrue(c.psi.is_close(expected.psi))
+      self.assertEqual(c.ir.gates[5].val, vals[0])
+
+      # The (cached) inverse follows the bound values.
+      c.run(inverse=True)
+      self.assertTrue(c.psi.is_close(state.zeros(3)))
+
+    for name, make_gate in [('rx', ops.RotationX), ('ry', ops.RotationY),
+                            ('rz', ops.RotationZ), ('u1', ops.U1)]:
+      self.assertTrue(np.allclose(circuit.rotation(name, 0.7),
+                                  make_gate(0.7), atol=1e-6))
+
+    # Parameters survive inverse and optimization.
+    c.bind({b: 0.0})
+    inv = c.inverse()
+    self.assertEqual(inv.parameters, [a, b])
+    c.optimize()
+    self.assertEqual(c.ir.ngates, 7)
+    inv.bind([0.4, 0.9])
+    c.bind([0.4, 0.9])
+    c.psi = state.zeros(3)
+    c.run()
+    inv.apply_to(c.psi, 3)
+    self.assertTrue(c.psi.is_close(state.zeros(3)))
+
+  def test_gradient(self):
+    params = [circuit.Parameter(f'p{i}') for i in range(4)]
+    sub = circuit.qc('sub', eager=False)
+    sub.reg(3, 0)
+    sub.ry(1, params[3])
+    sub.cx(1, 2)
+    sub.rz(2, params[0])
+
+    c = circuit.qc('grad', eager=False)
+    c.reg(3, 0)
+    c.h(0)
+    c.rx(0, params[0])
+    c.ry(1, params[1])
+    c.cx(0, 1)
+    c.rz(2, params[2])
+    c.cu1(1, 2, params[1])
+    c.ccx(0, [1], 2)
+    c.u1(0, params[3])
+    c.rx(2, params[0])
+    c.qc(sub.inverse())
+    c.ry(0, params[2])
+    hamil = pauli.PauliSum([(0.5, 'ZIX'), (-1.0, 'XYZ'), (0.7, 'IZZ')])
+
+    def energy(values):
+      c.bind(values)
+      psi = state.zeros(3)
+      c.compile().run(psi)
+      return hamil.expectation(psi)
+
+    values = [0.3, -1.1, 2.0, 0.8]
+    eps = 1e-3
+    expected = []
+    for i in range(4):
+      plus = list(values)
+      minus = list(values)
+      plus[i] += eps
+      minus[i] -= eps
+      expected.append((energy(plus) - energy(minus)) / (2 * eps))
+
+    c.bind(values)
+    grads = c.gradient(hamil)
+    self.assertTrue(np.allclose(grads, expected, atol=2e-3))
+    self.assertTrue(np.allclose(c.gradient(hamil.matrix(), params[2:]),
+                                grads[2:], atol=1e-5))
+
   def test_multi1(self):
     c = circuit.qc('multi', eager=False)
     c.reg(6)
     aux = c.reg(6)
     ctl = [0, 1, 2, 3, 4]
     c.multi_control(ctl, 5, aux, ops.PauliX(), f'multi-x({ctl}, 5)')
-    self.assertEqual(41, c.ir.ngates)
+    self.assertEqual(1, c.ir.ngates)
+    self.assertEqual(41, c.ir.lower().ngates)
+
+  def test_multi_native(self):
+    qc = circuit.qc('multi', eager=False)
+    qc.reg(4)
+    aux = qc.reg(2)
+    qc.ccx(0, [1], 2)
+    qc.multi_control([0, [1], 2], 3, aux, ops.Hadamard(), 'mh')
+    qc.cswap([3], 0, 2)
+    self.assertEqual(qc.ir.ngates, 5)
+    self.assertEqual(str(qc.ir.gates[0]), 'ccx([0, [1]], 2)')
+    self.assertEqual(qc.ir.gates[1].qubits, (0, 1, 2, 3))
+
+    # The lowered circuit matches on all states with aux in |0>.
+    lowered = circuit.qc('lowered', eager=False)
+    lowered.ir = qc.ir.lower()
+    self.assertEqual(lowered.ir.ngates, 7 + 25 + 3 * 7)
+    columns = [i << 2 for i in range(16)]
+    self.assertTrue(np.allclose(qc.unitary_matrix(columns),
+                                lowered.unitary_matrix(columns), atol=1e-5))
+    self.assertIn('cv_adj', dumpers.qasm(qc.ir))
+
+    # Inverse and replay keep the gates native.
+    inv = qc.inverse()
+    self.assertEqual(inv.ir.ngates, 5)
+    both = circuit.qc('both')
+    both.reg(4, 5)
+    both.reg(2)
+    both.qc(qc)
+    both.qc(inv)
+    self.assertEqual(both.ir.ngates, 10)
+    self.assertGreater(both.psi.prob(0, 1, 0, 1, 0, 0), 0.99)
 
   def test_multi0(self):
     c = circuit.qc('multi', eager=True)
@@ -287,10 +616,180 @@ class CircuitTest(absltest.TestCase):
     for _ in range(15, 0, -1):
       decr(qc, 0, 4, aux, [])
 
-    # print(qc.stats())
+    ngates = qc.ir.ngates
+    stats = qc.optimize()
+    self.assertEqual(ngates - qc.ir.ngates, sum(stats.values()))
+
+  def test_optimizer(self):
+    def build():
+      qc = circuit.qc('opt')
+      qc.reg(3, 0)
+      qc.h(0)
+      qc.x(1)
+      qc.x(1)
+      qc.h(0)          # h x x h -> nothing
+      qc.h(2)
+      qc.cx(1, 2)
+      qc.cx(1, 2)      # cx cx -> nothing
+      qc.rz(1, 0.25)
+      qc.rz(1, 0.5)    # rz rz -> rz(0.75)
+      qc.u1(2, 0.0)    # identity
+      qc.cu1(0, 1, 0.5)
+      qc.cu1(0, 1, -0.5)  # cu1 cu1 -> cu1(0) -> nothing
+      qc.t(0)
+      qc.v(2)
+      qc.cx(0, 2)
+      return qc
+
+    qc = build()
+    stats = qc.optimize()
+    self.assertEqual(stats['inverse'], 6)
+    self.assertEqual(stats['rotation'], 2)
+    self.assertEqual(stats['identity'], 2)
+    self.assertEqual(stats['fuse'], 1)  # h(2) v(2) -> u(2)
+    self.assertEqual(qc.ir.ngates, 4)
+    self.assertTrue(circuit.circuits_equivalent(build(), qc))
+
+  def test_optimizer_commute(self):
+    def build():
+      qc = circuit.qc('commute')
+      qc.reg(3, 0)
+      qc.h(2)
+      qc.t(0)
+      qc.cx(0, 1)     # t commutes with the control of cx
+      qc.cx(2, 1)     # cx targets commute
+      qc.u1(0, -math.pi/4)  # ... and cancels t
+      qc.cv(0, 2)
+      qc.cx(0, 1)     # cx(0, 1) cx(2, 1) cx(0, 1) -> cx(2, 1)
+      qc.cv(1, 2)
+      qc.cv(0, 2)     # cv cv -> cx, which cancels the next cx
+      qc.rz(1, 0.5)
+      qc.cx(0, 2)
+      qc.rz(1, 0.25)  # rz rz -> rz(0.75)
+      qc.h(1)
+      qc.h(0)
+      return qc
+
+    qc = build()
+    stats = qc.optimize()
+    self.assertEqual(stats['commute'], 7)
+    self.assertEqual(stats['rotation'], 1)
+    self.assertEqual(stats['fuse'], 1)  # rz(1) h(1) -> u(1)
+    self.assertEqual(qc.ir.ngates, 5)
+    self.assertIn('Removed by optimizer: 9', qc.stats())
+    self.assertTrue(circuit.circuits_equivalent(build(), qc))
+
+    # Larger circuits with many cv/cx from lowered ccx gates.
+    def build_walk():
+      qc = circuit.qc('walk', eager=False)
+      qc.reg(4, 0)
+      aux = qc.reg(4, 0)
+      for _ in range(3):
+        qc.h(3)
+        for i in range(3):
+          ctl = [3] + [[j] for j in range(2, i, -1)]
+          qc.multi_control(ctl, i, aux, ops.PauliX(), 'multi-X')
+      qc.ir = qc.ir.lower()
+      return qc
+
+    qc = build_walk()
+    ngates = qc.ir.ngates
+    stats = qc.optimize()
+    self.assertGreater(stats['commute'], 0)
+    self.assertEqual(ngates - qc.ir.ngates, sum(stats.values()))
+    self.assertTrue(circuit.circuits_equivalent(build_walk(), qc))
+
+  def test_optimizer_libq(self):
+    qc = circuit.qc('t only')
+    qc.reg(2, 0)
+    qc.t(0)
+    qc.t(0)
+    qc.cx(0, 1)
+    for _ in range(6):
+      qc.t(1)
     qc.optimize()
-    # print(qc.stats())
+    self.assertEqual([op.name for op in qc.ir.gates], ['s', 'cx', 'u1'])
+
+    # Only gates provided by libq.h, s becomes u1.
+    src = dumpers.libq(qc.ir)
+    self.assertContainsSubset(set(re.findall(r'libq::(\w+)\(', src)),
+                              libq_functions)
+    self.assertIn('libq::u1(0, M_PI/2, q);', src)
+    self.assertIn('libq::u1(1, -M_PI/2, q);', src)
 
+    # And as s, sdg in qasm and cirq.
+    qc = circuit.qc('s and sdag')
+    qc.reg(2, 0)
+    qc.s(0)
+    qc.sdag(1)
+    qc.t(1)
+    src = dumpers.qasm(qc.ir)
+    self.assertIn('\ns ', src)
+    self.assertIn('\nsdg ', src)
+    self.assertIn('\nt ', src)
+    src = dumpers.cirq(qc.ir)
+    self.assertIn('qc.append(cirq.S(r[0]))', src)
+    self.assertIn('qc.append((cirq.S**-1).on(r[1]))', src)
+    self.assertIn('qc.append(cirq.T(r[1]))', src)
+
+  def test_optimizer_fuse(self):
+    def build():
+      qc = circuit.qc('fuse')
+      qc.reg(3, 0)
+      for layer in range(6):
+        qc.h(0)
+        qc.t(0)
+        qc.v(1)
+        qc.yroot(1)
+        qc.rx(2, 0.1 * layer)
+        qc.rz(2, 0.3)
+        qc.t(2)
+        qc.cz(layer % 2, 2)
+      qc.cx(1, 0)
+      qc.t(0)
+      qc.t(0)
+      return qc
+
+    qc = build()
+    stats = qc.optimize()
+    self.assertGreater(stats['fuse'], 0)
+    self.assertTrue(circuit.circuits_equivalent(build(), qc))
+
+    # No runs of single-qubit gates are left.
+    last = {}
+    for op in qc.ir.gates:
+      if op.is_single():
+        self.assertFalse(last.get(op.idx0, False))
+        last[op.idx0] = True
+      else:
+        last[op.ctl] = last[op.idx1] = False
+
+    # t t at the end becomes s.
+    self.assertEqual(qc.ir.gates[-1].name, 's')
+    self.assertIn('u3(', dumpers.qasm(qc.ir))
+    self.assertLess(len(dumpers.qasm(qc.ir)), len(dumpers.qasm(build().ir)))
+
+    # Fused runs are named only with gates every dumper can emit, all
+    # others are u1 or 'u' gates.
+    qc = circuit.qc('fuse named')
+    qc.reg(3, 0)
+    qc.s(0)
+    qc.z(0)
+    qc.t(1)
+    qc.u1(1, math.pi/4)
+    qc.h(2)
+    qc.s(2)
+    qc.h(2)
+    qc.optimize()
+    self.assertEqual([op.name for op in qc.ir.gates], ['u1', 'u1', 'u'])
+    src = dumpers.libq(qc.ir)
+    self.assertContainsSubset(set(re.findall(r'libq::(\w+)\(', src)),
+                              libq_functions)
+    src = dumpers.qasm(qc.ir)
+    self.assertEqual(re.findall(r'^(\w+)', src, re.M)[2:],
+                     ['u1', 'u1', 'u3'])
+    src = dumpers.cirq(qc.ir)
+    self.assertEqual(src.count('cirq.MatrixGate(m).on('), 3)
 
 if __name__ == '__main__':
   absltest.main()
@@ -3,7 +3,13 @@
 
 """Various output formats for the compiler IR."""
 
+# These formats support only single and controlled gates, hence every
+# dumper first lowers multi-controlled gates, see ir.lower().
+
+import math
+
 from src.lib import helper
+from src.lib import ops
 
 
 def reg2str(ir, idx):
@@ -15,9 +21,23 @@ def reg2str(ir, idx):
   return '???'
 
 
+def u_params(op):
+  """Angles theta, phi, lam of a fused 'u' gate (see ops.ZYDecompose)."""
+
+  # The global phase is dropped, it is not observable.
+  _, beta, gamma, delta = ops.ZYDecompose(op.gate)
+  return gamma, beta, delta
+
+
+# Gates with a different name in qasm's qelib1.inc.
+qasm_names = {'sdag': 'sdg'}
+
+
 def qasm(ir) -> str:
   """Dump IR in qasm format."""
 
+  ir = ir.lower()
+
   res = 'OPENQASM 2.0;\n'
   for regs in ir.regset:
     res += f'qreg {regs[0]}[{regs[1]}];\n'
@@ -25,7 +45,14 @@ def qasm(ir) -> str:
 
   for op in ir.gates:
     if op.is_gate():
-      res += op.name
+      if op.name == 'u':
+        # Fused gates are products of single precision matrices, hence
+        # we match fractions of pi with a matching tolerance.
+        res += 'u3({})'.format(','.join(
+            helper.pi_fractions(angle, atol=1e-6) for angle in u_params(op)))
+        res += f' {reg2str(ir, op.idx0)};\n'
+        continue
+      res += qasm_names.get(op.name, op.name)
       if op.val is not None:
         res += '({})'.format(helper.pi_fractions(op.val))
       if op.is_single():
@@ -35,9 +62,16 @@ def qasm(ir) -> str:
   return res
 
 
+# Gates which libq doesn't provide (but the optimizer may produce, eg.,
+# t t -> s), as phase gates u1(gamma).
+libq_phases = {'s': math.pi / 2, 'sdag': -math.pi / 2}
+
+
 def libq(ir) -> str:
   """Dump IR to a compilable C++ program with libq."""
 
+  ir = ir.lower()
+
   res = ('// This file was generated by qc.dump_to_file()\n\n' +
          '#include <math.h>\n' +
          '#include <stdio.h>\n\n' +
@@ -60,6 +94,16 @@ def libq(ir) -> str:
   for op in ir.gates:
 
     if op.is_gate():
+      if op.name == 'u':
+        m = ', '.join(f'libq::cmplx({val.real}, {val.imag})'
+                      for val in op.gate.reshape(4))
+        res += f'  {{\n    libq::cmplx m[4] = {{{m}}};\n'
+        res += f'    libq::libq_gate1({op.idx0}, m, q);\n  }}\n'
+        continue
+      if op.name in libq_phases and op.is_single():
+        gamma = helper.pi_fractions(libq_phases[op.name], 'M_PI')
+        res += f'  libq::u1({op.idx0}, {gamma}, q);\n'
+        continue
       res += f'  libq::{op.name}('
 
       if op.is_single():
@@ -85,6 +129,8 @@ def libq(ir) -> str:
 def cirq(ir) -> str:
   """Dump IR to a Cirq Python file."""
 
+  ir = ir.lower()
+
   res = ('# This file was generated by qc.dump_to_file()\n\n' +
          'import cirq\n' +
          'import cmath\n' +
@@ -95,7 +141,7 @@ def cirq(ir) -> str:
   res += f'r = cirq.LineQubit.range({ir.nregs})\n'
   res += '\n'
 
-  op_map = {'h': 'H', 'x': 'X', 'y': 'Y', 'z': 'Z',
+  op_map = {'h': 'H', 'x': 'X', 'y': 'Y', 'z': 'Z', 's': 'S', 't': 'T',
             'cx': 'CX', 'cz': 'CZ'}
 
   for op in ir.gates:
@@ -113,6 +159,17 @@ def cirq(ir) -> str:
                 f'(r[{op.idx0}], r[{op.idx1}]))\n')
         continue
 
+      if op.name == 'u':
+        m = op.gate
+        res += ('m = np.array([({}, {}), ({}, {})])\n'
+                .format(m[0, 0], m[0, 1], m[1, 0], m[1, 1]))
+        res += f'qc.append(cirq.MatrixGate(m).on(r[{op.idx0}]))\n'
+        continue
+
+      if op.name == 'sdag':
+        res += f'qc.append((cirq.S**-1).on(r[{op.idx0}]))\n'
+        continue
+
       if op.name == 'cv':
         res += 'm = np.array([(1+1j, 1-1j), (1-1j, 1+1j)]) * 0.5\n'
         res += ('qc.append(cirq.MatrixGate(m).controlled()' +
@@ -153,6 +210,8 @@ def cirq(ir) -> str:
 def latex(ir) -> str:
   """Minimal Dumper to quantikz Latex Format."""
 
+  ir = ir.lower()
+
   # First let's create a matrix according to circuit size,
   # before populating it with gates or lines.
   larr = []
@@ -172,6 +231,8 @@ def latex(ir) -> str:
       name = name.replace('_adj', r'^\dagger')
       if op.name == 'h':
         name = 'H'
+      if op.name == 'u':
+        name = 'U'
       if op.name == 'cu1' or op.name == 'u1':
         name = ''
       if op.val is not None:
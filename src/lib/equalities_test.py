@@ -4,6 +4,7 @@ from absl.testing import absltest
 import numpy as np
 
 from src.lib import bell
+from src.lib import circuit
 from src.lib import helper
 from src.lib import ops
 from src.lib import state
@@ -162,6 +163,36 @@ class EqualitiesTest(absltest.TestCase):
     self.assertTrue((rz1 @ c).is_close(c @ rz1))
     self.assertTrue((rx2 @ c).is_close(c @ rx2))
 
+  def test_circuit_equalities(self):
+    def make(*gates):
+      qc = circuit.qc('eq', eager=False)
+      for gate, *args in gates:
+        getattr(qc, gate)(*args)
+      return qc
+
+    # Same as test_control_equalities and test_had_cnot_had, but via
+    # random input states through the simulator.
+    self.assertTrue(circuit.circuits_equivalent(
+        make(('cx', 0, 1), ('x', 0), ('cx', 0, 1)),
+        make(('x', 0), ('x', 1))))
+    self.assertTrue(circuit.circuits_equivalent(
+        make(('cx', 0, 1), ('z', 1), ('cx', 0, 1)),
+        make(('z', 0), ('z', 1))))
+    self.assertTrue(circuit.circuits_equivalent(
+        make(('h', 0), ('h', 1), ('cx', 0, 1), ('h', 0), ('h', 1)),
+        make(('cx', 1, 0))))
+    self.assertTrue(circuit.circuits_equivalent(
+        make(('cx', 0, 2), ('cx', 2, 0), ('cx', 0, 2)),
+        make(('swap', 0, 2))))
+    self.assertFalse(circuit.circuits_equivalent(
+        make(('cx', 0, 1)), make(('cx', 1, 0))))
+
+    # XYX = -Y, equal only up to a global phase.
+    xyx = make(('x', 0), ('y', 0), ('x', 0))
+    self.assertFalse(circuit.circuits_equivalent(xyx, make(('y', 0))))
+    self.assertTrue(circuit.circuits_equivalent(xyx, make(('y', 0)),
+                                                up_to_phase=True))
+
   def test_partial(self):
     """Test partial trace."""
 
@@ -204,6 +235,20 @@ class EqualitiesTest(absltest.TestCase):
     self.assertTrue(math.isclose(np.real(reduced[0, 0]), 0.25))
     self.assertTrue(math.isclose(np.real(reduced[1, 1]), 0.75))
 
+  def test_reduced_density(self):
+    psi = state.State(np.random.random(2**5) + 1j * np.random.random(2**5))
+    psi.normalize()
+    rho = psi.density()
+    for index_set, kept in [([0], [1, 2, 3, 4]),
+                            ([0, 2], [1, 3, 4]),
+                            ([2, 3], [0, 1, 4]),
+                            ([4, 1], [1, 2, 3])]:
+      reduced = ops.TraceOut(rho, index_set)
+      self.assertTrue(reduced.is_close(psi.reduced_density(kept)))
+
+    reduced = ops.TraceOutSingle(rho, 3)
+    self.assertTrue(reduced.is_close(psi.reduced_density([0, 1, 2, 4])))
+
   def test_bloch_coords(self):
     psi = state.bitstring(1, 1)
     psi = ops.Qft(2)(psi)
@@ -68,16 +68,17 @@ def qubit_dump_bloch(psi: np.ndarray):
   dump_bloch(x, y, z)
 
 
-def pi_fractions(val: float, pi: str = 'pi') -> str:
-  """Convert a value in fractions of pi."""
+def pi_fractions(val: float, pi: str = 'pi', atol: float = 0.0) -> str:
+  """Convert a value in fractions of pi (within tolerance atol)."""
 
   if val is None:
     return ''
-  if val == 0:
+  if abs(val) <= atol:
     return '0'
   for pi_multiplier in range(1, 4):
     for denom in range(-128, 128):
-      if denom and math.isclose(val, pi_multiplier * math.pi / denom):
+      if denom and math.isclose(val, pi_multiplier * math.pi / denom,
+                                abs_tol=atol):
         pi_str = ''
         if pi_multiplier != 1:
           pi_str = f'{abs(pi_multiplier)}*'
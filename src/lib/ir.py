@@ -5,7 +5,10 @@
 
 import enum
 
+import numpy as np
+
 from src.lib import helper
+from src.lib import ops
 
 
 class Op(enum.Enum):
@@ -14,18 +17,39 @@ class Op(enum.Enum):
   CTL = 2
   SECTION = 3
   END_SECTION = 4
+  MULTI = 5
+
+
+# The IR is stored as a 'struct of arrays'. Instead of a Python object
+# per gate, each holding its own operator matrix and name string, the
+# IR keeps one NumPy array per field (opcode, qubit indices, parameter,
+# gate and name id). Gates and names are interned, identical gates,
+# like the many Hadamards in a circuit, are stored only once in the
+# gate table. This makes a gate cost about 25 bytes and allows circuits
+# with 10^7+ gates.
+#
+# Sections (see qc.scope) are not stored as nodes. They are markers
+# at gate indices, with each section covering a range of gates.
+#
+# Node objects are lightweight views into these arrays, they are
+# created on demand, eg., when iterating over ir.gates.
+#
+# Multi-controlled gates (Op.MULTI), like ccx, are single nodes. They
+# reference an interned entry in the control table, which holds the
+# control qubits, whether each control is by |0> (instead of |1>), and
+# the ancillas to use for a decomposition. The simulator executes
+# these gates natively. Only targets that need 1- and 2-qubit gates,
+# like the dumpers, lower them via lower(), see below.
 
 
 class Node:
-  """Single node in the IR."""
+  """Single node in the IR, a view into the IR arrays."""
+
+  __slots__ = ('_ir', '_i')
 
-  def __init__(self, opcode, name, idx0, idx1, gate, val):
-    self._opcode = opcode
-    self._name = name
-    self._idx0 = idx0
-    self._idx1 = idx1
-    self._gate = gate
-    self._val = val
+  def __init__(self, ir, i):
+    self._ir = ir
+    self._i = i
 
   def __str__(self):
     s = ''
@@ -33,68 +57,133 @@ class Node:
       s = '{}({})'.format(self.name, self.idx0)
     if self.is_ctl():
       s = '{}({}, {})'.format(self.name, self.ctl, self.idx1)
-    if self._val:
+    if self.is_multi():
+      s = '{}({}, {})'.format(self.name, ctl_list(self.ctls, self.ctl_by_0),
+                              self.idx1)
+    if self.val:
       s += '({})'.format(helper.pi_fractions(self.val))
-    if self.is_section():
-      s += '|-- {} ---'.format(self.name)
-    if self.is_end_section():
-      s += ''
     return s
 
   def is_single(self):
-    return self._opcode == Op.SINGLE
+    return self._ir._opcode[self._i] == Op.SINGLE.value
 
   def is_ctl(self):
-    return self._opcode == Op.CTL
+    return self._ir._opcode[self._i] == Op.CTL.value
+
+  def is_multi(self):
+    return self._ir._opcode[self._i] == Op.MULTI.value
 
   def is_gate(self):
-    return self.is_single() or self.is_ctl()
+    return self.is_single() or self.is_ctl() or self.is_multi()
 
   def is_section(self):
-    return self._opcode == Op.SECTION
+    return False
 
   def is_end_section(self):
-    return self._opcode == Op.END_SECTION
+    return False
+
+  @property
+  def index(self):
+    return self._i
 
   @property
   def opcode(self):
-    return self._opcode
+    return Op(int(self._ir._opcode[self._i]))
 
   @property
   def name(self):
-    if not self._name:
+    name = self.desc
+    if not name:
       return '*unk*'
-    return self._name
+    return name
 
   @property
   def desc(self):
-    return self._name
+    return self._ir.names[self._ir._name_id[self._i]]
 
   @property
   def idx0(self):
     if not self.is_single():
       raise AssertionError('Invalid use of idx0(), must be single gate.')
-    return self._idx0
+    return int(self._ir._idx0[self._i])
 
   @property
   def ctl(self):
     if not self.is_ctl():
       raise AssertionError('Invalid use of ctl(), must be controlled gate.')
-    return self._idx0
+    return int(self._ir._idx0[self._i])
 
   @property
   def idx1(self):
-    if not self.is_ctl():
+    if not self.is_ctl() and not self.is_multi():
       raise AssertionError('Invalid use of idx1(), must be controlled gate.')
-    return self._idx1
+    return int(self._ir._idx1[self._i])
+
+  @property
+  def ctls(self):
+    if not self.is_multi():
+      raise AssertionError('Invalid use of ctls(), must be multi gate.')
+    return self._ir.ctl_table[self._ir._ctl_id[self._i]][0]
+
+  @property
+  def ctl_by_0(self):
+    if not self.is_multi():
+      raise AssertionError('Invalid use of ctl_by_0(), must be multi gate.')
+    return self._ir.ctl_table[self._ir._ctl_id[self._i]][1]
+
+  @property
+  def aux(self):
+    if not self.is_multi():
+      raise AssertionError('Invalid use of aux(), must be multi gate.')
+    return self._ir.ctl_table[self._ir._ctl_id[self._i]][2]
+
+  @property
+  def qubits(self):
+    if self.is_ctl():
+      return (self.ctl, self.idx1)
+    if self.is_multi():
+      return self.ctls + (self.idx1,)
+    return (self.idx0,)
 
   @property
   def val(self):
-    return self._val
+    val = self._ir._val[self._i]
+    return None if np.isnan(val) else float(val)
+
+  @property
+  def gate_id(self):
+    return int(self._ir._gate_id[self._i])
 
   @property
   def gate(self):
-    return self._gate
+    return self._ir.gate_table[self._ir._gate_id[self._i]]
+
+  @property
+  def param(self):
+    return self._ir.params.get(self.gate_id)
+
+
+class Gates:
+  """Sequence of Node views over the gates of an IR."""
+
+  def __init__(self, ir):
+    self._ir = ir
+
+  def __len__(self):
+    return self._ir.ngates
+
+  def __getitem__(self, idx):
+    if isinstance(idx, slice):
+      return [Node(self._ir, i) for i in range(*idx.indices(len(self)))]
+    if idx < 0:
+      idx += len(self)
+    if idx < 0 or idx >= len(self):
+      raise IndexError('IR gate index out of range.')
+    return Node(self._ir, idx)
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield Node(self._ir, i)
 
 
 class Ir:
@@ -102,47 +191,359 @@ class Ir:
 
   def __init__(self):
     self._ngates = 0  # gates in this IR
-    self.gates = []   # [] of gates
     self.regs = []    # [] of tuples (global reg index, name, reg index)
     self.nregs = 0    # number of registers
     self.regset = []  # [] of tuples (name, size, reg) for register files
 
+    # Gate arrays, with capacity >= ngates.
+    self._opcode = np.zeros(16, dtype=np.int8)
+    self._idx0 = np.zeros(16, dtype=np.int32)
+    self._idx1 = np.zeros(16, dtype=np.int32)
+    self._val = np.zeros(16, dtype=np.float64)
+    self._gate_id = np.zeros(16, dtype=np.int32)
+    self._name_id = np.zeros(16, dtype=np.int32)
+    self._ctl_id = np.zeros(16, dtype=np.int32)
+
+    # Interned gates, names, and controls of multi gates, as tuples
+    # (control qubits, by_0 flags, aux qubits).
+    self.gate_table = []
+    self.names = []
+    self.ctl_table = []
+    self._gate_ids = {}
+    self._name_ids = {}
+    self._ctl_ids = {}
+
+    # Gates of parameterized rotations are interned by their parameter,
+    # not their matrix, as (parameter, rotation name, adjoint) tuples.
+    # All gates on the same parameter share one gate id, binding a
+    # value to a parameter updates their matrix in the gate table.
+    self.params = {}   # gate id -> (parameter, name, adjoint)
+    self._param_gates = None
+
+    # Section markers, in order, as (gate index, desc or None for end).
+    self.markers = []
+
   def __str__(self):
     nesting = 0
     s = ''
-    for node in self.gates:
-      if node.is_section():
-        nesting = nesting + 1
-      if node.is_end_section():
-        nesting = nesting - 1
-        continue
-      s = s + ('  ' * nesting) + str(node) + '\n'
+    markers = iter(self.markers + [(self.ngates + 1, None)])
+    marker = next(markers)
+    for i in range(self.ngates + 1):
+      while marker[0] == i:
+        if marker[1] is None:
+          nesting = nesting - 1
+        else:
+          nesting = nesting + 1
+          s = s + ('  ' * nesting) + '|-- {} ---'.format(marker[1]) + '\n'
+        marker = next(markers)
+      if i < self.ngates:
+        s = s + ('  ' * nesting) + str(Node(self, i)) + '\n'
     return s
 
+  @property
+  def gates(self):
+    return Gates(self)
+
+  @property
+  def sections(self):
+    """List of (desc, start, end) gate index ranges of all sections."""
+
+    res = []
+    stack = []
+    for idx, desc in self.markers:
+      if desc is not None:
+        stack.append(len(res))
+        res.append([desc, idx, None])
+      else:
+        res[stack.pop()][2] = idx
+    return [tuple(sec) for sec in res]
+
+  # Read-only views of the gate arrays, for passes over the whole IR.
+  @property
+  def opcodes(self):
+    return self._opcode[:self._ngates]
+
+  @property
+  def idx0s(self):
+    return self._idx0[:self._ngates]
+
+  @property
+  def idx1s(self):
+    return self._idx1[:self._ngates]
+
+  @property
+  def vals(self):
+    return self._val[:self._ngates]
+
+  @property
+  def gate_ids(self):
+    return self._gate_id[:self._ngates]
+
+  @property
+  def name_ids(self):
+    return self._name_id[:self._ngates]
+
+  @property
+  def ctl_ids(self):
+    return self._ctl_id[:self._ngates]
+
+  @property
+  def qubits(self):
+    """List of tuples of the qubits each gate acts on, target last."""
+
+    single = Op.SINGLE.value
+    ctl = Op.CTL.value
+    res = []
+    for op, idx0, idx1, ctl_id in zip(self.opcodes.tolist(),
+                                      self.idx0s.tolist(),
+                                      self.idx1s.tolist(),
+                                      self.ctl_ids.tolist()):
+      if op == single:
+        res.append((idx0,))
+      elif op == ctl:
+        res.append((idx0, idx1))
+      else:
+        res.append(self.ctl_table[ctl_id][0] + (idx1,))
+    return res
+
+  @property
+  def has_multi(self):
+    return bool(np.any(self.opcodes == Op.MULTI.value))
+
   def reg(self, size, name, register):
     self.regset.append((name, size, register))
     for i in range(size):
       self.regs.append((self.nregs + i, name, i))
     self.nregs += size
 
-  def add_node(self, node):
-    self.gates.append(node)
-    self._ngates += 1
-
-  def single(self, name, idx0, gate, val=None):
-    self.gates.append(Node(Op.SINGLE, name, idx0, None, gate, val))
+  def intern_gate(self, gate, param=None):
+    """Return the id of gate in the gate table, adding it if needed."""
+
+    if param is not None:
+      key = tuple(param)
+    else:
+      data = np.asarray(gate)
+      key = (data.shape, data.dtype.str, data.tobytes())
+    gate_id = self._gate_ids.get(key)
+    if gate_id is None:
+      gate_id = len(self.gate_table)
+      self.gate_table.append(gate)
+      self._gate_ids[key] = gate_id
+      if param is not None:
+        self.params[gate_id] = key
+    return gate_id
+
+  def intern_name(self, name):
+    name_id = self._name_ids.get(name)
+    if name_id is None:
+      name_id = len(self.names)
+      self.names.append(name)
+      self._name_ids[name] = name_id
+    return name_id
+
+  def intern_ctl(self, ctls, by_0, aux):
+    key = (tuple(ctls), tuple(by_0), tuple(aux))
+    ctl_id = self._ctl_ids.get(key)
+    if ctl_id is None:
+      ctl_id = len(self.ctl_table)
+      self.ctl_table.append(key)
+      self._ctl_ids[key] = ctl_id
+    return ctl_id
+
+  def _reserve(self, size):
+    """Grow the gate arrays (by doubling) to a capacity >= size."""
+
+    cap = self._opcode.shape[0]
+    if size <= cap:
+      return
+    while cap < size:
+      cap *= 2
+    n = self._ngates
+    for field in ('_opcode', '_idx0', '_idx1', '_val',
+                  '_gate_id', '_name_id', '_ctl_id'):
+      arr = getattr(self, field)
+      grown = np.zeros(cap, dtype=arr.dtype)
+      grown[:n] = arr[:n]
+      setattr(self, field, grown)
+
+  def _append(self, opcode, name, idx0, idx1, gate, val, ctl_id=-1,
+              param=None):
+    n = self._ngates
+    self._reserve(n + 1)
+    self._opcode[n] = opcode.value
+    self._idx0[n] = idx0
+    self._idx1[n] = idx1 if idx1 is not None else -1
+    self._val[n] = np.nan if val is None else val
+    self._gate_id[n] = self.intern_gate(gate, param)
+    self._name_id[n] = self.intern_name(name)
+    self._ctl_id[n] = ctl_id
     self._ngates += 1
 
-  def controlled(self, name, idx0, idx1, gate, val=None):
-    self.gates.append(Node(Op.CTL, name, idx0, idx1, gate, val))
-    self._ngates += 1
+  def add_node(self, node):
+    if node.is_single():
+      self.single(node.desc, node.idx0, node.gate, node.val, node.param)
+    if node.is_ctl():
+      self.controlled(node.desc, node.ctl, node.idx1, node.gate, node.val,
+                      node.param)
+    if node.is_multi():
+      self.multi(node.desc, node.ctls, node.ctl_by_0, node.idx1,
+                 node.gate, node.aux, node.val, node.param)
+
+  def extend(self, other, offset=0):
+    """Append all gates of IR other, with qubits shifted by offset."""
+
+    # Instead of adding gates one by one, the gate arrays of other are
+    # copied in bulk. Only its (small) interned tables are mapped to
+    # the tables of this IR. As with add_node(), sections of other
+    # are not copied.
+    n, m = self._ngates, other.ngates
+    if not m:
+      return
+    self._reserve(n + m)
+    gate_map = np.array([self.intern_gate(g, other.params.get(gate_id))
+                         for gate_id, g in enumerate(other.gate_table)],
+                        dtype=np.int32)
+    name_map = np.array([self.intern_name(name) for name in other.names],
+                        dtype=np.int32)
+
+    # Single and controlled gates have ctl_id -1, which picks the
+    # trailing -1 of ctl_map.
+    ctl_map = np.array([self.intern_ctl(tuple(q + offset for q in ctls),
+                                        by_0,
+                                        tuple(q + offset for q in aux))
+                        for ctls, by_0, aux in other.ctl_table] + [-1],
+                       dtype=np.int32)
+    idx1s = other.idx1s
+    self._opcode[n:n+m] = other.opcodes
+    self._idx0[n:n+m] = other.idx0s + offset
+    self._idx1[n:n+m] = np.where(idx1s >= 0, idx1s + offset, idx1s)
+    self._val[n:n+m] = other.vals
+    self._gate_id[n:n+m] = gate_map[other.gate_ids]
+    self._name_id[n:n+m] = name_map[other.name_ids]
+    self._ctl_id[n:n+m] = ctl_map[other.ctl_ids]
+    self._ngates += m
+
+  def single(self, name, idx0, gate, val=None, param=None):
+    self._append(Op.SINGLE, name, idx0, None, gate, val, param=param)
+
+  def controlled(self, name, idx0, idx1, gate, val=None, param=None):
+    self._append(Op.CTL, name, idx0, idx1, gate, val, param=param)
+
+  def multi(self, name, ctls, by_0, idx1, gate, aux=(), val=None,
+            param=None):
+    """Gate controlled by ctls (by |0> where by_0 is set)."""
+
+    self._append(Op.MULTI, name, ctls[0], idx1, gate, val,
+                 self.intern_ctl(ctls, by_0, aux), param)
+
+  def bind(self, gate_id, gate, val):
+    """Set matrix and value of the gates of a parameterized gate id."""
+
+    # The indices of the gates per parameterized gate id are computed
+    # once, and again only after gates were added.
+    if self._param_gates is None or self._param_gates[0] != self._ngates:
+      ids = self.gate_ids
+      self._param_gates = (self._ngates, {
+          g: np.flatnonzero(ids == g) for g in self.params})
+    self.gate_table[gate_id] = gate
+    self._val[self._param_gates[1][gate_id]] = val
 
   def section(self, desc):
-    self.gates.append(Node(Op.SECTION, desc, 0, 0, None, None))
+    self.markers.append((self._ngates, desc))
 
   def end_section(self):
-    self.gates.append(Node(Op.END_SECTION, 0, 0, 0, None, None))
+    self.markers.append((self._ngates, None))
 
   @property
   def ngates(self):
     return self._ngates
+
+  # --- Lowering ------------------------------------------------
+  #
+  # Multi gates are lowered to the decompositions qc.ccx() and
+  # qc.multi_control() used to produce directly, with the same
+  # sections, gates, and names:
+  #   - A gate with 2 controls and no ancillas is a ccx in the
+  #     Sleator-Weinfurter construction, with 5 controlled gates
+  #     (plus x gates for controls by |0>).
+  #   - Otherwise, the gate is controlled by an ancilla, which holds
+  #     the AND of the controls, computed (and uncomputed) by a
+  #     ladder of ccx gates over the ancillas. The ancillas must be
+  #     |0>, as for qc.multi_control().
+  #
+  def lower(self):
+    """Return an IR with only single and controlled gates."""
+
+    if not self.has_multi:
+      return self
+
+    res = Ir()
+    res.regs = list(self.regs)
+    res.nregs = self.nregs
+    res.regset = list(self.regset)
+
+    markers = iter(self.markers + [(self.ngates + 1, None)])
+    marker = next(markers)
+    for i in range(self.ngates):
+      while marker[0] == i:
+        res.markers.append((res.ngates, marker[1]))
+        marker = next(markers)
+      node = Node(self, i)
+      if node.is_multi():
+        res.lower_multi(node)
+      else:
+        res.add_node(node)
+    while marker[0] == self.ngates:
+      res.markers.append((res.ngates, marker[1]))
+      marker = next(markers)
+    return res
+
+  def lower_ccx(self, c0, c1, by_0, target):
+    self.section('ccx({}, {}, {})'.format(ctl_str(c0, by_0[0]),
+                                          ctl_str(c1, by_0[1]), target))
+    for c, flip in zip((c0, c1), by_0):
+      if flip:
+        self.single('x', c, ops.PauliX())
+    self.controlled('cv', c0, target, ops.Vgate())
+    self.controlled('cx', c0, c1, ops.PauliX())
+    self.controlled('cv_adj', c1, target, ops.Vgate().adjoint())
+    self.controlled('cx', c0, c1, ops.PauliX())
+    self.controlled('cv', c1, target, ops.Vgate())
+    for c, flip in zip((c0, c1), by_0):
+      if flip:
+        self.single('x', c, ops.PauliX())
+    self.end_section()
+
+  def lower_multi(self, node):
+    ctls, by_0, aux = node.ctls, node.ctl_by_0, node.aux
+    if not aux:
+      self.lower_ccx(ctls[0], ctls[1], by_0, node.idx1)
+      return
+
+    self.section('multi({}, {}) # {})'.format(ctl_list(ctls, by_0),
+                                              node.idx1, node.desc))
+    # Compute the predicate.
+    self.lower_ccx(ctls[0], ctls[1], by_0[:2], aux[0])
+    for i in range(2, len(ctls)):
+      self.lower_ccx(ctls[i], aux[i-2], (by_0[i], False), aux[i-1])
+
+    # Use predicate to single-control the target.
+    self.controlled(node.desc, aux[len(ctls)-2], node.idx1, node.gate,
+                    node.val)
+
+    # Uncompute predicate.
+    for i in range(len(ctls)-1, 1, -1):
+      self.lower_ccx(ctls[i], aux[i-2], (by_0[i], False), aux[i-1])
+    self.lower_ccx(ctls[0], ctls[1], by_0[:2], aux[0])
+    self.end_section()
+
+
+def ctl_str(ctl, by_0):
+  return f'[{ctl}]' if by_0 else f'{ctl}'
+
+
+def ctl_list(ctls, by_0):
+  """Format controls as in qc.multi_control(), eg., [1, [2], 3]."""
+
+  return '[{}]'.format(', '.join(ctl_str(c, flip)
+                                 for c, flip in zip(ctls, by_0)))
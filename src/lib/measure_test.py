@@ -1,7 +1,9 @@
 # python3
 import math
+import random
 
 from absl.testing import absltest
+import numpy as np
 
 from src.lib import ops
 from src.lib import state
@@ -21,6 +23,48 @@ class MeasureTest(absltest.TestCase):
     p0, _ = ops.Measure(psi2, 0)
     self.assertTrue(math.isclose(p0, 1.0, abs_tol=1e-6))
 
+  def test_measure_against_projector(self):
+    psi = state.State(np.random.random(2**5) + 1j * np.random.random(2**5))
+    psi.normalize()
+    for idx in range(5):
+      for tostate in range(2):
+        op = ops.Projector(state.zero if tostate == 0 else state.one)
+        op = ops.Identity(idx) * op if idx > 0 else op
+        if idx < 4:
+          op = op * ops.Identity(4 - idx)
+        prob = np.real(np.trace(op @ psi.density()))
+        collapsed = op @ psi
+        collapsed = collapsed / np.linalg.norm(collapsed)
+
+        p0, psi2 = ops.Measure(psi, idx, tostate)
+        self.assertTrue(math.isclose(p0, prob, abs_tol=1e-5))
+        self.assertTrue(psi2.is_close(collapsed))
+
+  def test_measure_multi(self):
+    psi = state.zeros(3)
+    psi = ops.Hadamard(3)(psi)
+    p, psi2 = ops.Measure(psi, [0, 2], [1, 0])
+    self.assertTrue(math.isclose(p, 0.25, abs_tol=1e-5))
+    self.assertTrue(math.isclose(psi2.prob(1, 0, 0), 0.5, abs_tol=1e-5))
+    self.assertTrue(math.isclose(psi2.prob(1, 1, 0), 0.5, abs_tol=1e-5))
+
+    # Integer outcome for a whole register, qubit 0 is the msb.
+    reg = state.Reg(3, 0, 0)
+    val = random.randint(0, 7)
+    p, psi2 = ops.Measure(psi, reg, val)
+    self.assertTrue(math.isclose(p, 1 / 8, abs_tol=1e-5))
+    self.assertTrue(math.isclose(abs(psi2[val]), 1.0, abs_tol=1e-5))
+
+  def test_measure_inplace(self):
+    psi = state.zeros(2)
+    psi = ops.Hadamard()(psi)
+    psi = ops.Cnot(0, 1)(psi)
+
+    p0, psi2 = ops.Measure(psi, 1, 1, inplace=True)
+    self.assertTrue(math.isclose(p0, 0.5, abs_tol=1e-5))
+    self.assertIs(psi2, psi)
+    self.assertTrue(psi.is_close(state.bitstring(1, 1)))
+
 
 if __name__ == '__main__':
   absltest.main()
@@ -7,7 +7,7 @@ from __future__ import annotations
 
 import cmath
 import math
-from typing import Optional, Union, List, Callable
+from typing import Optional, Union, List, Callable, Tuple
 
 import numpy as np
 
@@ -68,6 +68,9 @@ class Operator(tensor.Tensor):
   # Once the operator has been constructed a simple matmul does the
   # application and produces a new state.
   #
+  # Note: For states, the expansion is never built explicitly, see
+  #       apply_local() below. The result is the same.
+  #
   # On Operator:
   # -------------
   # Op(op) equals Op @ op equal matmul(Op, op), to produce a new state.
@@ -114,19 +117,49 @@ class Operator(tensor.Tensor):
     if not isinstance(arg, state.State):
       raise AssertionError('Invalid parameter, expected State.')
 
-    op = self
-    if idx > 0:
-      op = Identity().kpow(idx)  * op
-    if arg.nbits - idx - self.nbits > 0:
-      op = op * Identity().kpow(arg.nbits - idx - self.nbits)
-
-    return state.State(np.matmul(op, arg))
+    return self.apply_local(arg, idx)
 
   def __call__(self,
                arg: Union[state.State, Operator],
                idx=0) -> Union[state.State, Operator]:
     return self.apply(arg, idx)
 
+  # The expanded operator I x ... x I x Op x I x ... x I is a matrix of
+  # size 2^n x 2^n, with n being the number of qubits of the state.
+  # Building it, and the matmul, cost O(4^n). Instead, we view the
+  # state as a 3D tensor of shape (2^idx, 2^k, 2^rest), with k being
+  # the number of qubits of this operator. The middle axis represents
+  # the qubits idx ... idx+k-1 and the operator only needs to be
+  # multiplied into this axis, which costs O(2^n * 2^k).
+  #
+  def apply_local(self, psi: state.State, idx: int = 0) -> state.State:
+    """Apply operator to qubits idx ... idx+nbits-1 of a state."""
+
+    if idx < 0 or psi.nbits - idx - self.nbits < 0:
+      raise AssertionError('Operator applied to invalid qubits.')
+
+    view = np.asarray(psi).reshape(2**idx, 2**self.nbits,
+                                   2**(psi.nbits - idx - self.nbits))
+    return state.State(np.matmul(np.asarray(self), view).reshape(-1))
+
+  # In-place version of apply_local(). The matmul can't write into its
+  # own input, so the result goes into a scratch buffer first and is
+  # then copied back. For a chain of operators, this runs at steady
+  # state memory, without allocating a new state per step.
+  #
+  def apply_(self, psi: state.State, idx: int = 0) -> state.State:
+    """Apply operator in-place to qubits idx ... idx+nbits-1 of psi."""
+
+    if idx < 0 or psi.nbits - idx - self.nbits < 0:
+      raise AssertionError('Operator applied to invalid qubits.')
+
+    view = np.asarray(psi).reshape(2**idx, 2**self.nbits,
+                                   2**(psi.nbits - idx - self.nbits))
+    scratch = tensor.arena.get(view.shape, view.dtype)
+    np.matmul(np.asarray(self), view, out=scratch)
+    view[...] = scratch
+    return psi
+
 
 #--------------------------------------------------------------
 # Single Qubit Gates / Generators.
@@ -238,6 +271,41 @@ def RotationZ(theta: float) -> Operator:
   return Rotation([0., 0., 1.], theta)
 
 
+def ZYDecompose(u: np.ndarray) -> Tuple[float, float, float, float]:
+  """Find alpha, beta, gamma, delta with U = e^(i alpha) Rz Ry Rz."""
+
+  # Any single-qubit unitary can be written as (see zy_decompose.py):
+  #
+  #   U = e^(i*alpha) * Rz(beta) * Ry(gamma) * Rz(delta)
+  #
+  # With g = alpha - (beta + delta)/2, this is IBM's U-gate with a
+  # global phase, e^(i*g) * U(gamma, beta, delta), which reads:
+  #
+  #   e^(i*g) [ cos(gamma/2)               -e^(i*delta) sin(gamma/2)
+  #             e^(i*beta) sin(gamma/2)    e^(i*(beta+delta)) cos(gamma/2) ]
+  #
+  # We read the angles off the phases of the matrix elements. If gamma
+  # is 0 or Pi, only beta+delta or beta-delta is defined, and we set
+  # beta = 0.
+  #
+  u = np.asarray(u, dtype=np.complex128)
+  gamma = 2 * math.atan2(abs(u[1, 0]), abs(u[0, 0]))
+  if abs(u[1, 0]) < 1e-9:
+    g = cmath.phase(u[0, 0])
+    beta = 0.0
+    delta = cmath.phase(u[1, 1]) - g
+  elif abs(u[0, 0]) < 1e-9:
+    g = cmath.phase(u[1, 0])
+    beta = 0.0
+    delta = cmath.phase(-u[0, 1]) - g
+  else:
+    g = cmath.phase(u[0, 0])
+    beta = cmath.phase(u[1, 0]) - g
+    delta = cmath.phase(-u[0, 1]) - g
+  alpha = g + (beta + delta) / 2
+  return alpha, beta, gamma, delta
+
+
 def Projector(psi: state.State) -> Operator:
   """Construct projection operator for basis state from outer product."""
   return Operator(psi.density())
@@ -323,54 +391,282 @@ def Toffoli(idx0: int, idx1: int, idx2: int) -> Operator:
   return toffoli
 
 
+def OracleValues(nbits: int, f: Callable[[List[int]], int],
+                 vectorized: bool = False) -> np.ndarray:
+  """Evaluate f(x) for all 2**nbits inputs x, optionally vectorized."""
+
+  # f is written for a list of bits, high to low, eg., f([1, 0, 1]).
+  # Many such functions only use arithmetic and indexing and work just
+  # as well if each 'bit' is a numpy array of bits. For such functions
+  # callers can pass vectorized=True, and we call f once, with the bit
+  # columns of all inputs, instead of 2**nbits times. By default, f is
+  # called for each input, as f may well do things that don't work
+  # on arrays (comparisons, branches, or side effects).
+  #
+  dim = 2**nbits
+  xs = np.arange(dim, dtype=np.int64)
+  if vectorized:
+    columns = [(xs >> (nbits - 1 - i)) & 1 for i in range(nbits)]
+    fx = np.asarray(f(columns))
+    if fx.shape != (dim,):
+      raise AssertionError('Vectorized f() returned invalid shape.')
+    return fx.astype(np.int64) & 1
+
+  return np.array([int(f(helper.val2bits(x, nbits))) & 1 for x in xs],
+                  dtype=np.int64)
+
+
+# Controlled operations only act on the half of the state vector
+# where the control qubit is |1>. We view the state as a tensor of
+# shape [2, 2, ..., 2], select index 1 on the control axis, and pass
+# this half, as a state of n-1 qubits, to func. Qubits after the
+# control qubit move up by one in the smaller state.
+#
+# The half is (in general) a strided view. It is gathered into a
+# contiguous scratch buffer, which func may modify in-place, and the
+# result is scattered back. With 'inplace', psi itself is updated.
+#
+def ControlledApply(psi: state.State, ctl: int,
+                    func: Callable[[state.State], state.State],
+                    inplace: bool = False) -> state.State:
+  """Apply func to the part of psi where qubit ctl is |1>."""
+
+  if ctl < 0 or ctl >= psi.nbits:
+    raise AssertionError('Invalid control qubit.')
+
+  res = psi if inplace else state.State(np.array(psi))
+  psi_t = np.asarray(res).reshape([2] * psi.nbits)
+  sub = psi_t[(slice(None),) * ctl + (1,)]
+  buf = tensor.arena.get(sub.shape, sub.dtype, slot=1)
+  buf[...] = sub
+  sub_psi = func(state.State(buf.reshape(-1)))
+  sub[...] = np.asarray(sub_psi).reshape(sub.shape)
+  return res
+
+
+class Oracle:
+  """Oracle represented by a permutation and a phase vector."""
+
+  # Oracles like U_f |x, y> = |x, y ^ f(x)> map each basis state to
+  # exactly one other basis state, possibly with a phase. The matrix
+  # has a single non-zero entry per row, which makes the dense 2^n x 2^n
+  # representation, and the matmul to apply it, very wasteful. Instead
+  # we store two vectors, such that:
+  #
+  #     U[i, perm[i]] = phase[i]
+  #
+  # Applying the oracle to a state then becomes a single gather:
+  #
+  #     (U psi)[i] = phase[i] * psi[perm[i]]
+  #
+  # Either vector may be None, meaning identity permutation or no phase.
+
+  def __init__(self, nbits: int,
+               perm: Optional[np.ndarray] = None,
+               phase: Optional[np.ndarray] = None):
+    dim = 2**nbits
+    self.nbits = nbits
+    self.perm = None
+    self.phase = None
+    if perm is not None:
+      self.perm = np.asarray(perm, dtype=np.int64)
+      if (self.perm.shape != (dim,) or
+          np.bincount(self.perm, minlength=dim).max() != 1):
+        raise AssertionError('Oracle requires a permutation of 2**nbits.')
+    if phase is not None:
+      self.phase = np.asarray(phase, dtype=tensor.tensor_type())
+      if self.phase.shape != (dim,):
+        raise AssertionError('Oracle phase vector has invalid size.')
+
+  def apply(self, psi: state.State, idx: int = 0) -> state.State:
+    """Apply the oracle to qubits idx ... idx+nbits-1 of psi."""
+
+    if idx < 0 or psi.nbits - idx - self.nbits < 0:
+      raise AssertionError('Oracle applied to invalid qubits.')
+
+    view = np.asarray(psi).reshape(2**idx, 2**self.nbits,
+                                   2**(psi.nbits - idx - self.nbits))
+    if self.perm is not None:
+      view = view[:, self.perm, :]
+    if self.phase is not None:
+      view = view * self.phase[None, :, None]
+    return state.State(view.reshape(-1))
+
+  def __call__(self, psi: state.State, idx: int = 0) -> state.State:
+    return self.apply(psi, idx)
+
+  def adjoint(self) -> Oracle:
+    """The inverse oracle, U^dagger[perm[i], i] = conj(phase[i])."""
+
+    if self.perm is None:
+      if self.phase is None:
+        return Oracle(self.nbits)
+      return Oracle(self.nbits, phase=np.conj(self.phase))
+    inv = np.empty_like(self.perm)
+    inv[self.perm] = np.arange(self.perm.shape[0])
+    if self.phase is None:
+      return Oracle(self.nbits, inv)
+    return Oracle(self.nbits, inv, np.conj(self.phase[inv]))
+
+  def matrix(self) -> Operator:
+    """Materialize the dense operator (only for small sizes)."""
+
+    dim = 2**self.nbits
+    rows = np.arange(dim)
+    u = np.zeros((dim, dim), dtype=tensor.tensor_type())
+    u[rows, rows if self.perm is None else self.perm] = (
+        1.0 if self.phase is None else self.phase)
+    return Operator(u)
+
+
+def PermutationOracle(nbits: int, f: Callable[[List[int]], int],
+                      vectorized: bool = False) -> Oracle:
+  """Make an n-qubit Oracle |x, y> -> |x, y ^ f(x)> as a permutation."""
+
+  return Oracle(nbits, Permutation(nbits, f, vectorized))
+
+
+def PhaseOracle(nbits: int, f: Callable[[List[int]], int],
+                vectorized: bool = False) -> Oracle:
+  """Make an n-qubit Oracle |x> -> (-1)^f(x) |x>, without ancilla."""
+
+  fx = OracleValues(nbits, f, vectorized)
+  return Oracle(nbits, phase=1.0 - 2.0 * fx)
+
+
+class Grover:
+  """Matrix-free Grover operator G = D O over nbits qubits."""
+
+  # The Grover operator is the combination of:
+  #    - the oracle O, flipping the phase of the marked states
+  #    - the diffusion D = 2|s><s| - I, an inversion about the mean,
+  #      with |s> the equal superposition
+  #
+  # Both are cheap on the state vector. The oracle is a multiplication
+  # with a vector of +1/-1 signs, and the diffusion computes 2u - c_x
+  # for every amplitude c_x, with u being the mean over all amplitudes
+  # of the Grover register. One iteration thus costs O(2^n), instead of
+  # the O(4^n) matmul with a dense 2^n x 2^n Grover matrix.
+  #
+  # 'marked' is either a list of marked indices, a predicate f(bits)
+  # returning 1 for marked states (as for OracleUf, see OracleValues
+  # for 'vectorized'), or a phase Oracle.
+
+  def __init__(self, nbits: int, marked, vectorized: bool = False):
+    self.nbits = nbits
+    dim = 2**nbits
+    if isinstance(marked, Oracle):
+      if marked.perm is not None or marked.phase is None:
+        raise AssertionError('Grover requires a phase oracle.')
+      sign = np.real(marked.phase)
+    elif callable(marked):
+      sign = 1.0 - 2.0 * OracleValues(nbits, marked, vectorized)
+    else:
+      sign = np.ones(dim)
+      sign[np.asarray(marked, dtype=np.int64)] = -1.0
+    self.sign = np.asarray(sign, dtype=tensor.tensor_type())
+    if self.sign.shape != (dim,):
+      raise AssertionError('Grover marked states have invalid size.')
+
+  @property
+  def solutions(self) -> int:
+    return int(np.count_nonzero(np.real(self.sign) < 0))
+
+  def iterations(self) -> int:
+    """Number of iterations maximizing the probability of a solution."""
+
+    # With M solutions out of N states the optimal iteration count is
+    # pi/4 sqrt(N/M), see also grover.py.
+    return int(math.pi / 4 * math.sqrt(2**self.nbits /
+                                       max(1, self.solutions)))
+
+  def _iterate(self, view: np.ndarray, iterations: int) -> None:
+    """Apply G^iterations in-place to axis 1 of a 3D view."""
+
+    sign = self.sign[None, :, None]
+    for _ in range(iterations):
+      view *= sign
+      mean = view.mean(axis=1, keepdims=True)
+      np.subtract(2 * mean, view, out=view)
+
+  def apply(self, psi: state.State, idx: int = 0,
+            iterations: int = 1, inplace: bool = False) -> state.State:
+    """Apply G^iterations to qubits idx ... idx+nbits-1 of psi."""
+
+    if idx < 0 or psi.nbits - idx - self.nbits < 0:
+      raise AssertionError('Grover applied to invalid qubits.')
+
+    res = psi if inplace else state.State(np.array(psi))
+    view = np.asarray(res).reshape(2**idx, 2**self.nbits,
+                                   2**(psi.nbits - idx - self.nbits))
+    self._iterate(view, iterations)
+    return res
+
+  def __call__(self, psi: state.State, idx: int = 0,
+               iterations: int = 1) -> state.State:
+    return self.apply(psi, idx, iterations)
+
+  def apply_controlled(self, psi: state.State, ctl: int, idx: int,
+                       power: int = 1,
+                       inplace: bool = False) -> state.State:
+    """Apply G^power to qubits idx ... idx+nbits-1, controlled by ctl."""
+
+    # This is the controlled-power form needed for phase estimation,
+    # eg., in quantum counting. Only the half of the state vector with
+    # the control qubit set to |1> is being iterated.
+    #
+    if idx <= ctl < idx + self.nbits:
+      raise AssertionError('Control qubit overlaps the Grover register.')
+
+    start = idx - 1 if ctl < idx else idx
+    return ControlledApply(
+        psi, ctl, lambda sub: self.apply(sub, start, power, inplace=True),
+        inplace)
+
+  def matrix(self) -> Operator:
+    """Materialize the dense Grover operator (only for small sizes)."""
+
+    dim = 2**self.nbits
+    diffusion = np.full((dim, dim), 2.0 / dim) - np.eye(dim)
+    return Operator(diffusion * self.sign[None, :])
+
+
 def OracleUf(nbits: int, f: Callable[[List[int]], int]) -> Operator:
   """Make an n-qubit Oracle for function f (e.g. Deutsch, Grover)."""
 
   # This Oracle is constructed similar to the implementation in
   # ./deutsch.py, just with an n-bit |x> and a 1-bit |y>
   #
+  # The matrix has a single 1.0 per row, in the column given by the
+  # permutation. Since the permutation is checked to be a bijection, the
+  # resulting matrix is unitary by construction and we avoid the
+  # expensive is_unitary() check.
+  #
   dim = 2**nbits
-  u = np.zeros(dim**2).reshape(dim, dim)
-  for row in range(dim):
-    bits = helper.val2bits(row, nbits)
-    fx = f(bits[0:-1])   # f(x) without the y.
-    xor = bits[-1] ^ fx
-
-    new_bits = bits[0:-1]
-    new_bits.append(xor)
-
-    # Construct new column (int) from the new bit sequence.
-    new_col = helper.bits2val(new_bits)
-    u[row][new_col] = 1.0
-
-  op = Operator(u)
-  if not op.is_unitary():
+  perm = Permutation(nbits, f)
+  u = np.zeros((dim, dim))
+  u[np.arange(dim), perm] = 1.0
+  if np.bincount(perm, minlength=dim).max() != 1:
     raise AssertionError('Constructed non-unitary operator.')
-  return op
+  return Operator(u)
 
 
 # It is possible to construct 1- and 2-qubit oracles from a
 # permutation matrix. First step is to compute the permutation.
 # This follows the same method as OraceUf, but it does not
 # populate a matrix, it only collects the permutations.
-
-
-def Permutation(nbits: int, f) -> List[int]:
+#
+# For row |x, y>, f(x) only depends on x, so we evaluate f only once
+# for each of the 2**(nbits-1) values of x and then compute the new
+# column (x, y ^ f(x)) for all rows at once.
+#
+def Permutation(nbits: int, f,
+                vectorized: bool = False) -> np.ndarray:
   """Compute a permutation from function f."""
 
-  dim = 2**nbits
-  perm = []
-  for row in range(dim):
-    bits = helper.val2bits(row, nbits)
-    fx = f(bits[0:-1])
-    xor = bits[-1] ^ fx
-    new_bits = bits[0:-1]
-    new_bits.append(xor)
-
-    # Construct new column (int) from the new bit sequence.
-    new_col = helper.bits2val(new_bits)
-    perm.append(new_col)
-  return perm
+  rows = np.arange(2**nbits, dtype=np.int64)
+  fx = OracleValues(nbits - 1, f, vectorized)
+  return (rows & ~1) | ((rows & 1) ^ fx[rows >> 1])
 
 
 # Build the QFT operator. A good explanation can be found here:
@@ -405,104 +701,139 @@ def Qft(nbits: int) -> Operator:
   for idx in range(nbits // 2):
     op = op(Swap(idx, nbits - idx - 1), idx)
 
-  if not op.is_unitary():
+  if not op.validate_unitary():
     raise AssertionError('Constructed non-unitary operator.')
   return op
 
 
-# Trace out a qubit from a density matrix and return the
+# Trace out qubits from a density matrix and return the
 # remaining density matrix.
 #
+# The density matrix is viewed as a tensor with 2n axes of size 2,
+# the first n axes for the rows (qubits 0..n-1) and the second n
+# axes for the columns. Tracing out a qubit means summing over the
+# diagonal of its row and column axis. A single einsum does this for
+# all traced qubits at once, without building any projectors.
+#
+def TraceOutQubits(rho: Operator, qubits: List[int]) -> Operator:
+  """Trace out the given set of (original) qubit indices at once."""
+
+  nbits = int(math.log2(rho.shape[0]))
+  kept = [q for q in range(nbits) if q not in qubits]
+  labels = list(range(2 * nbits))
+  for q in qubits:
+    labels[nbits + q] = q
+  out_labels = kept + [nbits + q for q in kept]
+  rho_t = np.asarray(rho).reshape([2] * 2 * nbits)
+  reduced = np.einsum(rho_t, labels, out_labels)
+  dim = 2**len(kept)
+  return Operator(reduced.reshape(dim, dim))
+
+
 def TraceOutSingle(rho: Operator, index: int) -> Operator:
   """Trace out single qubit from density matrix."""
 
   nbits = int(math.log2(rho.shape[0]))
-  if index > nbits:
+  if index >= nbits:
     raise AssertionError(
         'Error in TraceOutSingle invalid index (>nbits).')
-
-  eye = Identity()
-  zero = Operator(np.array([1.0, 0.0]))
-  one = Operator(np.array([0.0, 1.0]))
-
-  p0 = p1 = tensor.Tensor(1.0)
-  for idx in range(nbits):
-    if idx == index:
-      p0 = p0 * zero
-      p1 = p1 * one
-    else:
-      p0 = p0 * eye
-      p1 = p1 * eye
-
-  rho0 = p0 @ rho
-  rho0 = rho0 @ p0.transpose()
-  rho1 = p1 @ rho
-  rho1 = rho1 @ p1.transpose()
-  rho_reduced = rho0 + rho1
-  return rho_reduced
+  return TraceOutQubits(rho, [index])
 
 
 def TraceOut(rho: Operator, index_set: List[int]) -> Operator:
   """Trace out multiple qubits from density matrix."""
 
+  # The indices in index_set are interpreted as if the qubits were
+  # traced out one by one. Tracing out a bit means that rho is then
+  # 1 bit smaller, and the indices of all qubits following in the
+  # index_set are shifted left by 1. Example, to trace out bits 2, 4:
+  # Before:
+  #    qubit 0  1  2  3  4  5
+  #          a  b  c  d  e  f
+  # Trace out 2:
+  #    qubit 0  1 <-  3  4  5
+  #    qubit 0  1  2  3  4
+  #          a  b  d  e  f
+  # Trace out 4 (is now 3)
+  #    qubit 0  1  2  <-  4
+  #    qubit 0  1  2  3
+  #          a  b  d  f
+  #
+  # We map these indices back to the original qubits and then
+  # trace them out all at once.
+  nbits = int(math.log2(rho.shape[0]))
+  remaining = list(range(nbits))
+  index_set = list(index_set)
+  traced = []
   for idx, val in enumerate(index_set):
-    nbits = int(math.log2(rho.shape[0]))
-    if val > nbits:
+    if val < 0 or val >= len(remaining):
       raise AssertionError('Error TraceOut, invalid index (>nbits).')
-    rho = TraceOutSingle(rho, val)
-
-    # Tracing out a bit means that rho is now 1 bit smaller, the
-    # indices right to the traced out qubit need to shift left by 1.
-    # Example, to trace out bits 2, 4:
-    # Before:
-    #    qubit 0  1  2  3  4  5
-    #          a  b  c  d  e  f
-    # Trace out 2:
-    #    qubit 0  1 <-  3  4  5
-    #    qubit 0  1  2  3  4
-    #          a  b  d  e  f
-    # Trace out 4 (is now 3)
-    #    qubit 0  1  2  <-  4
-    #    qubit 0  1  2  3
-    #          a  b  d  f
+    traced.append(remaining.pop(val))
     for i in range(idx+1, len(index_set)):
       index_set[i] = index_set[i] - 1
-  return rho
+  return TraceOutQubits(rho, traced)
 
 
-def Measure(psi: state.State, idx: int,
-            tostate: int = 0, collapse: bool = True) -> (float, state.State):
-  """Measure a qubit via a projector on the density matrix."""
+def Measure(psi: state.State, idx: Union[int, List[int], state.Reg],
+            tostate: Union[int, List[int]] = 0, collapse: bool = True,
+            inplace: bool = False) -> (float, state.State):
+  """Measure qubit(s) via a strided reduction over the state vector."""
 
   # Measure() measure qubit 'idx' in state 'psi'. It both measures the
   # probability of the result being state `tostate` and, if `collapse`
   # is set to true, also collapses the state to `tostate`. It is helpful
   # for debugging to have this forcing function, but care must
   # be taken not to collapse the state to one with 0 probability.
-
-  # Compute probability of qubit(idx) to be in state 0 / 1.
-  rho = psi.density()
-  op = Projector(state.zero) if tostate == 0 else Projector(state.one)
-
-  # Construct full matrix to apply to density matrix:
-  if idx > 0:
-    op = Identity().kpow(idx) * op
-  if idx < psi.nbits - 1:
-    op = op * Identity().kpow(psi.nbits - idx -1)
-
-  # Probability is the trace.
-  prob0 = np.trace(np.matmul(op, rho))
+  #
+  # Several qubits can be measured at once by passing a list of
+  # qubit indices (or a register) as 'idx'. In this case, 'tostate' is
+  # either a list of bits, one per qubit, or an integer, whose binary
+  # representation provides the bits (idx[0] being the most
+  # significant bit).
+  #
+  # The state is collapsed into a new state, unless 'inplace' is set,
+  # in which case 'psi' itself is collapsed and returned.
+
+  if isinstance(idx, state.Reg):
+    idx = idx.global_idx
+  if isinstance(idx, int):
+    idx, bits = [idx], [tostate]
+  elif isinstance(tostate, int):
+    bits = helper.val2bits(tostate, len(idx))
+  else:
+    bits = tostate
+
+  # View the state as a tensor with one axis per qubit, with axis i
+  # corresponding to qubit i. The amplitudes matching the measurement
+  # outcome form a strided sub-view. This avoids building both the
+  # density matrix (4^n) and a full projector.
+  nbits = psi.nbits
+  psi_t = np.asarray(psi).reshape([2] * nbits)
+  sel = [slice(None)] * nbits
+  for q, b in zip(idx, bits):
+    sel[q] = slice(b, b + 1)
+  sub = psi_t[tuple(sel)]
+
+  # Probability is the sum of the squared magnitudes.
+  prob0 = np.real(np.vdot(sub, sub))
+  if not collapse:
+    # Return original state to enable chaining.
+    return prob0, psi
 
   # Collapse state and normalize
-  if collapse:
-    mvmul = np.dot(op, psi)
-    divisor = np.real(np.linalg.norm(mvmul))
-    if divisor > 1e-10:
-      normed = mvmul / divisor
-    else:
-      raise AssertionError(
-          'Measure() collapses to 0.0 probability state.')
-    return np.real(prob0), state.State(normed)
-
-  # Return original state to enable chaining.
-  return np.real(prob0), psi
+  divisor = np.sqrt(prob0)
+  if divisor <= 1e-10:
+    raise AssertionError(
+        'Measure() collapses to 0.0 probability state.')
+  if not inplace:
+    normed = np.zeros_like(psi_t)
+    normed[tuple(sel)] = sub / divisor
+    return prob0, state.State(normed.reshape(-1))
+
+  # Zero out the amplitudes not matching the outcome, qubit by qubit.
+  for q, b in zip(idx, bits):
+    other = [slice(None)] * nbits
+    other[q] = slice(1 - b, 2 - b)
+    psi_t[tuple(other)] = 0
+  psi /= divisor
+  return prob0, psi
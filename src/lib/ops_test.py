@@ -7,6 +7,7 @@ import numpy as np
 from src.lib import helper
 from src.lib import ops
 from src.lib import state
+from src.lib import tensor
 
 
 class OpsTest(absltest.TestCase):
@@ -278,6 +279,18 @@ class OpsTest(absltest.TestCase):
     self.assertTrue(np.allclose(ops.U(val, -np.pi/2, np.pi/2), ops.RotationX(val)))
     self.assertTrue(np.allclose(ops.U(val, 0, 0), ops.RotationY(val)))
 
+  def test_zy_decompose(self):
+    gates = [ops.Identity(), ops.PauliX(), ops.PauliY(), ops.PauliZ(),
+             ops.Hadamard(), ops.Tgate(), ops.Vgate(), ops.Yroot()]
+    for _ in range(20):
+      gates.append(ops.U(random.random() * 4, random.random() * 4,
+                         random.random() * 4) * np.exp(1j * random.random()))
+    for gate in gates:
+      alpha, beta, gamma, delta = ops.ZYDecompose(gate)
+      self.assertTrue(np.allclose(
+          np.exp(1j * alpha) * (ops.RotationZ(beta) @ ops.RotationY(gamma) @
+                                ops.RotationZ(delta)), gate, atol=1e-5))
+
   def test_diffusion_op(self):
     nbits = 3
     op = ops.Hadamard(nbits)
@@ -323,5 +336,108 @@ class OpsTest(absltest.TestCase):
        self.assertTrue(np.allclose(u, ident))
 
 
+  def test_permutation_oracle(self):
+    answers = np.random.randint(0, 2, size=2**4)
+
+    def f(bits):
+      return answers[helper.bits2val(bits)]
+
+    def f_scalar(bits):
+      return int(answers[helper.bits2val(bits)])
+
+    uf = ops.OracleUf(5, f)
+    for func, vectorized in [(f, False), (f, True), (f_scalar, False)]:
+      oracle = ops.PermutationOracle(5, func, vectorized)
+      self.assertTrue(np.allclose(oracle.matrix(), uf))
+      self.assertTrue(np.allclose(oracle.adjoint().matrix(), uf.adjoint()))
+
+    # By default, f is evaluated in a loop, for scalar-only functions.
+    def f_list(bits):
+      return 1 if list(bits) == [1, 0, 1, 1] else 0
+    oracle = ops.PermutationOracle(5, f_list)
+    self.assertEqual(int(oracle.perm[0b10110]), 0b10111)
+    self.assertEqual(int(oracle.perm[0b00110]), 0b00110)
+
+    psi = state.State(np.random.random(2**7) + 1j * np.random.random(2**7))
+    psi.normalize()
+    for idx in range(3):
+      oracle = ops.PermutationOracle(5, f)
+      self.assertTrue(np.allclose(oracle(psi, idx), uf(psi, idx), atol=1e-6))
+
+    phase = ops.PhaseOracle(4, f)
+    self.assertTrue(np.allclose(np.diag(phase.matrix()), 1 - 2 * answers))
+    with self.assertRaises(AssertionError):
+      ops.Oracle(2, [0, 0, 1, 2])
+
+
+  def test_grover(self):
+    marked = [3, 9, 12]
+    grover = ops.Grover(4, marked)
+    self.assertEqual(grover.solutions, 3)
+
+    # Compare against the dense construction in grover.py.
+    zero_projector = np.zeros((16, 16))
+    zero_projector[0, 0] = 1
+    hn = ops.Hadamard(4)
+    reflection = ops.Operator(zero_projector) * 2.0 - ops.Identity(4)
+    oracle = ops.PhaseOracle(4, lambda bits: int(helper.bits2val(bits)
+                                                 in marked), False)
+    dense = oracle.matrix()(hn(reflection(hn)))
+    self.assertTrue(np.allclose(grover.matrix(), dense, atol=1e-6))
+    self.assertTrue(np.allclose(ops.Grover(4, oracle).matrix(), dense,
+                                atol=1e-6))
+
+    psi = state.State(np.random.random(2**6) + 1j * np.random.random(2**6))
+    psi.normalize()
+    for idx in range(3):
+      res = grover(psi, idx, iterations=3)
+      self.assertTrue(np.allclose(
+          res, (dense @ dense @ dense)(psi, idx), atol=1e-5))
+
+    # Controlled powers, against the dense controlled operator.
+    u2 = dense @ dense
+    p0 = ops.Projector(state.zeros(1))
+    p1 = ops.Projector(state.ones(1))
+    for ctl, idx in [(0, 1), (1, 2), (0, 2)]:
+      res = grover.apply_controlled(psi, ctl, idx, 2)
+      want = ops.ControlledU(0, idx - ctl, u2)(psi, ctl)
+      self.assertTrue(np.allclose(res, want, atol=1e-5))
+    for ctl, gap in [(4, 0), (5, 1)]:
+      res = grover.apply_controlled(psi, ctl, 0, 2)
+      want = (ops.Identity(4 + gap) * p0 +
+              u2 * ops.Identity(gap) * p1)(psi)
+      self.assertTrue(np.allclose(res, want, atol=1e-5))
+
+    with self.assertRaises(AssertionError):
+      grover.apply_controlled(psi, 1, 0)
+
+
+  def test_apply_inplace(self):
+    psi = state.State(np.random.random(2**6) + 1j * np.random.random(2**6))
+    psi.normalize()
+    for op, idx in [(ops.Hadamard(), 0), (ops.Cnot(0, 2), 2),
+                    (ops.Qft(3), 3), (ops.PauliY(), 5)]:
+      want = op(psi, idx)
+      res = psi.copy()
+      self.assertIs(op.apply_(res, idx), res)
+      self.assertTrue(np.allclose(res, want, atol=1e-6))
+
+    # Repeated application runs on the same scratch buffer.
+    nbytes = tensor.arena.nbytes
+    buffers = list(tensor.arena.buffers.values())
+    for _ in range(10):
+      ops.Hadamard().apply_(psi, 3)
+    self.assertEqual(tensor.arena.nbytes, nbytes)
+    for buf in buffers:
+      self.assertTrue(any(buf is b for b in tensor.arena.buffers.values()))
+
+    # Controlled application, in-place.
+    u = ops.RotationY(0.4) * ops.Tgate()
+    res = psi.copy()
+    ops.ControlledApply(res, 0, lambda sub: u.apply_(sub, 2), inplace=True)
+    want = ops.ControlledU(0, 3, u)(psi)
+    self.assertTrue(np.allclose(res, want, atol=1e-6))
+
+
 if __name__ == '__main__':
   absltest.main()
@@ -1,43 +1,518 @@
 # python3
 """Optimize the IR with a variety of (simple) techniques."""
 
+import collections
+from typing import Dict
+
+import numpy as np
+
 from src.lib import ir
+from src.lib import ops
+
+# The optimizer works on a per-qubit DAG of the gates. Each qubit is a
+# 'wire' and every gate is linked to its predecessor and successor
+# gate on each of the wires it touches (one for single gates, two for
+# controlled gates). Two gates are adjacent if they directly follow each
+# other on all their wires, with no other gate in between.
+#
+# On this DAG, each pass is a single sweep over the gates. Removing
+# a gate simply links its predecessor and successor on each wire, which
+# may make new pairs adjacent (eg., h x x h -> h h -> nothing). The
+# passes re-check these pairs right away, hence they run in O(G).
+#
+# The passes are:
+#   - identity:  Remove gates which are (numerically) the identity,
+#                eg., zero-angle rotations.
+#   - rotation:  Merge adjacent rotations of the same kind into a
+#                single rotation, eg., rz(a) rz(b) -> rz(a+b).
+#   - inverse:   Cancel adjacent gates that are inverses of each
+#                other, eg., x x, h h, cx cx, v v_adj, or t t^dagger.
+#   - commute:   Cancel inverse pairs and merge rotations which are
+#                not adjacent, but separated by gates they commute with,
+#                eg., t(0) cx(0, 1) tdag(0) -> cx(0, 1). Pairs of
+#                gates, like cv cv, are combined into one gate, cx.
+#   - fuse:      Multiply each run of single-qubit gates on a wire
+#                into one 2x2 matrix, named 'u' (or a built-in gate,
+#                if the product happens to be one, eg., h z h -> x).
+#
+# Gates of parameterized rotations (see circuit.Parameter) are kept
+# as they are, their matrix changes with each bound value. They only
+# commute with other gates based on their kind of rotation, see
+# param_kinds below.
+
+
+# Rotations that can be merged by adding their angles, with the
+# function to construct the gate for a given angle.
+rotations = {
+    'rx': ops.RotationX,
+    'ry': ops.RotationY,
+    'rz': ops.RotationZ,
+    'u1': ops.U1,
+    'cu1': ops.U1,
+}
+
+# Pairs of the same gate that combine into another built-in gate, with
+# the resulting name and the function to construct its matrix.
+products = {
+    't': ('s', ops.Sgate),
+    's': ('z', ops.PauliZ),
+    'sdag': ('z', ops.PauliZ),
+    'v': ('x', ops.PauliX),
+    'cv': ('cx', ops.PauliX),
+    'cv_adj': ('cx', ops.PauliX),
+}
+
+# Built-in single-qubit gates, to name the product of fused gates.
+# Only gates every dumper can emit, others, like s, t, or v, become
+# u1 or 'u' gates.
+named_gates = [
+    ('x', ops.PauliX()),
+    ('y', ops.PauliY()),
+    ('z', ops.PauliZ()),
+    ('h', ops.Hadamard()),
+]
+
+
+# To find gates which commute, we classify how a gate acts on each of
+# its qubits. A gate is of kind 'z' on a qubit if its matrix is
+# diagonal (eg., t, s, rz, u1, and the control of any controlled gate),
+# and of kind 'x' if it is diagonal in the Hadamard basis, ie., has the
+# form [[a, b], [b, a]] (eg., x, v, rx, and the target of cx or cv).
+# All operators of one kind commute with each other. Hence, two gates
+# commute if on each of their common qubits both are of the same kind:
+#
+#             i       z       x       o
+#      i      y       y       y       y
+#      z      y       y       -       -
+#      x      y       -       y       -
+#      o      y       -       -       -
+#
+# Kind 'i' is the identity, 'o' are all other gates, eg., h or ry.
+# This is a sufficient, not a necessary condition, eg., two Hadamard
+# gates commute, which we check separately for single-qubit gates.
+commutes = {
+    ('i', 'i'), ('i', 'z'), ('i', 'x'), ('i', 'o'),
+    ('z', 'i'), ('z', 'z'),
+    ('x', 'i'), ('x', 'x'),
+    ('o', 'i'),
+}
+
+# Kinds of parameterized rotations, on their target, for any angle.
+param_kinds = {'rx': 'x', 'ry': 'o', 'rz': 'z', 'u1': 'z', 'cu1': 'z'}
+
+
+def gate_kind(gate: np.ndarray) -> str:
+  """Classify a 2x2 gate as 'i', 'z', 'x', or 'o' (see above)."""
+
+  if np.allclose(gate, np.eye(2), atol=1e-6):
+    return 'i'
+  if abs(gate[0, 1]) < 1e-6 and abs(gate[1, 0]) < 1e-6:
+    return 'z'
+  if (abs(gate[0, 0] - gate[1, 1]) < 1e-6 and
+      abs(gate[0, 1] - gate[1, 0]) < 1e-6):
+    return 'x'
+  return 'o'
+
+
+class Dag:
+  """Per-qubit DAG over the gates of an IR."""
+
+  def __init__(self, parm_ir: ir.Ir):
+    self.ir = parm_ir
+    n = parm_ir.ngates
+    # Gates are referenced by their index in the IR. New gates (from
+    # merges) are appended to a local copy of the interned gate table.
+    self.table = list(parm_ir.gate_table)
+    self.gid = [int(g) for g in parm_ir.gate_ids]
+    self.name = [parm_ir.names[i] for i in parm_ir.name_ids]
+    self.val = parm_ir.vals.tolist()
+    self.op = parm_ir.opcodes.tolist()
+    self.is_single = [op == ir.Op.SINGLE.value for op in self.op]
+    self.param = [g in parm_ir.params for g in self.gid]
+    self.ctl_id = parm_ir.ctl_ids.tolist()
+    self.qubits = parm_ir.qubits  # Target last, after the controls.
+    self.alive = [True] * n
+
+    # Link the gates on each wire.
+    self.prev = [[-1] * len(q) for q in self.qubits]
+    self.next = [[-1] * len(q) for q in self.qubits]
+    last = {}
+    for i, qubits in enumerate(self.qubits):
+      for k, q in enumerate(qubits):
+        p = last.get(q, -1)
+        if p >= 0:
+          self.next[p][self.qubits[p].index(q)] = i
+          self.prev[i][k] = p
+        last[q] = i
+
+    self._identity = {}
+    self._inverse = {}
+    self._kind = {}
+    self._commute = {}
+
+  def __len__(self):
+    return len(self.qubits)
+
+  def gate(self, i: int) -> np.ndarray:
+    return self.table[self.gid[i]]
+
+  def set_gate(self, i: int, gate: ops.Operator, val=None) -> None:
+    self.table.append(gate)
+    self.gid[i] = len(self.table) - 1
+    self.val[i] = np.nan if val is None else val
+
+  def same_qubits(self, i: int, j: int) -> bool:
+    """Check whether gates i and j act the same way on the same qubits."""
+
+    if self.qubits[i] != self.qubits[j] or self.op[i] != self.op[j]:
+      return False
+    if self.op[i] == ir.Op.MULTI.value:
+      # Same controls by |0>, the ancillas don't matter.
+      return (self.ir.ctl_table[self.ctl_id[i]][1] ==
+              self.ir.ctl_table[self.ctl_id[j]][1])
+    return True
+
+  def adjacent(self, i: int) -> int:
+    """Return the successor of i on all its wires, or -1."""
+
+    j = self.next[i][0]
+    if j < 0 or not self.same_qubits(i, j):
+      return -1
+    for k in range(1, len(self.qubits[i])):
+      if self.next[i][k] != j:
+        return -1
+    return j
+
+  def remove(self, i: int) -> None:
+    """Remove gate i, link its predecessors and successors."""
+
+    for k, q in enumerate(self.qubits[i]):
+      p = self.prev[i][k]
+      s = self.next[i][k]
+      if p >= 0:
+        self.next[p][self.qubits[p].index(q)] = s
+      if s >= 0:
+        self.prev[s][self.qubits[s].index(q)] = p
+    self.alive[i] = False
+
+  def predecessors(self, i: int):
+    return [p for p in self.prev[i] if p >= 0]
+
+  def is_identity(self, i: int) -> bool:
+    if self.param[i]:
+      return False
+    gid = self.gid[i]
+    if gid not in self._identity:
+      gate = np.asarray(self.table[gid])
+      self._identity[gid] = np.allclose(gate, np.eye(gate.shape[0]),
+                                        atol=1e-6)
+    return self._identity[gid]
+
+  def is_inverse(self, i: int, j: int) -> bool:
+    """Check whether gates i, j on the same qubits are inverses."""
+
+    if self.param[i] or self.param[j]:
+      return False
+    key = (self.gid[i], self.gid[j])
+    if key not in self._inverse:
+      a = np.asarray(self.table[key[0]])
+      b = np.asarray(self.table[key[1]])
+      self._inverse[key] = np.allclose(b @ a, np.eye(a.shape[0]),
+                                       atol=1e-6)
+    return self._inverse[key]
+
+  def kind(self, i: int, q: int) -> str:
+    """Return how gate i acts on qubit q, see 'commutes' below."""
+
+    if q != self.qubits[i][-1]:
+      return 'z'
+    if self.param[i]:
+      return param_kinds[self.ir.params[self.gid[i]][1]]
+    gid = self.gid[i]
+    if gid not in self._kind:
+      self._kind[gid] = gate_kind(np.asarray(self.table[gid]))
+    return self._kind[gid]
+
+  def commute(self, i: int, j: int) -> bool:
+    """Check whether gates i and j commute."""
+
+    for q in self.qubits[i]:
+      if q not in self.qubits[j]:
+        continue
+      ki = self.kind(i, q)
+      kj = self.kind(j, q)
+      if (ki, kj) in commutes:
+        continue
+      # Two single-qubit gates of another kind, eg., h h, may still
+      # commute, we check this with their matrices.
+      if (not self.is_single[i] or not self.is_single[j] or
+          self.param[i] or self.param[j]):
+        return False
+      key = (self.gid[i], self.gid[j])
+      if key not in self._commute:
+        a = np.asarray(self.table[key[0]])
+        b = np.asarray(self.table[key[1]])
+        self._commute[key] = np.allclose(a @ b, b @ a, atol=1e-6)
+      if not self._commute[key]:
+        return False
+    return True
+
+  def to_ir(self) -> ir.Ir:
+    """Build a new IR from the remaining gates, in original order."""
+
+    new_ir = ir.Ir()
+    new_ir.regs = list(self.ir.regs)
+    new_ir.nregs = self.ir.nregs
+    new_ir.regset = list(self.ir.regset)
+
+    # Map section markers to the new gate indices.
+    new_index = np.concatenate(
+        ([0], np.cumsum(np.array(self.alive, dtype=np.int64))))
+    markers = iter(self.ir.markers)
+    marker = next(markers, None)
+    for i in range(len(self) + 1):
+      while marker is not None and marker[0] == i:
+        new_ir.markers.append((int(new_index[i]), marker[1]))
+        marker = next(markers, None)
+      if i == len(self) or not self.alive[i]:
+        continue
+      val = None if np.isnan(self.val[i]) else self.val[i]
+      param = self.ir.params.get(self.gid[i]) if self.param[i] else None
+      if self.op[i] == ir.Op.MULTI.value:
+        ctls, by_0, aux = self.ir.ctl_table[self.ctl_id[i]]
+        new_ir.multi(self.name[i], ctls, by_0, self.qubits[i][-1],
+                     self.gate(i), aux, val, param)
+      elif self.op[i] == ir.Op.CTL.value:
+        new_ir.controlled(self.name[i], self.qubits[i][0],
+                          self.qubits[i][1], self.gate(i), val, param)
+      else:
+        new_ir.single(self.name[i], self.qubits[i][0], self.gate(i), val,
+                      param)
+    return new_ir
+
+
+def remove_identities(dag: Dag) -> int:
+  """Remove gates which are the identity. Returns # of removed gates."""
+
+  removed = 0
+  for i in range(len(dag)):
+    if dag.alive[i] and dag.is_identity(i):
+      dag.remove(i)
+      removed += 1
+  return removed
+
+
+def merge_rotations(dag: Dag) -> int:
+  """Merge adjacent rotations. Returns # of removed gates."""
+
+  removed = 0
+  for i in range(len(dag)):
+    if (not dag.alive[i] or dag.param[i] or
+        dag.name[i] not in rotations):
+      continue
+    j = dag.adjacent(i)
+    while j >= 0 and dag.name[j] == dag.name[i] and not dag.param[j]:
+      val = dag.val[i] + dag.val[j]
+      dag.set_gate(i, rotations[dag.name[i]](val), val)
+      dag.remove(j)
+      removed += 1
+      j = dag.adjacent(i)
+  return removed
+
+
+def cancel_inverses(dag: Dag) -> int:
+  """Cancel adjacent pairs of inverse gates. Returns # removed gates."""
+
+  removed = 0
+  for start in range(len(dag)):
+    work = [start]
+    while work:
+      i = work.pop()
+      if not dag.alive[i]:
+        continue
+      j = dag.adjacent(i)
+      if j < 0 or not dag.is_inverse(i, j):
+        continue
+      preds = dag.predecessors(i)
+      dag.remove(i)
+      dag.remove(j)
+      removed += 2
+      # Removing the pair may make a predecessor of i adjacent to a
+      # new successor, re-check those.
+      work.extend(preds)
+  return removed
+
+
+def partner(dag: Dag, i: int, j: int) -> bool:
+  """Check whether gate j can be merged with or cancels gate i."""
 
-# Currently, this is work-in-progress.
-# The code just builds a 2D grid representation from the IR.
+  if not dag.same_qubits(i, j) or dag.param[i] or dag.param[j]:
+    return False
+  if dag.name[i] == dag.name[j] and (dag.name[i] in rotations or
+                                     dag.name[i] in products):
+    return True
+  return dag.is_inverse(i, j)
 
 
-def build_2d_grid(parm_ir):
-  """Build simple grid with a column for each gate."""
+# Maximum number of gates to look past for a partner gate. This keeps
+# the pass linear, even for long runs of commuting gates.
+window = 32
 
-  grid = []
-  for g in parm_ir.gates:
-    step = [None] * parm_ir.ngates
-    if g.is_single():
-      step[g.idx0] = g
-    if g.is_ctl():
-      step[g.ctl] = g.ctl
-      step[g.idx1] = g
-    grid.append(step)
-  return grid
 
+def find_partner(dag: Dag, i: int) -> int:
+  """Find a gate after i which cancels or merges with i, or -1."""
 
-def ir_from_grid(grid):
-  """From a grid, reconstruct the IR."""
+  # We follow the first wire of gate i, skipping over gates that i
+  # commutes with. Gate i can then be moved right in front of the
+  # candidate gate j, if it also commutes with all the gates between
+  # i and j on its other wire.
+  #
+  wire = dag.qubits[i][0]
+  j = dag.next[i][0]
+  for _ in range(window):
+    if j < 0:
+      return -1
+    if partner(dag, i, j) and path_commutes(dag, i, j):
+      return j
+    if not dag.commute(i, j):
+      return -1
+    j = dag.next[j][dag.qubits[j].index(wire)]
+  return -1
 
-  new_ir = ir.Ir()
-  for step in grid:
-    for i in range(len(step)):
-      if not step[i]:
+
+def path_commutes(dag: Dag, i: int, j: int) -> bool:
+  """Check that i commutes with all gates up to j on its other wires."""
+
+  for k in range(1, len(dag.qubits[i])):
+    wire = dag.qubits[i][k]
+    m = dag.next[i][k]
+    while m != j:
+      if m < 0 or not dag.commute(i, m):
+        return False
+      m = dag.next[m][dag.qubits[m].index(wire)]
+  return True
+
+
+def commute_gates(dag: Dag) -> int:
+  """Cancel or merge gates across commuting gates. Returns # removed."""
+
+  removed = 0
+  for start in range(len(dag)):
+    work = [start]
+    while work:
+      i = work.pop()
+      if not dag.alive[i]:
         continue
-      if isinstance(step[i], ir.Node):
-        new_ir.add_node(step[i])
-  return new_ir
+      j = find_partner(dag, i)
+      if j < 0:
+        continue
+      preds = dag.predecessors(i) + dag.predecessors(j)
+      if dag.is_inverse(i, j):
+        dag.remove(i)
+        dag.remove(j)
+        removed += 2
+      else:
+        # Move i next to j and merge them into j.
+        name = dag.name[j]
+        if name in rotations:
+          val = dag.val[i] + dag.val[j]
+          dag.set_gate(j, rotations[name](val), val)
+        else:
+          dag.name[j], make_gate = products[name]
+          dag.set_gate(j, make_gate())
+        dag.remove(i)
+        removed += 1
+        work.append(j)
+      work.extend(p for p in preds if p != i)
+  return removed
+
+
+def synthesize(gate: np.ndarray):
+  """Return name, gate, and value to represent a 2x2 matrix in the IR."""
+
+  # Dumpers need a named gate. A product may be one of named_gates or
+  # a phase gate u1(lam). All others are 'u' gates, which the dumpers
+  # emit as U(theta, phi, lam), via the Z-Y decomposition.
+  #
+  for name, named in named_gates:
+    if np.allclose(gate, named, atol=1e-6):
+      return name, named, None
+  if abs(gate[0, 1]) < 1e-6 and abs(gate[1, 0]) < 1e-6:
+    if abs(gate[0, 0] - 1) < 1e-6:
+      lam = float(np.angle(gate[1, 1]))
+      return 'u1', ops.U1(lam), lam
+
+  # Snap tiny elements to 0, which allows faster kernels.
+  gate = gate.copy()
+  gate[np.abs(gate) < 1e-7] = 0
+  return 'u', ops.Operator(gate), None
+
+
+def fuse_singles(dag: Dag) -> int:
+  """Fuse runs of single-qubit gates. Returns # removed gates."""
+
+  def fusable(i):
+    return dag.is_single[i] and not dag.param[i]
+
+  removed = 0
+  for i in range(len(dag)):
+    if not dag.alive[i] or not fusable(i):
+      continue
+    p = dag.prev[i][0]
+    if p >= 0 and fusable(p):
+      continue  # Not the start of a run.
+    run = [i]
+    j = dag.next[i][0]
+    while j >= 0 and fusable(j):
+      run.append(j)
+      j = dag.next[j][0]
+    if len(run) < 2:
+      continue
+
+    gate = np.eye(2, dtype=np.complex128)
+    for k in run:
+      gate = np.asarray(dag.gate(k)) @ gate
+    for k in run[:-1]:
+      dag.remove(k)
+    removed += len(run) - 1
+
+    last = run[-1]
+    if np.allclose(gate, np.eye(2), atol=1e-6):
+      dag.remove(last)
+      removed += 1
+      continue
+    name, gate, val = synthesize(gate)
+    dag.name[last] = name
+    dag.set_gate(last, gate, val)
+  return removed
+
+
+passes = [
+    ('identity', remove_identities),
+    ('rotation', merge_rotations),
+    ('inverse', cancel_inverses),
+    ('commute', commute_gates),
+    ('fuse', fuse_singles),
+]
 
 
-def optimize(parm_ir):
+def optimize(parm_ir: ir.Ir,
+             stats: Dict[str, int] = None) -> ir.Ir:
   """Optimize the IR with a variety of techniques."""
 
-  grid = build_2d_grid(parm_ir)
-  new_ir = ir_from_grid(grid)
-  return new_ir
+  # The passes enable each other, eg., merged rotations may become
+  # the identity, or removed identities may expose inverse pairs.
+  # Hence we repeat them, until nothing changes anymore. The number
+  # of removed gates per pass are accumulated into 'stats'.
+  #
+  if stats is None:
+    stats = collections.Counter()
+  dag = Dag(parm_ir)
+  changed = True
+  while changed:
+    changed = False
+    for name, opt_pass in passes:
+      removed = opt_pass(dag)
+      stats[name] = stats.get(name, 0) + removed
+      changed = changed or removed > 0
+  return dag.to_ir()
@@ -0,0 +1,156 @@
+# python3
+"""class PauliSum represents observables as weighted Pauli strings."""
+
+from __future__ import annotations
+
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+from src.lib import ops
+from src.lib import state
+
+
+def parity(vals: np.ndarray) -> np.ndarray:
+  """Compute the parity (number of 1-bits mod 2) of each value."""
+
+  vals = vals.copy()
+  for shift in [32, 16, 8, 4, 2, 1]:
+    vals ^= vals >> shift
+  return vals & 1
+
+
+class PauliSum:
+  """Observable as weighted sum of Pauli strings, eg., 0.5 XZIY + ZZII."""
+
+  # A Pauli string is a tensor product of single-qubit Pauli operators,
+  # with the leftmost character acting on qubit 0, the most significant
+  # bit in the state vector. For example, 'XZ' is X on qubit 0 and Z
+  # on qubit 1.
+  #
+  # For the expectation value we never build a matrix. A Pauli string P
+  # maps each basis state |i> to a single basis state:
+  #
+  #    X|b> = |1-b>,  Y|b> = i(-1)^b |1-b>,  Z|b> = (-1)^b |b>
+  #
+  # Hence, with 'xmask' marking the qubits with X or Y (these bits
+  # flip), 'zmask' marking the qubits with Y or Z (these bits
+  # contribute a sign), and ny being the number of Y's:
+  #
+  #    P|i> = i^ny (-1)^parity(i & zmask) |i ^ xmask>
+  #
+  # and the expectation value becomes a single sweep over the state:
+  #
+  #    <psi|P|psi> = i^ny sum_i conj(psi[i ^ xmask]) psi[i]
+  #                             (-1)^parity(i & zmask)
+  #
+  # Terms with the same xmask share the product of amplitudes, which
+  # is computed only once per group of terms.
+
+  def __init__(self, terms: Iterable[Tuple[float, str]] = ()):
+    self.terms: List[Tuple[float, str]] = []
+    for coeff, paulis in terms:
+      self.add_term(coeff, paulis)
+
+  def __str__(self) -> str:
+    return ' + '.join(f'{coeff:.4f} * {paulis}'
+                      for coeff, paulis in self.terms)
+
+  def __add__(self, other: PauliSum) -> PauliSum:
+    return PauliSum(self.terms + other.terms)
+
+  def __mul__(self, factor: float) -> PauliSum:
+    return PauliSum([(factor * coeff, paulis)
+                     for coeff, paulis in self.terms])
+
+  def __rmul__(self, factor: float) -> PauliSum:
+    return self * factor
+
+  def add_term(self, coeff: float, paulis: str) -> None:
+    """Add the term coeff * paulis, eg., 0.5 * 'XZIY'."""
+
+    paulis = paulis.upper()
+    if not paulis or any(p not in 'IXYZ' for p in paulis):
+      raise ValueError(f'Invalid Pauli string: {paulis}')
+    if self.terms and len(paulis) != self.nbits:
+      raise ValueError('All Pauli strings must have the same length.')
+    self.terms.append((coeff, paulis))
+
+  @property
+  def nbits(self) -> int:
+    return len(self.terms[0][1]) if self.terms else 0
+
+  def masks(self, paulis: str) -> Tuple[int, int, int]:
+    """Compute xmask, zmask, and number of Y's for a Pauli string."""
+
+    xmask = zmask = ny = 0
+    for idx, p in enumerate(paulis):
+      bit = 1 << (len(paulis) - idx - 1)
+      if p in 'XY':
+        xmask |= bit
+      if p in 'YZ':
+        zmask |= bit
+      if p == 'Y':
+        ny += 1
+    return xmask, zmask, ny
+
+  def expectation(self, psi: state.State):
+    """Compute <psi|H|psi> directly on the state vector."""
+
+    # For a batch of states, of shape (batch, 2^n), the result is an
+    # array with the expectation value of each state.
+    if psi.shape[-1] != 1 << self.nbits:
+      raise ValueError('State and observable sizes do not match.')
+
+    psi = np.asarray(psi, dtype=np.complex128)
+    idx = np.arange(psi.shape[-1], dtype=np.int64)
+
+    groups = {}
+    for coeff, paulis in self.terms:
+      xmask, zmask, ny = self.masks(paulis)
+      groups.setdefault(xmask, []).append((coeff, zmask, ny))
+
+    result = 0.0
+    for xmask, group in groups.items():
+      prod = psi.conj()[..., idx ^ xmask] * psi
+      total = prod.sum(axis=-1)
+      for coeff, zmask, ny in group:
+        if zmask:
+          val = total - 2 * prod[..., parity(idx & zmask) == 1].sum(axis=-1)
+        else:
+          val = total
+        result += coeff * (1j**ny) * val
+    if psi.ndim > 1:
+      return np.real(result)
+    return float(np.real(result))
+
+  def apply(self, psi: state.State) -> state.State:
+    """Compute H|psi>, also directly on the state vector."""
+
+    # With the notation above, P|psi> has the amplitude
+    # i^ny (-1)^parity(i & zmask) psi[i] at index i ^ xmask.
+    if psi.shape[-1] != 1 << self.nbits:
+      raise ValueError('State and observable sizes do not match.')
+
+    psi = np.asarray(psi, dtype=np.complex128)
+    idx = np.arange(psi.shape[-1], dtype=np.int64)
+    res = np.zeros(psi.shape, dtype=np.complex128)
+    for coeff, paulis in self.terms:
+      xmask, zmask, ny = self.masks(paulis)
+      sign = 1 - 2 * parity(idx & zmask)
+      res[..., idx ^ xmask] += coeff * (1j**ny) * sign * psi
+    return state.State(res)
+
+  def matrix(self) -> ops.Operator:
+    """Build the dense matrix (only for small sizes, eg., for testing)."""
+
+    paulis = {'I': ops.Identity(), 'X': ops.PauliX(),
+              'Y': ops.PauliY(), 'Z': ops.PauliZ()}
+    dim = 1 << self.nbits
+    res = ops.Operator(np.zeros((dim, dim)))
+    for coeff, string in self.terms:
+      op = paulis[string[0]]
+      for p in string[1:]:
+        op = op * paulis[p]
+      res = res + coeff * op
+    return ops.Operator(res)
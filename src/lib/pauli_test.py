@@ -0,0 +1,63 @@
+# python3
+import random
+
+from absl.testing import absltest
+import numpy as np
+
+from src.lib import ops
+from src.lib import pauli
+from src.lib import state
+
+
+class PauliTest(absltest.TestCase):
+
+  def rand_state(self, nbits: int) -> state.State:
+    psi = state.State(np.random.random(2**nbits) +
+                      1j * np.random.random(2**nbits))
+    psi.normalize()
+    return psi
+
+  def test_single_qubit(self):
+    psi = state.zeros(1)
+    self.assertAlmostEqual(pauli.PauliSum([(1.0, 'Z')]).expectation(psi), 1.0)
+    self.assertAlmostEqual(pauli.PauliSum([(1.0, 'X')]).expectation(psi), 0.0)
+
+    psi = ops.Hadamard()(psi)
+    self.assertAlmostEqual(pauli.PauliSum([(1.0, 'X')]).expectation(psi), 1.0,
+                           places=5)
+
+    psi = ops.Sgate()(psi)
+    self.assertAlmostEqual(pauli.PauliSum([(1.0, 'Y')]).expectation(psi), 1.0,
+                           places=5)
+
+  def test_against_matrix(self):
+    nbits = 4
+    for _ in range(10):
+      hamil = pauli.PauliSum()
+      for _ in range(8):
+        paulis = ''.join(random.choice('IXYZ') for _ in range(nbits))
+        hamil.add_term(random.random() - 0.5, paulis)
+      psi = self.rand_state(nbits)
+
+      expect = np.real(np.vdot(psi, hamil.matrix() @ psi))
+      self.assertAlmostEqual(hamil.expectation(psi), expect, places=5)
+      self.assertTrue(np.allclose(hamil.apply(psi), hamil.matrix() @ psi,
+                                  atol=1e-5))
+
+  def test_algebra(self):
+    h1 = pauli.PauliSum([(0.5, 'XZ')])
+    h2 = pauli.PauliSum([(0.25, 'yy')])
+    h = 2.0 * (h1 + h2)
+    self.assertLen(h.terms, 2)
+    self.assertEqual(h.nbits, 2)
+    self.assertTrue(h.matrix().is_close(
+        ops.PauliX() * ops.PauliZ() + 0.5 * ops.PauliY() * ops.PauliY()))
+
+    with self.assertRaises(ValueError):
+      h.add_term(1.0, 'XYZ')
+    with self.assertRaises(ValueError):
+      h.add_term(1.0, 'XA')
+
+
+if __name__ == '__main__':
+  absltest.main()
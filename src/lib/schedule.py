@@ -0,0 +1,100 @@
+# python3
+"""Schedule the gates of an IR into moments (layers)."""
+
+from typing import List
+
+import numpy as np
+
+from src.lib import ir
+
+# A moment, or layer, is a set of gates acting on disjoint qubits.
+# All gates in a moment can be applied at the same time, eg., by a
+# simulation kernel that applies a whole moment in one sweep over the
+# state vector, or by hardware, which executes gates in parallel.
+#
+# Scheduling assigns each gate to a layer, respecting the order of
+# gates on each qubit:
+#
+#   ASAP (as soon as possible): A gate goes into the layer right after
+#        the last layer used by any of its qubits.
+#   ALAP (as late as possible): The same, scheduling backwards from
+#        the end of the circuit.
+#
+# Both schedules have the same number of layers, which is the depth
+# of the circuit. Gates with the same ASAP and ALAP layer have no
+# slack, they are on a critical path. A longest chain of dependent
+# gates is a critical path, its length is the depth.
+#
+# Both schedules are computed in a single pass each, in O(G).
+
+
+class Schedule:
+  """ASAP and ALAP schedules of an IR."""
+
+  def __init__(self, parm_ir: ir.Ir):
+    n = parm_ir.ngates
+    qubits = parm_ir.qubits
+
+    # ASAP, also remember the predecessor that determined the layer
+    # of each gate, to find a critical path.
+    asap = [0] * n
+    crit_prev = [-1] * n
+    last = {}  # qubit -> last gate on this qubit
+    for i in range(n):
+      layer = 0
+      for q in qubits[i]:
+        p = last.get(q, -1)
+        if p >= 0 and asap[p] + 1 > layer:
+          layer = asap[p] + 1
+          crit_prev[i] = p
+        last[q] = i
+      asap[i] = layer
+    self.depth = max(asap) + 1 if n else 0
+
+    # ALAP, as ASAP on the reversed circuit.
+    rev = [0] * n
+    first = {}  # qubit -> first gate (so far) on this qubit
+    for i in range(n - 1, -1, -1):
+      layer = 0
+      for q in qubits[i]:
+        s = first.get(q, -1)
+        if s >= 0 and rev[s] + 1 > layer:
+          layer = rev[s] + 1
+        first[q] = i
+      rev[i] = layer
+
+    self.asap = np.array(asap, dtype=np.int64)
+    self.alap = self.depth - 1 - np.array(rev, dtype=np.int64)
+    self._crit_prev = crit_prev
+
+  @property
+  def slack(self) -> np.ndarray:
+    """Number of layers each gate can move without changing the depth."""
+
+    return self.alap - self.asap
+
+  def layers(self, alap: bool = False) -> List[np.ndarray]:
+    """List of layers, each as an array of gate indices, in order."""
+
+    sched = self.alap if alap else self.asap
+    order = np.argsort(sched, kind='stable')
+    bounds = np.searchsorted(sched[order], np.arange(self.depth + 1))
+    return [order[bounds[d]:bounds[d + 1]] for d in range(self.depth)]
+
+  def widths(self, alap: bool = False) -> np.ndarray:
+    """Number of gates per layer."""
+
+    sched = self.alap if alap else self.asap
+    return np.bincount(sched, minlength=self.depth)
+
+  def critical_path(self) -> List[int]:
+    """Gate indices of a longest chain of dependent gates."""
+
+    if not self.depth:
+      return []
+    i = int(np.argmax(self.asap))
+    path = []
+    while i >= 0:
+      path.append(i)
+      i = self._crit_prev[i]
+    return path[::-1]
@@ -0,0 +1,67 @@
+# python3
+from absl.testing import absltest
+import numpy as np
+
+from src.lib import circuit
+from src.lib import schedule
+
+
+class ScheduleTest(absltest.TestCase):
+
+  def test_schedule(self):
+    qc = circuit.qc('schedule', eager=False)
+    qc.reg(3, 0)
+    qc.h(0)        # 0
+    qc.h(1)        # 1
+    qc.cx(0, 1)    # 2
+    qc.t(2)        # 3, can be in layer 0 or 1
+    qc.cx(1, 2)    # 4
+    qc.h(0)        # 5
+
+    sched = schedule.Schedule(qc.ir)
+    self.assertEqual(sched.depth, 3)
+    self.assertEqual(list(sched.asap), [0, 0, 1, 0, 2, 2])
+    self.assertEqual(list(sched.alap), [0, 0, 1, 1, 2, 2])
+    self.assertEqual(list(sched.slack), [0, 0, 0, 1, 0, 0])
+    self.assertEqual([list(l) for l in sched.layers()],
+                     [[0, 1, 3], [2], [4, 5]])
+    self.assertEqual([list(l) for l in sched.layers(alap=True)],
+                     [[0, 1], [2, 3], [4, 5]])
+    self.assertEqual(list(sched.widths()), [3, 1, 2])
+    self.assertEqual(sched.critical_path(), [0, 2, 4])
+    self.assertIn('Depth : 3', qc.stats())
+
+  def test_disjoint_layers(self):
+    qc = circuit.qc('random', eager=False)
+    qc.reg(6, 0)
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+      a, b = rng.choice(6, 2, replace=False)
+      if rng.random() < 0.5:
+        qc.h(int(a))
+      else:
+        qc.cx(int(a), int(b))
+
+    sched = qc.schedule()
+    for alap in [False, True]:
+      layers = sched.layers(alap)
+      self.assertLen(layers, sched.depth)
+      self.assertEqual(sum(len(l) for l in layers), qc.ir.ngates)
+      for layer in layers:
+        qubits = [q for i in layer for q in qc.ir.gates[int(i)].qubits]
+        self.assertEqual(len(qubits), len(set(qubits)))
+
+    # Gates on a critical path have no slack.
+    path = sched.critical_path()
+    self.assertLen(path, sched.depth)
+    self.assertTrue(np.all(sched.slack[path] == 0))
+
+  def test_empty(self):
+    sched = schedule.Schedule(circuit.qc('empty').ir)
+    self.assertEqual(sched.depth, 0)
+    self.assertEqual(sched.layers(), [])
+    self.assertEqual(sched.critical_path(), [])
+
+
+if __name__ == '__main__':
+  absltest.main()
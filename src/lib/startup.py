@@ -13,10 +13,13 @@
 # pylint: disable=unused-import
 import numpy as np
 
+from src.lib import batch
 from src.lib import bell
 from src.lib import circuit
 from src.lib import helper
 from src.lib import ops
+from src.lib import pauli
+from src.lib import schedule
 from src.lib import state
 from src.lib import tensor
 print(__file__ + ': qcc initialized')
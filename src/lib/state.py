@@ -4,7 +4,7 @@
 import cmath
 import math
 import random
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 import numpy as np
 
@@ -31,7 +31,66 @@ class State(tensor.Tensor):
     dump_state(self, desc, prob_only)
 
   def density(self) -> tensor.Tensor:
-    return tensor.Tensor(np.outer(self, self.conj()))
+    psi = np.asarray(self)
+    return tensor.Tensor(np.outer(psi, psi.conj()))
+
+  def reduced_density(self, qubits: List[int]) -> tensor.Tensor:
+    """Compute the reduced density matrix for 'qubits' of this state."""
+
+    # Instead of building the full 4^n density matrix and tracing out
+    # all other qubits, we view the state as a 2^k x 2^(n-k) matrix M,
+    # with the rows indexed by the k 'qubits' (in the given order)
+    # and the columns indexed by all other qubits. Summing over the
+    # other qubits is then a single matrix product, rho = M M^dagger,
+    # at a cost of O(2^n 2^k).
+    nbits = self.nbits
+    if len(set(qubits)) != len(qubits):
+      raise ValueError('Qubit indices must be unique.')
+    if any(q < 0 or q >= nbits for q in qubits):
+      raise ValueError('Qubit indices must be between 0 and nbits-1.')
+
+    others = [q for q in range(nbits) if q not in qubits]
+    m = np.asarray(self).reshape([2] * nbits)
+    m = m.transpose(list(qubits) + others).reshape(2**len(qubits), -1)
+    return tensor.Tensor(m @ m.conj().T)
+
+  def qubit_marginals(self) -> np.ndarray:
+    """Compute the 2x2 reduced density matrices of all qubits."""
+
+    # For qubit q, we view the state as a 2^q x 2 x 2^(n-q-1) tensor.
+    # The two slices a = psi[:, 0, :] and b = psi[:, 1, :] hold the
+    # amplitudes with qubit q in |0> and |1>, and the reduced density
+    # matrix for qubit q is:
+    #
+    #   | sum |a|^2        sum a conj(b) |
+    #   | sum b conj(a)    sum |b|^2     |
+    #
+    # This is O(2^n) per qubit, without any partial trace. The
+    # probabilities are computed only once and shared by all qubits.
+    nbits = self.nbits
+    psi = np.asarray(self)
+    probs = self.probabilities()
+    rho = np.zeros((nbits, 2, 2), dtype=psi.dtype)
+    for q in range(nbits):
+      shape = (2**q, 2, 2**(nbits - q - 1))
+      view = psi.reshape(shape)
+      pview = probs.reshape(shape)
+      rho[q, 0, 0] = pview[:, 0, :].sum()
+      rho[q, 1, 1] = pview[:, 1, :].sum()
+      rho[q, 1, 0] = np.vdot(view[:, 0, :], view[:, 1, :])
+      rho[q, 0, 1] = np.conj(rho[q, 1, 0])
+    return rho
+
+  def bloch_vectors(self) -> np.ndarray:
+    """Compute Bloch sphere coordinates (x, y, z) for all qubits."""
+
+    rho = self.qubit_marginals()
+    return np.stack([2.0 * rho[:, 1, 0].real,
+                     2.0 * rho[:, 1, 0].imag,
+                     2.0 * rho[:, 0, 0].real - 1.0], axis=1)
+
+  def dump_qubits(self, desc: Optional[str] = None) -> None:
+    dump_qubits(self, desc)
 
   def adjoint(self) -> tensor.Tensor:
     return self.conj().transpose()
@@ -39,22 +98,23 @@ class State(tensor.Tensor):
   def normalize(self) -> None:
     """Renormalize the state. Sum of squared amplitudes==1.0."""
 
-    dprod = np.conj(self) @ self
-    if dprod.is_close(0.0):
+    psi = np.asarray(self)
+    dprod = np.real(np.vdot(psi, psi))
+    if math.isclose(dprod, 0.0, abs_tol=1e-6):
       raise AssertionError('Normalizing to zero-probability state.')
-    self /= np.sqrt(np.real(dprod))
+    psi /= np.sqrt(dprod)
 
   def ampl(self, *bits) -> np.complexfloating:
     """Return amplitude for state indexed by 'bits'."""
 
     idx = helper.bits2val(bits)
-    return self[idx]
+    return np.asarray(self)[idx]
 
   def prob(self, *bits) -> float:
     """Return probability for state indexed by 'bits'."""
 
     amplitude = self.ampl(*bits)
-    return np.real(amplitude.conj() * amplitude)
+    return amplitude.real**2 + amplitude.imag**2
 
   def phase(self, *bits) -> float:
     """Return phase of a state from the complex amplitude."""
@@ -62,15 +122,46 @@ class State(tensor.Tensor):
     amplitude = self.ampl(*bits)
     return math.degrees(cmath.phase(amplitude))
 
+  def probabilities(self) -> np.ndarray:
+    """Return the probabilities of all basis states as an array."""
+
+    psi = np.asarray(self)
+    return psi.real**2 + psi.imag**2
+
+  def argmax_prob(self) -> int:
+    """Return the index of the basis state with highest probability."""
+
+    return int(np.argmax(self.probabilities()))
+
+  def top_k(self, k: int) -> (np.ndarray, np.ndarray):
+    """Return indices and probabilities of the k most likely states."""
+
+    if k < 0:
+      raise ValueError('k must not be negative.')
+    probs = self.probabilities()
+    k = min(k, probs.shape[0])
+    if k == 0:
+      return np.zeros(0, dtype=np.int64), probs[:0]
+    # Partition in O(2^n), then only sort the top k elements. Ties
+    # are broken towards the lower index.
+    indices = np.sort(np.argpartition(probs, -k)[-k:])
+    indices = indices[np.argsort(-probs[indices], kind='stable')]
+    return indices, probs[indices]
+
+  def nonzero(self, threshold: float = 0.0) -> np.ndarray:
+    """Return indices of states with probability > threshold."""
+
+    return np.flatnonzero(self.probabilities() > threshold)
+
   def maxprob(self) -> (List[float], float):
     """Find state with highest probability."""
 
-    maxbits, maxprob = [], 0.0
-    for bits in helper.bitprod(self.nbits):
-      cur_prob = self.prob(*bits)
-      if cur_prob > maxprob:
-        maxbits, maxprob = bits, cur_prob
-    return maxbits, maxprob
+    probs = self.probabilities()
+    idx = int(np.argmax(probs))
+    maxprob = probs[idx]
+    if maxprob <= 0.0:
+      return [], 0.0
+    return tuple(helper.val2bits(idx, self.nbits)), maxprob
 
   # The Schmidt number is an entanglement measure for a state.
   #
@@ -107,6 +198,35 @@ class State(tensor.Tensor):
     qc = np.sum(d > 1e-10)
     return qc
 
+  def entanglement_profile(self, threshold: float = 1e-10
+                           ) -> List[Tuple[int, float]]:
+    """Compute Schmidt rank and entropy for all contiguous cuts."""
+
+    # For each cut between qubits [0, .., c-1] and [c, .., n-1], this
+    # computes the Schmidt rank and the von Neumann entanglement
+    # entropy (in bits). Instead of a full SVD of the whole state per
+    # cut (as in schmidt_number()), we sweep left to right, similar
+    # to the construction of a matrix product state. After the cut c,
+    # only the product S V^dagger is carried over to the next cut,
+    # the left isometries U are dropped, as they don't change singular
+    # values. Singular values below 'threshold' are truncated.
+    #
+    # A low Schmidt rank for all cuts indicates a state that can be
+    # simulated cheaply with low-entanglement methods.
+    profile = []
+    rest = np.asarray(self, dtype=np.complex128).reshape(1, -1)
+    for _ in range(1, self.nbits):
+      m = rest.reshape(rest.shape[0] * 2, -1)
+      _, svals, vh = np.linalg.svd(m, full_matrices=False)
+      keep = svals > threshold
+      svals, vh = svals[keep], vh[keep]
+
+      probs = svals**2 / np.sum(svals**2)
+      entropy = float(-np.sum(probs * np.log2(probs)))
+      profile.append((int(svals.shape[0]), max(entropy, 0.0)))
+      rest = svals[:, None] * vh
+    return profile
+
   def apply1(self, gate, index) -> None:
     """Apply single-qubit gate to this state."""
 
@@ -303,16 +423,35 @@ def dump_state(psi, desc: Optional[str] = None,
       print(i % 10, end='')
     print(f'> \'{desc}\'')
 
-  state_list: List[str] = []
-  for bits in helper.bitprod(psi.nbits):
-    if prob_only and (psi.prob(*bits) < 10e-6):
-      continue
+  if prob_only:
+    indices = psi.nonzero(10e-6)
+  else:
+    indices = range(psi.shape[0])
+  probs = psi.probabilities()
+  phases = np.angle(np.asarray(psi), deg=True)
 
+  state_list: List[str] = []
+  for idx in indices:
     state_list.append(
         '{:s}:  ampl: {:+.2f} prob: {:.2f} Phase: {:5.1f}'
-        .format(state_to_string(bits),
-                psi.ampl(*bits),
-                psi.prob(*bits),
-                psi.phase(*bits)))
-  state_list.sort()
+        .format(state_to_string(helper.val2bits(idx, psi.nbits)),
+                psi[idx],
+                probs[idx],
+                phases[idx]))
   print(*state_list, sep='\n')
+
+
+def dump_qubits(psi, desc: Optional[str] = None) -> None:
+  """Dump per-qubit probabilities and Bloch coordinates of a state."""
+
+  # Unlike dump_state(), this does not enumerate basis states and
+  # works for wide states as well.
+  if desc:
+    print(f'\'{desc}\'')
+  # The probability of |1> follows from z = p(|0>) - p(|1>), no need
+  # to compute the marginals twice.
+  bloch = psi.bloch_vectors()
+  for q in range(psi.nbits):
+    x, y, z = bloch[q]
+    print(f'qubit {q:2d}: p(|1>): {(1.0 - z) / 2:.2f}  '
+          f'x: {x:.2f}, y: {y:.2f}, z: {z:.2f}')
@@ -5,6 +5,7 @@ import random
 from absl.testing import absltest
 import numpy as np
 
+from src.lib import helper
 from src.lib import state
 
 
@@ -43,6 +44,45 @@ class StateTest(absltest.TestCase):
     self.assertEqual(psi.prob(1, 1, 0), 0.0)
     self.assertEqual(psi.prob(1, 1, 1), 0.0)
 
+  def test_prob_queries(self):
+    psi = state.State(np.array([0.1, 0.7, 0.0, 0.5, 0.5, 0.0, 0.0, 0.1]))
+    psi.normalize()
+    probs = psi.probabilities()
+    self.assertTrue(np.allclose(probs.sum(), 1.0))
+    self.assertEqual(psi.argmax_prob(), 1)
+
+    maxbits, maxprob = psi.maxprob()
+    self.assertEqual(maxbits, (0, 0, 1))
+    self.assertTrue(np.allclose(maxprob, psi.prob(0, 0, 1)))
+
+    indices, top = psi.top_k(3)
+    self.assertEqual(list(indices), [1, 3, 4])
+    self.assertTrue(np.allclose(top, probs[[1, 3, 4]]))
+    indices, top = psi.top_k(0)
+    self.assertEqual((indices.shape, top.shape), ((0,), (0,)))
+    self.assertEqual(indices.dtype, np.int64)
+    with self.assertRaises(ValueError):
+      psi.top_k(-1)
+    self.assertEqual(list(psi.nonzero()), [0, 1, 3, 4, 7])
+    self.assertEqual(list(psi.nonzero(0.1)), [1, 3, 4])
+
+  def test_qubit_marginals(self):
+    psi = state.State(np.random.random(2**4) + 1j * np.random.random(2**4))
+    psi.normalize()
+    rho = psi.qubit_marginals()
+    bloch = psi.bloch_vectors()
+    self.assertEqual(rho.shape, (4, 2, 2))
+    self.assertEqual(bloch.shape, (4, 3))
+    for q in range(4):
+      reduced = psi.reduced_density([q])
+      self.assertTrue(np.allclose(rho[q], reduced, atol=1e-6))
+      self.assertTrue(np.allclose(bloch[q],
+                                  helper.density_to_cartesian(reduced),
+                                  atol=1e-6))
+
+    psi = state.bitstring(0, 1)
+    self.assertTrue(np.allclose(psi.bloch_vectors(), [[0, 0, 1], [0, 0, -1]]))
+
   def test_schmidt(self):
     psi = state.zeros(2)
     self.assertEqual(psi.schmidt_number([1]), 1.0)
@@ -53,6 +93,28 @@ class StateTest(absltest.TestCase):
     psi = state.State(np.array([1.0, 1.0, 0.0, 1.0]))
     self.assertNotEqual(psi.schmidt_number([1]), 1.0)
 
+  def test_entanglement_profile(self):
+    psi = state.bitstring(0, 1, 1, 0, 1)
+    for rank, entropy in psi.entanglement_profile():
+      self.assertEqual(rank, 1)
+      self.assertAlmostEqual(entropy, 0.0)
+
+    # GHZ state, every cut has one bit of entanglement.
+    psi = state.zeros(5)
+    psi[0] = psi[31] = 1.0
+    psi.normalize()
+    for rank, entropy in psi.entanglement_profile():
+      self.assertEqual(rank, 2)
+      self.assertAlmostEqual(entropy, 1.0, places=5)
+
+    psi = state.State(np.random.random(2**6) + 1j * np.random.random(2**6))
+    psi.normalize()
+    profile = psi.entanglement_profile()
+    self.assertLen(profile, 5)
+    for cut in range(1, 6):
+      self.assertEqual(profile[cut - 1][0],
+                       psi.schmidt_number(list(range(cut))))
+
   def test_density(self):
     psi = state.bitstring(1, 0)
     rho = psi.density()
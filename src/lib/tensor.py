@@ -11,8 +11,6 @@
 
 from __future__ import annotations
 
-import math
-
 import numpy as np
 
 
@@ -39,6 +37,93 @@ def float_accuracy(bit_width: int = 64):
   tensor_width = bit_width
 
 
+# Validation policy for the checks during construction of operators,
+# eg., whether an oracle or QFT operator is unitary:
+#   'off':         No checks at all.
+#   'randomized':  Freivalds-style checks on a few random vectors,
+#                  O(k 4^n) for a 2^n x 2^n operator.
+#   'exact':       Full checks, eg., U^dagger U = I, which is O(8^n).
+validation = 'randomized'
+
+
+def validation_policy(policy: str) -> None:
+  """Set validation policy to 'off', 'randomized', or 'exact'."""
+
+  global validation
+  if policy not in ('off', 'randomized', 'exact'):
+    raise AssertionError('Invalid validation policy, must be ' +
+                         '"off", "randomized", or "exact"')
+  validation = policy
+
+
+def kron(a: np.ndarray, b: np.ndarray,
+         out: np.ndarray = None) -> np.ndarray:
+  """Kronecker product of two raw vectors or matrices."""
+
+  # np.kron is general, but has a large constant overhead, which
+  # dominates for the small tensors in this package. For vectors and
+  # matrices, the product is a single broadcasted multiply.
+  #
+  # With 'out', the product is written into the given (contiguous)
+  # array, which avoids allocating a new result, eg., in loops.
+  if a.ndim == 1 and b.ndim == 1:
+    if out is not None:
+      np.multiply(a[:, None], b[None, :],
+                  out=out.reshape(a.shape[0], b.shape[0]))
+      return out
+    return (a[:, None] * b[None, :]).reshape(-1)
+  if a.ndim == 2 and b.ndim == 2:
+    if out is not None:
+      np.multiply(a[:, None, :, None], b[None, :, None, :],
+                  out=out.reshape(a.shape[0], b.shape[0],
+                                  a.shape[1], b.shape[1]))
+      return out
+    return (a[:, None, :, None] * b[None, :, None, :]).reshape(
+        a.shape[0] * b.shape[0], a.shape[1] * b.shape[1])
+  if out is not None:
+    out[...] = np.kron(a, b)
+    return out
+  return np.kron(a, b)
+
+
+class Arena:
+  """Reusable scratch buffers, to avoid allocations per step."""
+
+  # Iterative algorithms apply the same kind of operation to states of
+  # the same size over and over. Allocating a fresh 2^n temporary for
+  # each step churns memory and, for large states, causes page faults.
+  # The arena keeps one buffer per (slot, dtype), which only grows, and
+  # hands out views of it. A buffer is only valid until the next get()
+  # on the same slot. Functions that nest must use different slots.
+
+  def __init__(self):
+    self.buffers = {}
+
+  def get(self, shape, dtype=None, slot: int = 0) -> np.ndarray:
+    """Return an (uninitialized) scratch array of the given shape."""
+
+    dtype = np.dtype(tensor_type() if dtype is None else dtype)
+    size = int(np.prod(shape))
+    buf = self.buffers.get((slot, dtype))
+    if buf is None or buf.shape[0] < size:
+      buf = np.empty(size, dtype=dtype)
+      self.buffers[(slot, dtype)] = buf
+    return buf[:size].reshape(shape)
+
+  @property
+  def nbytes(self) -> int:
+    return sum(buf.nbytes for buf in self.buffers.values())
+
+  def clear(self) -> None:
+    self.buffers.clear()
+
+
+# Scratch buffers for the library. Slot 0 is used by leaf functions,
+# like Operator.apply_(), slot 1 by functions calling those, like
+# ops.ControlledApply().
+arena = Arena()
+
+
 class Tensor(np.ndarray):
   """Tensor is a numpy array representing a state or operator."""
 
@@ -51,14 +136,29 @@ class Tensor(np.ndarray):
     # if new attributes are needed, this is the place to add them, like this:
     #    self.info = getattr(obj, 'info', None)
 
+  # Every numpy operation on a Tensor, including each temporary in an
+  # expression, goes through subclass dispatch and __array_finalize__.
+  # For small tensors this overhead dominates the actual math. Hence,
+  # the methods below (and the engines in ops and state) do their math
+  # on the raw numpy buffer, via np.asarray() (which does not copy), and
+  # wrap the result into a Tensor only once, at the API boundary.
+  # See benchmarks/tensor_math.py for a microbenchmark.
+
   @property
   def nbits(self) -> int:
-    return int(math.log2(self.shape[0]))
+    # Dimensions are powers of 2, the bit length gives the exponent
+    # without the floating point log2.
+    return self.shape[0].bit_length() - 1
 
   def is_close(self, arg) -> bool:
     """Check that a 1D or 2D tensor is numerically close to arg."""
 
-    return np.allclose(self, arg, atol=1e-6)
+    a = np.asarray(self)
+    b = np.asarray(arg)
+    if a.shape != b.shape:
+      return np.allclose(a, b, atol=1e-6)
+    # Same test as np.allclose(a, b, atol=1e-6), without its overhead.
+    return bool(np.all(np.abs(a - b) <= 1e-6 + 1e-5 * np.abs(b)))
 
   def is_hermitian(self) -> bool:
     """Check if this tensor is hermitian - Udag = U."""
@@ -67,13 +167,32 @@ class Tensor(np.ndarray):
       return False
     if self.shape[0] != self.shape[1]:
       return False
-    return self.is_close(np.conj(self.transpose()))
+    u = np.asarray(self)
+    return np.allclose(u, np.conj(u.T), atol=1e-6)
 
   def is_unitary(self) -> bool:
     """Check if this tensor is unitary - Udag*U = I."""
 
-    return Tensor(np.conj(self.transpose()) @ self).is_close(
-        Tensor(np.eye(self.shape[0])))
+    u = np.asarray(self)
+    return np.allclose(np.conj(u.T) @ u, np.eye(self.shape[0]), atol=1e-6)
+
+  def validate_unitary(self, trials: int = 3) -> bool:
+    """Check unitarity according to the validation policy."""
+
+    # Freivalds' algorithm: for random vectors V, check that
+    # U^dagger (U V) = V, with only matrix-vector products. If U is not
+    # unitary, this fails with high probability.
+    if validation == 'off':
+      return True
+    if validation == 'exact':
+      return self.is_unitary()
+    if len(self.shape) != 2 or self.shape[0] != self.shape[1]:
+      return False
+    shape = (self.shape[0], trials)
+    v = np.random.randn(*shape) + 1j * np.random.randn(*shape)
+    v /= np.linalg.norm(v, axis=0)
+    u = np.asarray(self)
+    return np.allclose(np.conj(u.T) @ (u @ v), v, atol=1e-5)
 
   def is_density(self) -> bool:
     """Check if this tensor is a density operator."""
@@ -105,7 +224,7 @@ class Tensor(np.ndarray):
   def kron(self, arg: Tensor) -> Tensor:
     """Return the kronecker product of this object with arg."""
 
-    return self.__class__(np.kron(self, arg))
+    return self.__class__(kron(np.asarray(self), np.asarray(arg)))
 
   def __mul__(self, arg: Tensor) -> Tensor:
     """Inline * operator maps to kronecker product."""
@@ -118,7 +237,8 @@ class Tensor(np.ndarray):
     if n == 0:
       return 1.0
 
-    t = self
+    base = np.asarray(self)
+    t = base
     for _ in range(n - 1):
-      t = np.kron(t, self)
+      t = kron(t, base)
     return self.__class__(t)
@@ -1,6 +1,7 @@
 # python3
 
 from absl.testing import absltest
+import numpy as np
 
 from src.lib import tensor
 
@@ -46,6 +47,43 @@ class TensorTest(absltest.TestCase):
     self.assertTrue(t.is_hermitian())
     self.assertFalse(t.is_unitary())
 
+  def test_validate_unitary(self):
+    u = tensor.Tensor([[0.0, 1.0], [1.0j, 0.0]])
+    t = tensor.Tensor([[1.0, 1.0], [0.0, 1.0]])
+    for policy in ['randomized', 'exact']:
+      tensor.validation_policy(policy)
+      self.assertTrue(u.validate_unitary())
+      self.assertFalse(t.validate_unitary())
+    tensor.validation_policy('off')
+    self.assertTrue(t.validate_unitary())
+    tensor.validation_policy('randomized')
+    with self.assertRaises(AssertionError):
+      tensor.validation_policy('sometimes')
+
+
+  def test_kron_out(self):
+    a = np.random.random((2, 2)) + 1j
+    b = np.random.random((4, 4))
+    out = np.empty((8, 8), dtype=np.complex128)
+    self.assertIs(tensor.kron(a, b, out=out), out)
+    self.assertTrue(np.allclose(out, np.kron(a, b)))
+    v = np.random.random(4)
+    out = np.empty(16)
+    tensor.kron(v, v, out=out)
+    self.assertTrue(np.allclose(out, np.kron(v, v)))
+
+  def test_arena(self):
+    arena = tensor.Arena()
+    buf = arena.get((4, 4))
+    self.assertEqual(buf.shape, (4, 4))
+    self.assertEqual(buf.dtype, tensor.tensor_type())
+    small = arena.get(8)
+    self.assertTrue(np.shares_memory(buf, small))
+    other = arena.get(8, slot=1)
+    self.assertFalse(np.shares_memory(small, other))
+    arena.clear()
+    self.assertEqual(arena.nbytes, 0)
+
 
 if __name__ == '__main__':
   absltest.main()
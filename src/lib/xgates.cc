@@ -13,20 +13,62 @@
 typedef std::complex<double> cmplxd;
 typedef std::complex<float> cmplxf;
 
-// apply1 applies a single gate to a state.
+// Gate kinds. The kind of a gate is determined by the structure of
+// its 2x2 matrix and selects a specialized kernel, which needs fewer
+// loads and floating point operations than the general case.
+// These values must match the KERNEL_* constants in circuit.py.
+//
+//   kGeneral:  | a b |    kReal:  | a b |  with a, b, c, d real
+//              | c d |            | c d |
+//
+//   kDiag:     | a 0 |    kAntiDiag:  | 0 b |    kPhase:  | 1 0 |
+//              | 0 d |                | c 0 |             | 0 d |
+//
+enum GateKind {
+  kGeneral = 0,
+  kReal = 1,
+  kDiag = 2,
+  kAntiDiag = 3,
+  kPhase = 4,
+};
+
+// apply_pair applies a gate of a given kind to a single pair of
+// amplitudes psi[i] and psi[i + q2].
 //
 // Gates are typically 2x2 matrices, but in this implementation they
 // are flattened to a 1x4 array:
 //   |  a  b |
 //   |  c  d |  -> | a b c d |
 //
-template <typename cmplx_type>
-void apply1(cmplx_type *psi, cmplx_type gate[4],
-            int nbits, int tgt) {
-  tgt = nbits - tgt - 1;
-  int q2 = 1 << tgt;
-  for (int g = 0; g < 1 << nbits; g += (1 << (tgt+1))) {
-    for (int i = g; i < g + q2; ++i) {
+template <typename cmplx_type, int kind>
+inline void apply_pair(cmplx_type *psi, const cmplx_type gate[4],
+                       int i, int q2) {
+  switch (kind) {
+    case kReal: {
+      // Complex times real needs 2 instead of 4 multiplications.
+      cmplx_type t1 = (gate[0].real() * psi[i] +
+                       gate[1].real() * psi[i + q2]);
+      cmplx_type t2 = (gate[2].real() * psi[i] +
+                       gate[3].real() * psi[i + q2]);
+      psi[i] = t1;
+      psi[i + q2] = t2;
+      break;
+    }
+    case kDiag:
+      psi[i] *= gate[0];
+      psi[i + q2] *= gate[3];
+      break;
+    case kAntiDiag: {
+      cmplx_type t1 = gate[1] * psi[i + q2];
+      psi[i + q2] = gate[2] * psi[i];
+      psi[i] = t1;
+      break;
+    }
+    case kPhase:
+      // Only the |1> amplitude changes, psi[i] is never touched.
+      psi[i + q2] *= gate[3];
+      break;
+    default: {
       cmplx_type t1 = gate[0] * psi[i] + gate[1] * psi[i + q2];
       cmplx_type t2 = gate[2] * psi[i] + gate[3] * psi[i + q2];
       psi[i] = t1;
@@ -35,11 +77,46 @@ void apply1(cmplx_type *psi, cmplx_type gate[4],
   }
 }
 
-// applyc applies a controlled gate to a state.
+// apply1 applies a single gate to a state.
 //
+template <typename cmplx_type, int kind>
+void apply1_kind(cmplx_type *psi, cmplx_type gate[4],
+                 int nbits, int tgt) {
+  tgt = nbits - tgt - 1;
+  int q2 = 1 << tgt;
+  for (int g = 0; g < 1 << nbits; g += (1 << (tgt+1))) {
+    for (int i = g; i < g + q2; ++i) {
+      apply_pair<cmplx_type, kind>(psi, gate, i, q2);
+    }
+  }
+}
+
 template <typename cmplx_type>
-void applyc(cmplx_type *psi, cmplx_type gate[4],
-            int nbits, int ctl, int tgt) {
+void apply1(cmplx_type *psi, cmplx_type gate[4],
+            int nbits, int tgt, int kind) {
+  switch (kind) {
+    case kReal:
+      apply1_kind<cmplx_type, kReal>(psi, gate, nbits, tgt);
+      break;
+    case kDiag:
+      apply1_kind<cmplx_type, kDiag>(psi, gate, nbits, tgt);
+      break;
+    case kAntiDiag:
+      apply1_kind<cmplx_type, kAntiDiag>(psi, gate, nbits, tgt);
+      break;
+    case kPhase:
+      apply1_kind<cmplx_type, kPhase>(psi, gate, nbits, tgt);
+      break;
+    default:
+      apply1_kind<cmplx_type, kGeneral>(psi, gate, nbits, tgt);
+  }
+}
+
+// applyc applies a controlled gate to a state.
+//
+template <typename cmplx_type, int kind>
+void applyc_kind(cmplx_type *psi, cmplx_type gate[4],
+                 int nbits, int ctl, int tgt) {
   tgt = nbits - tgt - 1;
   ctl = nbits - ctl - 1;
   int q2 = 1 << tgt;
@@ -47,21 +124,39 @@ void applyc(cmplx_type *psi, cmplx_type gate[4],
     for (int i = g; i < g + q2; ++i) {
       int idx = g * (1 << nbits) + i;
       if (idx & (1 << ctl)) {
-        cmplx_type t1 = gate[0] * psi[i] + gate[1] * psi[i + q2];
-        cmplx_type t2 = gate[2] * psi[i] + gate[3] * psi[i + q2];
-        psi[i] = t1;
-        psi[i + q2] = t2;
+        apply_pair<cmplx_type, kind>(psi, gate, i, q2);
       }
     }
   }
 }
 
+template <typename cmplx_type>
+void applyc(cmplx_type *psi, cmplx_type gate[4],
+            int nbits, int ctl, int tgt, int kind) {
+  switch (kind) {
+    case kReal:
+      applyc_kind<cmplx_type, kReal>(psi, gate, nbits, ctl, tgt);
+      break;
+    case kDiag:
+      applyc_kind<cmplx_type, kDiag>(psi, gate, nbits, ctl, tgt);
+      break;
+    case kAntiDiag:
+      applyc_kind<cmplx_type, kAntiDiag>(psi, gate, nbits, ctl, tgt);
+      break;
+    case kPhase:
+      applyc_kind<cmplx_type, kPhase>(psi, gate, nbits, ctl, tgt);
+      break;
+    default:
+      applyc_kind<cmplx_type, kGeneral>(psi, gate, nbits, ctl, tgt);
+  }
+}
+
 // ---------------------------------------------------------------
 // Python wrapper functions to call above accelerators.
 
 template <typename cmplx_type, int npy_type>
 void apply1_python(PyObject *param_psi, PyObject *param_gate,
-                   int nbits, int tgt) {
+                   int nbits, int tgt, int kind) {
   PyObject *psi_arr =
     PyArray_FROM_OTF(param_psi, npy_type, NPY_IN_ARRAY);
   cmplx_type *psi = ((cmplx_type *)PyArray_GETPTR1(psi_arr, 0));
@@ -70,7 +165,7 @@ void apply1_python(PyObject *param_psi, PyObject *param_gate,
     PyArray_FROM_OTF(param_gate, npy_type, NPY_IN_ARRAY);
   cmplx_type *gate = ((cmplx_type *)PyArray_GETPTR1(gate_arr, 0));
 
-  apply1<cmplx_type>(psi, gate, nbits, tgt);
+  apply1<cmplx_type>(psi, gate, nbits, tgt, kind);
 
   Py_DECREF(psi_arr);
   Py_DECREF(gate_arr);
@@ -82,23 +177,24 @@ static PyObject *apply1_c(PyObject *dummy, PyObject *args) {
   int nbits;
   int tgt;
   int bit_width;
+  int kind = kGeneral;
 
-  if (!PyArg_ParseTuple(args, "OOiii", &param_psi, &param_gate,
-                        &nbits, &tgt, &bit_width))
+  if (!PyArg_ParseTuple(args, "OOiii|i", &param_psi, &param_gate,
+                        &nbits, &tgt, &bit_width, &kind))
     return NULL;
   if (bit_width == 128) {
     apply1_python<cmplxd, NPY_CDOUBLE>(param_psi,
-                                       param_gate, nbits, tgt);
+                                       param_gate, nbits, tgt, kind);
   } else {
     apply1_python<cmplxf, NPY_CFLOAT>(param_psi,
-                                      param_gate, nbits, tgt);
+                                      param_gate, nbits, tgt, kind);
   }
   Py_RETURN_NONE;
 }
 
 template <typename cmplx_type, int npy_type>
 void applyc_python(PyObject *param_psi, PyObject *param_gate,
-                   int nbits, int ctl, int tgt) {
+                   int nbits, int ctl, int tgt, int kind) {
   PyObject *psi_arr =
     PyArray_FROM_OTF(param_psi, npy_type, NPY_IN_ARRAY);
   cmplx_type *psi = ((cmplx_type *)PyArray_GETPTR1(psi_arr, 0));
@@ -107,7 +203,7 @@ void applyc_python(PyObject *param_psi, PyObject *param_gate,
     PyArray_FROM_OTF(param_gate, npy_type, NPY_IN_ARRAY);
   cmplx_type *gate = ((cmplx_type *)PyArray_GETPTR1(gate_arr, 0));
 
-  applyc<cmplx_type>(psi, gate, nbits, ctl, tgt);
+  applyc<cmplx_type>(psi, gate, nbits, ctl, tgt, kind);
 
   Py_DECREF(psi_arr);
   Py_DECREF(gate_arr);
@@ -120,16 +216,17 @@ static PyObject *applyc_c(PyObject *dummy, PyObject *args) {
   int ctl;
   int tgt;
   int bit_width;
+  int kind = kGeneral;
 
-  if (!PyArg_ParseTuple(args, "OOiiii", &param_psi, &param_gate,
-                        &nbits, &ctl, &tgt, &bit_width))
+  if (!PyArg_ParseTuple(args, "OOiiii|i", &param_psi, &param_gate,
+                        &nbits, &ctl, &tgt, &bit_width, &kind))
     return NULL;
   if (bit_width == 128) {
     applyc_python<cmplxd, NPY_CDOUBLE>(param_psi,
-                                       param_gate, nbits, ctl, tgt);
+                                       param_gate, nbits, ctl, tgt, kind);
   } else {
     applyc_python<cmplxf, NPY_CFLOAT>(param_psi,
-                                      param_gate, nbits, ctl, tgt);
+                                      param_gate, nbits, ctl, tgt, kind);
   }
   Py_RETURN_NONE;
 }
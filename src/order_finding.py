@@ -236,6 +236,7 @@ def main(argv):
       if total_prob > 0.999:
         break
 
+  qc.optimize()
   print(qc.stats())
 
 
@@ -6,6 +6,7 @@ from absl import app
 import numpy as np
 import scipy.stats
 
+from src.lib import circuit
 from src.lib import helper
 from src.lib import ops
 from src.lib import state
@@ -25,13 +26,12 @@ def expo_u(psi: state.State, u: ops.Operator, t: int) -> state.State:
   # 'nbits' qubits   |       |           |
   # |u> --- U^1 --- U^2 --- U^4 ... --- U^s^(t-1)
   #
-  psi = ops.Hadamard(t)(psi)
-  for idx, inv in enumerate(range(t-1, -1, -1)):
-    u2 = u
-    for _ in range(idx):
-      u2 = u2(u2)
-    psi = ops.ControlledU(inv, t, u2)(psi, inv)
-  return psi
+  # Each controlled U^2^idx is applied directly to the target
+  # register, for the half of the state where the control qubit
+  # is |1>, see circuit.phase_estimation(). The powers of U are
+  # computed incrementally via squaring, U^2^(idx+1) = (U^2^idx)^2.
+  #
+  return circuit.phase_estimation(psi, u, t, inverse_qft=False)
 
 
 def run_experiment(nbits: int, t: int = 8):
@@ -144,13 +144,12 @@ def run_experiment_multi(nbits: int, t: int = 8):
   # match estimates and phi's is possible, but not essential for our
   # purposes here.
   #
+  # The value of 0.05 is a good guestimate for the given
+  # values of 't' and 'nbits' (derived experimentally).
+  #
   estimates = []
-  for bits in helper.bitprod(psi.nbits):
-    # The value of 0.05 is a good guestimate for the given
-    # values of 't' and 'nbits' (derived experimentally).
-    if psi.prob(*bits) < 0.05:
-      continue
-      
+  for idx in psi.nonzero(0.05):
+    bits = helper.val2bits(idx, psi.nbits)
     phi_estimate = sum(bits[i] * 2**(-i-1) for i in range(t))
     estimates.append(phi_estimate)
 
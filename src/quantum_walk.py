@@ -145,6 +145,9 @@ def simple_walk():
       print('{:5.1f} {:5.4f}'.format(float(helper.bits2val(bits)),
                                      qc.psi.ampl(*idx_bits0).real))
 
+  qc.optimize()
+  print(qc.stats())
+
 
 def main(argv):
   if len(argv) > 1:
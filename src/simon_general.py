@@ -4,6 +4,7 @@
 from absl import app
 import numpy as np
 
+from src.lib import circuit
 from src.lib import helper
 from src.lib import ops
 from src.lib import state
@@ -66,19 +67,24 @@ def make_c(nbits):
 def make_u(nbits, constant_c):
   """Make general Simon's Oracle."""
 
+  # We build the oracle as a (non-eager) circuit of Cnots and compute
+  # its matrix from the circuit. This avoids chaining dense kron and
+  # matmul products of 2^(2n) x 2^(2n) matrices.
+  #
+  qc = circuit.qc('simon_uf', eager=False)
+
   # Copy bits.
-  op = ops.Identity(nbits*2)
   for idx in range(nbits):
-    op = (ops.Identity(idx) *
-          ops.Cnot(idx, idx+nbits) *
-          ops.Identity(nbits - idx - 1)) @ op
+    qc.cx(idx, idx+nbits)
 
   # Connect the xor's controlled by the msb(x).
   for idx in range(nbits):
     if constant_c[idx] == 1:
-      op = (ops.Cnot(0, idx+nbits) * ops.Identity(nbits-idx-1)) @ op
+      qc.cx(0, idx+nbits)
+
+  op = qc.unitary_matrix()
 
-  if not op.is_unitary():
+  if not op.validate_unitary():
     raise AssertionError('Produced non-unitary Uf')
   return op
 
@@ -249,6 +249,9 @@ def sim_circuit(states, nbits, depth, target_nbits, target_depth):
                    1000000000 * duration / ngates /
                    (2 ** (nbits-1) * 16)))
 
+  # Fuse the runs of single-qubit gates, before dumping the circuit.
+  qc.optimize()
+  print(qc.stats())
   qc.dump_to_file()
 
   # To estimate simulation time of a 53-qubit circuit we make
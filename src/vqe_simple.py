@@ -41,8 +41,11 @@ from absl import app
 from absl import flags
 import numpy as np
 
+from src.lib import batch
 from src.lib import circuit
 from src.lib import ops
+from src.lib import pauli
+from src.lib import state
 
 flags.DEFINE_integer('experiments', 1000, 'Number of experiments')
 flags.DEFINE_integer('shots', 1000, 'Number of random samples')
@@ -65,15 +68,15 @@ flags.DEFINE_integer('shots', 1000, 'Number of random samples')
 # can just be measured.
 
 
-# These are the 10 angles for the ansatz. Where this ansatz specifically
+# The ansatz has 10 angles. Where this ansatz specifically
 # came from is not clear. In general, the choice of ansatz can be arbitrary.
 # Yet, some perform better than others and there seems to be a theory behind it.
 # We take the ansatz as described in the youtube video.
 #
-angles = [0.0] * 10
-
-
-def full_ansatz(qc):
+# The angles are circuit parameters. The circuit is built and compiled
+# once, for each experiment we only bind new values to the angles.
+#
+def full_ansatz(qc, angles):
   """The Ansatz circuit for this example."""
 
   qc.reg(2, 'r')
@@ -105,35 +108,33 @@ def run_two_qubit_zi_experiment():
   # Best achieved result. Goal is to get as close to +1 as possible.
   max_expect = 0.0
 
-  # Perform experiments with randomly selected angles.
-  for experiment in range(flags.FLAGS.experiments):
-    # Pick random angles.
-    for i in range(10):
-      angles[i] = random.random() * 2.0 * math.pi
-
-    # Construct and run the circuit.
-    qc = circuit.qc('vqe')
-    full_ansatz(qc)
-    qc.z(0)
-
-    # Measure the probablities as computed from the amplitudes.
-    # We only do this once per experiment.
-    p0, _ = qc.measure_bit(0, collapse=True)
-    p1, _ = qc.measure_bit(1, collapse=True)
-
-    # Simulate multiple measurements by sampling over the probabilities
-    # to obtain a distribution of sampled states. The measurements above
-    # are the probablities that a state would be found in the |0> state.
-    # For each bit, we compare this probability against another random value r.
-    # If the measured probability is < r, we pretend we've actually measured an
-    # |0> state, else a |1> state. We do this via sample_state() on both qubits.
-    #
-    num_shots = flags.FLAGS.shots
-    counts = [0] * 4
-    for _ in range(num_shots):
-      bit0 = qc.sample_state(p0)
-      bit1 = qc.sample_state(p1)
-      counts[bit1 * 2 + bit0] += 1
+  # Construct the circuit, once.
+  params = [circuit.Parameter(f'angle{i}') for i in range(10)]
+  qc = circuit.qc('vqe', eager=False)
+  full_ansatz(qc, params)
+  qc.z(0)
+
+  # Perform experiments with randomly selected angles. All experiments
+  # are simulated at once, as a batch with one state (and set of
+  # angles) per experiment.
+  experiments = flags.FLAGS.experiments
+  angles = np.array([[random.random() * 2.0 * math.pi for _ in range(10)]
+                     for _ in range(experiments)])
+  states = batch.zeros(experiments, 2)
+  states.run(qc, list(angles.T))
+
+  # Simulate multiple measurements by sampling over the probabilities
+  # as computed from the amplitudes. sample() computes the joint
+  # distribution of both qubits once and draws all shots at once.
+  # Note that measuring each qubit independently would be wrong
+  # for an entangled state. The counts are indexed by the measured
+  # bits, with qubit 0 as the most significant bit.
+  #
+  num_shots = flags.FLAGS.shots
+  all_counts = states.sample(num_shots, [0, 1])
+
+  for experiment in range(experiments):
+    counts = all_counts[experiment]
 
     # Compute the expectation value from samples measurements. Again,
     #   |00> and |01> map to Eigenvalue +1
@@ -156,50 +157,61 @@ def run_two_qubit_zi_experiment():
           counts[0], counts[1], counts[2], counts[3]))
       print('  ', end='')
       for i in range(10):
-        print('{:.1f} '.format(angles[i] / 2 / math.pi * 360), end='')
+        print('{:.1f} '.format(angles[experiment, i] / 2 / math.pi * 360),
+              end='')
       print()
 
 
-def single_qubit_ansatz(theta: float, phi: float) -> circuit.qc:
-  """Generate a single qubit ansatz."""
+def single_qubit_ansatz(theta: circuit.Parameter,
+                        phi: circuit.Parameter) -> circuit.qc:
+  """Generate a single qubit ansatz, run it after binding theta, phi."""
 
-  qc = circuit.qc('single-qubit ansatz Y')
+  qc = circuit.qc('single-qubit ansatz Y', eager=False)
   qc.qubit(1.0)
   qc.rx(0, theta)
   qc.ry(0, phi)
   return qc
 
 
+def grid(theta_range: range, theta_scale: float,
+         phi_range: range, phi_scale: float):
+  """All pairs of angles theta, phi (in steps of degrees)."""
+
+  theta, phi = np.meshgrid(np.pi * np.array(theta_range) / theta_scale,
+                           np.pi * np.array(phi_range) / phi_scale,
+                           indexing='ij')
+  return theta.reshape(-1), phi.reshape(-1)
+
+
 def run_single_qubit_mult():
   """Run experiments with single qubits."""
 
   # Construct Hamiltonian.
-  hamil = (random.random() * ops.PauliX() +
-           random.random() * ops.PauliY() +
-           random.random() * ops.PauliZ())
+  hamil = pauli.PauliSum([(random.random(), 'X'),
+                          (random.random(), 'Y'),
+                          (random.random(), 'Z')])
   # Compute known minimum eigenvalue.
-  eigvals = np.linalg.eigvalsh(hamil)
+  eigvals = np.linalg.eigvalsh(hamil.matrix())
 
-  # Brute force over the Bloch sphere.
-  min_val = 1000.0
-  for i in range(0, 180, 10):
-    for j in range(0, 180, 10):
-      theta = np.pi * i / 180.0
-      phi = np.pi * j / 180.0
+  # Build the ansatz with two rotation gates, once.
+  ansatz = single_qubit_ansatz(circuit.Parameter('theta'),
+                               circuit.Parameter('phi'))
 
-      # Build the ansatz with two rotation gates.
-      ansatz = single_qubit_ansatz(theta, phi)
+  # Brute force over the Bloch sphere. All points of the grid are
+  # simulated at once, as a batch.
+  theta, phi = grid(range(0, 180, 10), 180.0, range(0, 180, 10), 180.0)
+  states = batch.zeros(theta.shape[0], 1)
+  states.run(ansatz, [theta, phi])
 
-      # Compute <psi ! H ! psi>. Find smallest one, which will be
-      # the best approximation to the minimum eigenvalue from above.
-      # In this version, we just multiply out the result.
-      psi = np.dot(ansatz.psi.adjoint(), hamil(ansatz.psi))
-      if psi < min_val:
-        min_val = psi
+  # Compute <psi ! H ! psi>. Find smallest one, which will be
+  # the best approximation to the minimum eigenvalue from above.
+  # In this version, we compute the expectation value directly
+  # on the state vectors, term by term, without building a matrix.
+  min_val = states.expectation(hamil).min()
 
   # Result from brute force approach:
   print('Minimum: {:.4f}, Estimated: {:.4f}, Delta: {:.4f}'.format(
-      eigvals[0], np.real(min_val), np.real(min_val - eigvals[0])))
+      eigvals[0], min_val, min_val - eigvals[0]))
 
 
 def run_single_qubit_measure():
@@ -214,36 +226,86 @@ def run_single_qubit_measure():
   # Compute known minimum eigenvalue.
   eigvals = np.linalg.eigvalsh(hamil)
 
-  min_val = 1000.0
-  for i in range(0, 360, 5):
-    for j in range(0, 180, 5):
-
-      theta = np.pi * i / 360.0
-      phi = np.pi * j / 180.0
+  # Build the ansatz, with a change of basis, for each Pauli term.
+  theta = circuit.Parameter('theta')
+  phi = circuit.Parameter('phi')
 
-      # X Basis
-      qc = single_qubit_ansatz(theta, phi)
-      qc.h(0)
-      val_a = a * qc.pauli_expectation(0)
+  # X Basis
+  qc_x = single_qubit_ansatz(theta, phi)
+  qc_x.h(0)
 
-      # Y Basis
-      qc = single_qubit_ansatz(theta, phi)
-      qc.sdag(0)
-      qc.h(0)
-      val_b = b * qc.pauli_expectation(0)
+  # Y Basis
+  qc_y = single_qubit_ansatz(theta, phi)
+  qc_y.sdag(0)
+  qc_y.h(0)
 
-      # Z Basis
-      qc = single_qubit_ansatz(theta, phi)
-      val_c = c * qc.pauli_expectation(0)
+  # Z Basis
+  qc_z = single_qubit_ansatz(theta, phi)
 
-      expectation = val_a + val_b + val_c
-      if expectation < min_val:
-        min_val = expectation
+  # Run each circuit once, on a batch over the grid of angles.
+  thetas, phis = grid(range(0, 360, 5), 360.0, range(0, 180, 5), 180.0)
+  expectation = 0.0
+  for coeff, qc in [(a, qc_x), (b, qc_y), (c, qc_z)]:
+    states = batch.zeros(thetas.shape[0], 1)
+    states.run(qc, {theta: thetas, phi: phis})
+    expectation = expectation + coeff * states.pauli_expectation(0)
+  min_val = expectation.min()
 
   print('Minimum eigenvalue: {:.3f}, Delta: {:.3f}'
         .format(eigvals[0], min_val - eigvals[0]))
 
 
+# Instead of a random or grid search, we can minimize the expectation
+# value with gradient descent. The gradient by all angles is computed
+# with the adjoint method (see qc.gradient()), which costs about as
+# much as 3 simulations of the circuit, instead of 2 simulations per
+# angle for finite differences.
+#
+def gradient_descent(qc: circuit.qc, hamil: pauli.PauliSum,
+                     learning_rate: float = 0.2, steps: int = 500):
+  """Minimize <H> over the parameters of qc, from random angles."""
+
+  angles = np.random.uniform(0, 2 * math.pi, len(qc.parameters))
+  for step in range(steps):
+    qc.bind(angles)
+    grads = qc.gradient(hamil)
+    if np.linalg.norm(grads) < 1e-4:
+      break
+    angles -= learning_rate * grads
+
+  psi = state.zeros(qc.nbits)
+  qc.compile().run(psi)
+  return hamil.expectation(psi), step
+
+
+def run_single_qubit_gradient():
+  """Find the minimum eigenvalue with gradient descent."""
+
+  hamil = pauli.PauliSum([(random.random(), 'X'),
+                          (random.random(), 'Y'),
+                          (random.random(), 'Z')])
+  eigvals = np.linalg.eigvalsh(hamil.matrix())
+
+  ansatz = single_qubit_ansatz(circuit.Parameter('theta'),
+                               circuit.Parameter('phi'))
+  min_val, steps = gradient_descent(ansatz, hamil)
+  print('Minimum: {:.4f}, Gradient descent: {:.4f}, Delta: {:.4f}, '
+        'Steps: {}'.format(eigvals[0], min_val, min_val - eigvals[0], steps))
+
+
+def run_two_qubit_zi_gradient():
+  """Maximize <Z x I> for the full ansatz with gradient descent."""
+
+  params = [circuit.Parameter(f'angle{i}') for i in range(10)]
+  qc = circuit.qc('vqe', eager=False)
+  full_ansatz(qc, params)
+
+  # Maximizing <Z x I> means minimizing <-Z x I>.
+  max_val, steps = gradient_descent(qc, pauli.PauliSum([(-1.0, 'ZI')]))
+  print('Max expectation of H with gradient descent: {:.4f} '
+        '(target: 1.0), Steps: {}'.format(-max_val, steps))
+
+
 def main(argv):
   if len(argv) > 1:
     raise app.UsageError('Too many command-line arguments.')
@@ -253,6 +315,9 @@ def main(argv):
   for i in range(5):
     run_single_qubit_mult()
   run_two_qubit_zi_experiment()
+  for i in range(5):
+    run_single_qubit_gradient()
+  run_two_qubit_zi_gradient()
 
 
 if __name__ == '__main__':
@@ -56,6 +56,8 @@ def zy_decompose(umat):
     gamma = 2 * np.arcsin(abs(b))
 
   # TODO(rhundt): Handle cases with gamma very close to 0 or Pi
+  #               (ops.ZYDecompose handles these, for any U in U(2),
+  #               the optimizer uses it to resynthesize fused gates).
 
   beta = cmath.phase(c) - cmath.phase(a)
   delta = cmath.phase(-b) - cmath.phase(a)
@@ -93,6 +95,12 @@ def main(argv):
       print(f'decomp : {i:2d}: {alpha:.3f} {beta:.3f} {gamma:.3f} {delta:.3f}')
       raise AssertionError('Z-Y decomposition failed')
 
+    #
+    # The library version works for the unmodified u as well.
+    #
+    if not np.allclose(u, make_u(*ops.ZYDecompose(u)), atol=1e-4):
+      raise AssertionError('ops.ZYDecompose failed')
+
   print('Success')
 
 